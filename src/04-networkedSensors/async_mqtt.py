@@ -0,0 +1,297 @@
+"""
+    --------------------------------------------------------------------------------------
+    async_mqtt.py
+    --------------------------------------------------------------------------------------
+    A small asyncio MQTT 3.1.1 client, for programs that need to keep doing other work
+    (such as taking sensor readings) while they talk to the broker.
+
+    Unlike umqtt, nothing blocks: publish() and subscribe() are coroutines that only
+    hold up the task that called them, incoming messages are handed to the callback
+    by a reader task as soon as they arrive instead of when check_msg() gets called,
+    and a keepalive task pings the broker and notices when the connection has died.
+
+    QoS 0 and 1 are supported for publishing.  publish() with qos=1 returns once the
+    broker has acknowledged the message, and raises OSError if it doesn't within
+    `timeout` seconds.  Messages are not resent by the client; keep them somewhere
+    (e.g. outbox.py) until publish() returns if they mustn't be lost.  Messages
+    received with QoS 2 go through the PUBREC / PUBREL / PUBCOMP exchange, and are
+    handed to the callback once even if the broker sends them again.
+
+    The client only depends on asyncio, so it runs on MicroPython (uasyncio) and on
+    CPython.
+
+    Example:
+        import async_mqtt
+
+        def received(topic, msg):
+            print(topic, bytes(msg))
+
+        async def main():
+            client = async_mqtt.MQTTClient('node1', 'broker.local')
+            client.set_callback(received)
+            await client.connect()
+            await client.subscribe('sensors/#')
+            await client.publish('sensors/hello', b'hi', qos=1)
+            await client.wait_closed()
+
+        async_mqtt.asyncio.run(main())
+    --------------------------------------------------------------------------------------
+"""
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+PUBREC = 0x50
+PUBREL = 0x60
+PUBCOMP = 0x70
+SUBSCRIBE = 0x82
+SUBACK = 0x90
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+
+def _string(s):
+    if isinstance(s, str):
+        s = s.encode()
+    return bytes((len(s) >> 8, len(s) & 0xFF)) + s
+
+
+def _header(packet_type, length):
+    header = bytearray((packet_type,))
+    while True:
+        b = length & 0x7F
+        length >>= 7
+        if length:
+            header.append(b | 0x80)
+        else:
+            header.append(b)
+            return header
+
+
+class MQTTClient:
+    def __init__(self, client_id, server, port=1883, user=None, password=None, keepalive=60, timeout=10):
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.user = user
+        self.password = password
+        self.keepalive = keepalive
+        self.timeout = timeout
+
+        self.callback = None
+        self.reader = None
+        self.writer = None
+        self.connected = False
+        self.lock = asyncio.Lock()
+        self.closed = asyncio.Event()
+        self.tasks = ()
+
+        self.pid = 0
+        # Events of the packets waiting for a PUBACK or SUBACK, by packet id
+        self.waiting = {}
+        self.sent = False
+        self.received = False
+        # Ids of the QoS 2 messages received and not released by the broker yet
+        self.unreleased = set()
+
+    def set_callback(self, callback):
+        """
+        callback(topic, msg) is called with each message received, with the topic as
+        bytes and the payload as a memoryview of the received packet, so it isn't
+        copied. topic_router.Router.dispatch can be used as the callback.
+        """
+        self.callback = callback
+
+    async def connect(self, clean_session=True):
+        """Connects to the broker. Raises OSError if it fails."""
+        # The reader and keepalive tasks of the last connection mustn't outlive it
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = ()
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.server, self.port), self.timeout)
+        except asyncio.TimeoutError:
+            raise OSError('no connection to the broker')
+
+        flags = 0x02 if clean_session else 0
+        payload = _string(self.client_id)
+        if self.user is not None:
+            flags |= 0x80
+            payload += _string(self.user)
+            if self.password is not None:
+                flags |= 0x40
+                payload += _string(self.password)
+        variable = b'\x00\x04MQTT\x04' + bytes((flags, self.keepalive >> 8, self.keepalive & 0xFF))
+
+        self.connected = True
+        self.closed = asyncio.Event()
+        try:
+            await self._send(_header(CONNECT, len(variable) + len(payload)), variable, payload)
+            packet = await asyncio.wait_for(self.reader.readexactly(4), self.timeout)
+        except (OSError, EOFError, asyncio.TimeoutError):
+            await self._lost()
+            raise OSError('no CONNACK from the broker')
+        if packet[0] != CONNACK or packet[3] != 0:
+            await self._lost()
+            raise OSError('connection refused ({})'.format(packet[3]))
+
+        if clean_session:
+            self.unreleased.clear()
+        self.tasks = (asyncio.create_task(self._read()), asyncio.create_task(self._ping()))
+
+    async def publish(self, topic, msg, qos=0, retain=False):
+        if qos not in (0, 1):
+            raise ValueError('QoS {} is not supported for publishing'.format(qos))
+        if isinstance(msg, str):
+            msg = msg.encode()
+        topic = _string(topic)
+        if qos:
+            pid = self._next_pid()
+            event = self.waiting[pid] = asyncio.Event()
+            variable = topic + bytes((pid >> 8, pid & 0xFF))
+        else:
+            variable = topic
+        header = _header(PUBLISH | (qos << 1) | retain, len(variable) + len(msg))
+
+        await self._send(header, variable, msg)
+        if qos:
+            await self._acknowledged(pid, event)
+
+    async def subscribe(self, topic, qos=0):
+        pid = self._next_pid()
+        event = self.waiting[pid] = asyncio.Event()
+        variable = bytes((pid >> 8, pid & 0xFF)) + _string(topic) + bytes((qos,))
+        await self._send(_header(SUBSCRIBE, len(variable)), variable)
+        await self._acknowledged(pid, event)
+
+    async def disconnect(self):
+        if self.connected:
+            try:
+                await self._send(bytes((DISCONNECT, 0)))
+            except OSError:
+                pass
+        await self._lost()
+
+    async def wait_closed(self):
+        """Waits until the connection is closed or lost."""
+        await self.closed.wait()
+
+    def _next_pid(self):
+        self.pid = self.pid % 0xFFFF + 1
+        return self.pid
+
+    async def _acknowledged(self, pid, event):
+        try:
+            await asyncio.wait_for(event.wait(), self.timeout)
+        except asyncio.TimeoutError:
+            raise OSError('no acknowledgement from the broker')
+        finally:
+            self.waiting.pop(pid, None)
+        if not self.connected:
+            raise OSError('connection lost')
+
+    async def _send(self, *parts):
+        # Packets written by different tasks mustn't be interleaved
+        async with self.lock:
+            writer = self.writer
+            if writer is None:
+                raise OSError('not connected')
+            for part in parts:
+                writer.write(part)
+            await writer.drain()
+        self.sent = True
+
+    async def _read(self):
+        reader = self.reader
+        try:
+            while True:
+                packet_type = (await reader.readexactly(1))[0]
+                length = 0
+                shift = 0
+                while True:
+                    b = (await reader.readexactly(1))[0]
+                    length |= (b & 0x7F) << shift
+                    if b < 0x80:
+                        break
+                    shift += 7
+                data = await reader.readexactly(length) if length else b''
+                self.received = True
+
+                kind = packet_type & 0xF0
+                if kind == PUBLISH:
+                    qos = (packet_type >> 1) & 0x03
+                    end = 2 + ((data[0] << 8) | data[1])
+                    topic = data[2:end]
+                    deliver = True
+                    if qos == 1:
+                        await self._send(bytes((PUBACK, 2, data[end], data[end + 1])))
+                        end += 2
+                    elif qos == 2:
+                        # Delivered when first received, and only acknowledged
+                        # again when sent again before its PUBREL
+                        pid = (data[end] << 8) | data[end + 1]
+                        deliver = pid not in self.unreleased
+                        self.unreleased.add(pid)
+                        await self._send(bytes((PUBREC, 2, data[end], data[end + 1])))
+                        end += 2
+                    if deliver and self.callback:
+                        self.callback(topic, memoryview(data)[end:])
+                elif kind == PUBREL:
+                    self.unreleased.discard((data[0] << 8) | data[1])
+                    await self._send(bytes((PUBCOMP, 2, data[0], data[1])))
+                elif kind == PUBACK or kind == SUBACK:
+                    event = self.waiting.get((data[0] << 8) | data[1])
+                    if event:
+                        event.set()
+        except (OSError, EOFError):
+            pass
+        await self._lost()
+
+    async def _ping(self):
+        # Ping when nothing was sent (the broker drops idle clients) or received
+        # (the connection may be dead) for half the keepalive time, and give up
+        # when not even the ping was answered.
+        silent = 0
+        while self.connected:
+            self.sent = False
+            self.received = False
+            await asyncio.sleep(self.keepalive / 2)
+            if not self.connected:
+                return
+            if self.received:
+                silent = 0
+            else:
+                silent += 1
+                if silent > 1:
+                    await self._lost()
+                    return
+            if not (self.sent and self.received):
+                try:
+                    await self._send(bytes((PINGREQ, 0)))
+                except OSError:
+                    await self._lost()
+                    return
+
+    async def _lost(self):
+        if self.writer is None:
+            return
+        writer = self.writer
+        self.writer = None
+        self.connected = False
+        # Wake up everything that is waiting for an acknowledgement, so it can fail
+        for event in self.waiting.values():
+            event.set()
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except OSError:
+            pass
+        self.closed.set()
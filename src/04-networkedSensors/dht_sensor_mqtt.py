@@ -5,73 +5,173 @@
     Demonstrates how to connect to a remote MQTT message broker, and send temperature
     and humidity readings to a queue.
 
+    Readings are queued in an outbox (outbox.py) and published from there, so the
+    readings taken while the network or the broker are down are sent once the
+    connection is back, instead of being lost.  The connection is retried every
+    RECONNECT_INTERVAL_SECONDS.
+
+    Taking readings and publishing them are separate asyncio tasks, and the MQTT
+    client (async_mqtt.py) never blocks, so a slow network or broker doesn't delay
+    the readings.
+
+    Set BATCH_READINGS to publish readings in batches (sensor_batch.py) instead of one
+    JSON message per reading.  A batch is published once it holds BATCH_READINGS
+    readings or its first reading is BATCH_SECONDS old, as a compact binary message
+    on BATCH_TOPIC, which collector/batch_decoder.py decodes.
+
+    Batched readings carry the time they were taken, so the board's clock is set
+    with NTP (ntptime) at start up.  Joining the Wi-Fi network and NTP block, so
+    both are done before the tasks start; after that the board rejoins the network
+    by itself, and only the broker connection is retried.  Readings taken before the
+    clock was set are stamped from 2000-01-01; the collector moves those batches to
+    the time it received them.
+
     Author:  David Alexis (2020)
     --------------------------------------------------------------------------------------
 """
 
 from machine import Pin
-import time
 import dht
-from umqtt.robust import MQTTClient
 import ujson
 import secrets
+import outbox
+import sensor_batch
+import async_mqtt
+from async_mqtt import asyncio
 
 SENSOR_PIN = 5  # Change SENSOR_PIN to match the actual pin the sensor is connected to
 TOPIC = 'sensors/environmental'
 LOCATION = 'living room'  # Change to describe your device location
 READING_INTERVAL_SECONDS = 5
-
-
-def connect():
+RECONNECT_INTERVAL_SECONDS = 30
+QOS = 1  # With QoS 1, readings stay in the outbox until the broker acknowledges them
+DRAIN_LIMIT = 20  # Most queued messages to send before letting other tasks run
+BATCH_READINGS = 0  # Readings per batch, or 0 to publish each reading on its own
+BATCH_SECONDS = 60  # Publish a batch when its first reading is this old, even if not full
+BATCH_TOPIC = 'sensors/environmental/batch'
+
+
+def sync_clock():
+    """Sets the clock from an NTP server, so readings are stamped with the real time."""
+    import ntptime
+    try:
+        ntptime.settime()
+    except (OSError, OverflowError):
+        # No answer, or a bad one; the clock keeps running from where it was
+        print("Could not set the clock")
+
+
+def connect_to_network():
+    """Joins the Wi-Fi network and sets the clock. Blocks, so call it before the tasks start."""
     import networkUtils
     print("Connecting to network")
     networkUtils.connect_to_network(secrets.wifi_network, secrets.wifi_password, hostname=secrets.mqtt_device_id)
 
+    # The clock of the board isn't set at power up
+    sync_clock()
+
+
+async def connect():
     print("Connecting to MQTT broker")
-    client = MQTTClient(client_id=secrets.mqtt_device_id,
-                        server=secrets.mqtt_server,
-                        user=secrets.mqtt_user,
-                        password=secrets.mqtt_password,
-                        ssl=False)
-    client.connect()
+    client = async_mqtt.MQTTClient(client_id=secrets.mqtt_device_id,
+                                   server=secrets.mqtt_server,
+                                   user=secrets.mqtt_user,
+                                   password=secrets.mqtt_password)
+    await client.connect()
 
     print("Connected")
 
     return client
 
 
-def main():
-    pin = Pin(SENSOR_PIN, Pin.IN, Pin.PULL_UP)
-    sensor = dht.DHT22(pin)
-
-    mqttClient = connect()
-
+async def sample(sensor, box, queued, batch):
+    """Takes a reading every READING_INTERVAL_SECONDS, and queues it in the outbox."""
     while True:
         try:
             sensor.measure()
             temperature = round((sensor.temperature() * 1.8) + 32, 2)
             humidity = sensor.humidity()
 
-            reading = {
-                "device": secrets.mqtt_device_id,
-                "location": LOCATION,
-                "temperature_F": temperature,
-                "humidity": humidity
-            }
+            if batch:
+                print(temperature, humidity)
+                batch.add(temperature, humidity)
+            else:
+                reading = {
+                    "device": secrets.mqtt_device_id,
+                    "location": LOCATION,
+                    "temperature_F": temperature,
+                    "humidity": humidity
+                }
+
+                print(reading)
+                box.put(ujson.dumps(reading))
+                queued.set()
+        except OSError:
+            print('Failed to read the sensor')
+
+        if batch and batch.ready():
+            box.put(batch.encode())
+            queued.set()
+
+        # Wait at least 2 seconds before next reading, since the DHT sensor can only
+        # be read once every 2 seconds
+        await asyncio.sleep(READING_INTERVAL_SECONDS)
 
-            print(reading)
 
-            mqttClient.publish(TOPIC, ujson.dumps(reading), qos=0)
+async def publish(box, queued, topic):
+    """Publishes the readings in the outbox, (re)connecting whenever needed."""
+    client = None
+    while True:
+        if client is None or not client.connected:
+            try:
+                client = await connect()
+            except OSError:
+                print('Not connected, {} messages queued'.format(box.stats[0] - box.stats[1] - box.stats[3]))
+                client = None
+                await asyncio.sleep(RECONNECT_INTERVAL_SECONDS)
+                continue
 
-            # Wait at least 2 seconds before next reading, since the DHT sensor can only
-            # be read once every 2 seconds
-            time.sleep(READING_INTERVAL_SECONDS)
-        except KeyboardInterrupt:
-            print('Bye')
-            mqttClient.disconnect()
-            break
+        try:
+            await box.drain_async(client, topic, qos=QOS, limit=DRAIN_LIMIT)
         except OSError:
-            mqttClient = connect()
+            print('Connection lost')
+            await client.disconnect()
+            continue
+
+        if box.pending():
+            # Let the other tasks run before sending the next messages
+            await asyncio.sleep(0)
+        else:
+            await queued.wait()
+            queued.clear()
+
+
+def main():
+    pin = Pin(SENSOR_PIN, Pin.IN, Pin.PULL_UP)
+    sensor = dht.DHT22(pin)
+
+    box = outbox.Outbox('outbox.log')
+    topic = TOPIC
+    batch = None
+    if BATCH_READINGS:
+        topic = BATCH_TOPIC
+        batch = sensor_batch.Batch(secrets.mqtt_device_id, LOCATION,
+                                   (('temperature_F', 2), ('humidity', 1)),
+                                   max_readings=BATCH_READINGS, max_seconds=BATCH_SECONDS)
+
+    # Set by the sampling task whenever there is something new to publish
+    queued = asyncio.Event()
+
+    connect_to_network()
+
+    async def run():
+        asyncio.create_task(sample(sensor, box, queued, batch))
+        await publish(box, queued, topic)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print('Bye')
 
 
 # ------- Main program execution starts here --------
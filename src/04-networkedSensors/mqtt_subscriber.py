@@ -5,14 +5,21 @@
     Demonstrates how to subscribe to an MQTT topic. It listens to the sensors topic to
     which the dht_sensor_mqtt.py program publishes.
 
+    The asyncio MQTT client (async_mqtt.py) hands each message to the router
+    (topic_router.py) as soon as it arrives, instead of polling for messages, and the
+    router calls the handlers of the topic filters that match the message's topic.
+    Messages that none of them match, such as ones on deeper topics, are passed to
+    other_handler instead of being dropped.
+
     Author:  David Alexis (2020)
     --------------------------------------------------------------------------------------
 """
 
-import time
 import machine
 import ubinascii
-from umqtt.robust import MQTTClient
+import async_mqtt
+from async_mqtt import asyncio
+import topic_router
 import secrets
 
 
@@ -26,38 +33,72 @@ topic = 'sensors/#'
 client_id = ubinascii.hexlify(machine.unique_id()).decode('utf-8')
 print("My client ID is {}".format(client_id))
 
+RECONNECT_INTERVAL_SECONDS = 5
+
+
+def reading_handler(topic, msg):
+    print(topic.decode('utf-8'), " :: ", bytes(msg).decode('utf-8'))
+
+
+def batch_handler(topic, msg):
+    # Batches of readings (see sensor_batch.py) are binary, and can't be printed as text
+    print(topic.decode('utf-8'), " :: ", "batch of {} bytes".format(len(msg)))
+
+
+def other_handler(topic, msg):
+    # Any other topic under 'sensors/#'; the payload may not be text
+    print(topic.decode('utf-8'), " :: ", bytes(msg))
+
 
-def subscription_handler(topic, msg):
-    print(topic.decode('utf-8'), " :: ", msg.decode('utf-8'))
+# Sends each message to the handlers for its topic
+router = topic_router.Router()
+router.add('sensors/+', reading_handler)
+router.add('sensors/+/batch', batch_handler)
 
 
-def connect():
+def dispatch(topic, msg):
+    if not router.dispatch(topic, msg):
+        other_handler(topic, msg)
+
+
+async def connect():
     import networkUtils
     print("Connecting to network")
     networkUtils.connect_to_network(secrets.wifi_network, secrets.wifi_password)
 
     print("Connecting to MQTT broker")
-    client = MQTTClient(client_id=client_id,
-                        server=secrets.mqtt_server,
-                        user=secrets.mqtt_user,
-                        password=secrets.mqtt_password,
-                        ssl=False)
-    client.set_callback(subscription_handler)
-    client.connect()
-    client.subscribe(topic)
+    client = async_mqtt.MQTTClient(client_id=client_id,
+                                   server=secrets.mqtt_server,
+                                   user=secrets.mqtt_user,
+                                   password=secrets.mqtt_password)
+    client.set_callback(dispatch)
+    await client.connect()
+    subscribed = False
+    try:
+        await client.subscribe(topic)
+        subscribed = True
+    finally:
+        # Don't leave a connection open that nobody waits on
+        if not subscribed:
+            await client.disconnect()
 
     print("Connected")
 
     return client
 
 
-# ------ Main script execution starts here ------
+async def main():
+    while True:
+        try:
+            client = await connect()
+            # Messages are handled by the client's own task until the connection drops
+            await client.wait_closed()
+            print("Connection lost")
+        except OSError as e:
+            print("Failed to connect: {}".format(e))
+        await asyncio.sleep(RECONNECT_INTERVAL_SECONDS)
 
-client = connect()
 
-while True:
-    try:
-        client.check_msg()
-        time.sleep(.1)
-    except OSError:
-        client = connect()
+# ------ Main script execution starts here ------
+
+asyncio.run(main())
@@ -0,0 +1,216 @@
+"""
+    --------------------------------------------------------------------------------------
+    outbox.py
+    --------------------------------------------------------------------------------------
+    A store-and-forward outbox for MQTT messages, so readings taken while the Wi-Fi or
+    the broker are unreachable are sent later instead of being lost.
+
+    Messages are queued in a small ring buffer in RAM.  When it fills up (e.g. while
+    the board roams to another access point), new messages are appended to a log file
+    on flash or an SD card instead, which also survives a reset.  drain() publishes
+    the queued messages in the order they were queued, at most `limit` per call, so
+    catching up after an outage never stops the program from taking readings.  A
+    message only leaves the outbox once publish() has returned, which with QoS 1 means
+    the broker has acknowledged it.
+
+    The position reached in the log is saved every few messages, so after a reset a
+    few messages may be sent twice, but none are lost.  Messages still in the RAM
+    buffer are lost on a reset, so keep ram_slots small if that matters.
+
+    At most `max_log_bytes` of unsent messages are kept in the log; new messages are
+    dropped while it is full.  Once the sent part at the start of the log is half
+    that size and larger than the rest, the rest is copied to a new log, so the
+    file doesn't keep growing while the outbox is never quite empty.
+
+    Example:
+        import outbox
+        box = outbox.Outbox('outbox.log')
+        box.put(ujson.dumps(reading))
+        ...
+        box.drain(client, 'sensors/environmental', qos=1)
+    --------------------------------------------------------------------------------------
+"""
+
+import os
+
+
+class Outbox:
+    def __init__(self, path, ram_slots=16, max_log_bytes=256 * 1024, sync_every=8):
+        self.path = path
+        self.pos_path = path + '.pos'
+        self.tmp_path = path + '.tmp'
+        self.max_log_bytes = max_log_bytes
+        self.sync_every = sync_every
+
+        self.ram = [None] * ram_slots
+        self.head = 0
+        self.count = 0
+
+        self.header = bytearray(2)
+        # The next message in the log, once it has been read, and its size in the log
+        self.next = None
+        self.next_size = 0
+        self.unsaved = 0
+
+        # messages queued, sent, written to the log and dropped because the log was full
+        self.stats = [0, 0, 0, 0]
+
+        # Pick up messages left in the log before a reset, or in the new log if
+        # the reset came in the middle of compacting
+        try:
+            self.log_size = os.stat(path)[6]
+        except OSError:
+            self.log_size = 0
+            try:
+                os.rename(self.tmp_path, path)
+                self.log_size = os.stat(path)[6]
+                # The saved position, if still there, was in the old log
+                os.remove(self.pos_path)
+            except OSError:
+                pass
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+        try:
+            with open(self.pos_path, 'r') as f:
+                self.log_pos = int(f.read())
+        except (OSError, ValueError):
+            self.log_pos = 0
+        if self.log_pos >= self.log_size:
+            self._clear_log()
+
+    def __len__(self):
+        """The number of messages in RAM. Messages in the log aren't counted."""
+        return self.count
+
+    def pending(self):
+        return self.count > 0 or self.log_pos < self.log_size
+
+    def put(self, msg):
+        """Queues msg (bytes or str) to be published."""
+        if isinstance(msg, str):
+            msg = msg.encode()
+        self.stats[0] += 1
+
+        # Messages only go to RAM while the log is empty, to keep them in order
+        if self.log_pos >= self.log_size and self.count < len(self.ram):
+            self.ram[(self.head + self.count) % len(self.ram)] = msg
+            self.count += 1
+            return
+
+        if self.log_size - self.log_pos + 2 + len(msg) > self.max_log_bytes:
+            self.stats[3] += 1
+            return
+
+        header = self.header
+        header[0] = len(msg) >> 8
+        header[1] = len(msg) & 0xFF
+        with open(self.path, 'ab') as f:
+            f.write(header)
+            f.write(msg)
+        self.log_size += 2 + len(msg)
+        self.stats[2] += 1
+
+    def peek(self):
+        """Returns the oldest queued message without removing it, or None."""
+        if self.count:
+            return self.ram[self.head]
+        if self.log_pos >= self.log_size:
+            return None
+
+        if self.next is None:
+            with open(self.path, 'rb') as f:
+                f.seek(self.log_pos)
+                f.readinto(self.header)
+                size = (self.header[0] << 8) | self.header[1]
+                self.next = f.read(size)
+            self.next_size = 2 + size
+        return self.next
+
+    def remove(self):
+        """Removes the oldest queued message, once it has been sent."""
+        if self.count:
+            self.ram[self.head] = None
+            self.head = (self.head + 1) % len(self.ram)
+            self.count -= 1
+            return
+
+        self.log_pos += self.next_size
+        self.next = None
+        if self.log_pos >= self.log_size:
+            self._clear_log()
+            return
+        if self.log_pos >= self.max_log_bytes // 2 and self.log_pos >= self.log_size - self.log_pos:
+            self._compact()
+            return
+
+        self.unsaved += 1
+        if self.unsaved >= self.sync_every:
+            with open(self.pos_path, 'w') as f:
+                f.write(str(self.log_pos))
+            self.unsaved = 0
+
+    def drain(self, client, topic, qos=1, limit=10):
+        """
+        Publishes up to limit queued messages to topic with the MQTT client, oldest
+        first, and returns how many were sent. Errors from publish() are raised, and
+        the message that failed stays queued.
+        """
+        sent = 0
+        while sent < limit:
+            msg = self.peek()
+            if msg is None:
+                break
+            client.publish(topic, msg, qos=qos)
+            self.remove()
+            self.stats[1] += 1
+            sent += 1
+        return sent
+
+    async def drain_async(self, client, topic, qos=1, limit=10):
+        """drain() for clients whose publish() is a coroutine, such as async_mqtt."""
+        sent = 0
+        while sent < limit:
+            msg = self.peek()
+            if msg is None:
+                break
+            await client.publish(topic, msg, qos=qos)
+            self.remove()
+            self.stats[1] += 1
+            sent += 1
+        return sent
+
+    def _compact(self):
+        # Copies the unsent messages to a new log. The old log is removed before
+        # the saved position, and the new one only takes its name after both, so
+        # a reset at any point leaves either the old log with its position, or
+        # the new log (maybe still under tmp_path) with none.
+        buf = bytearray(256)
+        with open(self.path, 'rb') as src, open(self.tmp_path, 'wb') as dst:
+            src.seek(self.log_pos)
+            while True:
+                n = src.readinto(buf)
+                if not n:
+                    break
+                dst.write(buf if n == len(buf) else memoryview(buf)[:n])
+        os.remove(self.path)
+        try:
+            os.remove(self.pos_path)
+        except OSError:
+            pass
+        os.rename(self.tmp_path, self.path)
+        self.log_size -= self.log_pos
+        self.log_pos = 0
+        self.unsaved = 0
+
+    def _clear_log(self):
+        for path in (self.path, self.pos_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.log_size = 0
+        self.log_pos = 0
+        self.next = None
+        self.unsaved = 0
@@ -0,0 +1,199 @@
+"""
+Checks outbox.py against a fake MQTT client whose connection goes up and down and
+whose publishes fail at random, with resets of the board in between: messages
+must be delivered in the order they were queued, and only the ones in RAM at a
+reset may be lost.
+"""
+
+import asyncio
+import os
+import random
+
+import outbox
+
+
+class FakeClient:
+    def __init__(self, rnd, failures=0.1):
+        self.rnd = rnd
+        self.failures = failures
+        self.connected = True
+        self.received = []
+
+    def publish(self, topic, msg, qos=0):
+        if not self.connected or self.rnd.random() < self.failures:
+            raise OSError('publish failed')
+        self.received.append(bytes(msg))
+
+
+class AsyncClient(FakeClient):
+    async def publish(self, topic, msg, qos=0):
+        await asyncio.sleep(0)
+        FakeClient.publish(self, topic, msg, qos)
+
+
+def _catch_up(box, client):
+    client.connected = True
+    client.failures = 0
+    while box.pending():
+        box.drain(client, 'sensors/test', limit=50)
+
+
+def test_order_across_outages(tmp_path):
+    rnd = random.Random(1)
+    box = outbox.Outbox(str(tmp_path / 'outbox.log'), ram_slots=4, sync_every=3)
+    client = FakeClient(rnd)
+    for n in range(3000):
+        box.put('m%d' % n)
+        if rnd.random() < 0.01:
+            client.connected = not client.connected
+        try:
+            box.drain(client, 'sensors/test', limit=3)
+        except OSError:
+            pass
+    _catch_up(box, client)
+
+    # Nothing lost, nothing sent twice, in order
+    assert client.received == [b'm%d' % n for n in range(3000)]
+    queued, sent, logged, dropped = box.stats
+    assert queued == sent == 3000 and dropped == 0
+    assert logged > 0, 'the outages must have overflowed the RAM buffer'
+    assert not (tmp_path / 'outbox.log').exists()
+
+
+def test_resets(tmp_path):
+    rnd = random.Random(2)
+    sync_every = 3
+    path = str(tmp_path / 'outbox.log')
+    box = outbox.Outbox(path, ram_slots=4, sync_every=sync_every)
+    client = FakeClient(rnd)
+    lost = set()
+    resets = 0
+    for n in range(3000):
+        box.put('m%d' % n)
+        if rnd.random() < 0.01:
+            client.connected = not client.connected
+        if rnd.random() < 0.005:
+            # A reset loses what is in RAM, the log is picked up again
+            lost.update(box.ram[(box.head + i) % len(box.ram)] for i in range(box.count))
+            box = outbox.Outbox(path, ram_slots=4, sync_every=sync_every)
+            resets += 1
+        try:
+            box.drain(client, 'sensors/test', limit=3)
+        except OSError:
+            pass
+    _catch_up(box, client)
+    assert resets > 3
+
+    # Every message that wasn't in RAM at a reset arrives, in order. Those
+    # sent since the position in the log was last saved may arrive twice.
+    expected = [b'm%d' % n for n in range(3000) if b'm%d' % n not in lost]
+    first = []
+    seen = set()
+    for msg in client.received:
+        if msg not in seen:
+            seen.add(msg)
+            first.append(msg)
+    assert first == expected
+    assert len(client.received) - len(first) <= resets * sync_every
+
+
+def test_full_log_drops_new_messages(tmp_path):
+    box = outbox.Outbox(str(tmp_path / 'outbox.log'), ram_slots=2, max_log_bytes=100)
+    for n in range(20):
+        box.put('message %02d' % n)
+    # 2 in RAM, and 12 bytes per message in the log
+    assert box.stats[2] == 100 // 12
+    assert box.stats[3] == 20 - 2 - 100 // 12
+
+    client = FakeClient(random.Random(3), failures=0)
+    _catch_up(box, client)
+    assert client.received == [b'message %02d' % n for n in range(2 + 100 // 12)]
+
+
+def test_drain_async(tmp_path):
+    rnd = random.Random(4)
+    box = outbox.Outbox(str(tmp_path / 'outbox.log'), ram_slots=4)
+    client = AsyncClient(rnd, failures=0.2)
+
+    async def main():
+        for n in range(500):
+            box.put('m%d' % n)
+            try:
+                await box.drain_async(client, 'sensors/test', limit=2)
+            except OSError:
+                pass
+        client.failures = 0
+        while box.pending():
+            await box.drain_async(client, 'sensors/test', limit=50)
+
+    asyncio.run(main())
+    assert client.received == [b'm%d' % n for n in range(500)]
+
+
+
+def test_log_is_compacted(tmp_path):
+    path = str(tmp_path / 'outbox.log')
+    box = outbox.Outbox(path, ram_slots=1, max_log_bytes=200, sync_every=3)
+    client = FakeClient(random.Random(5), failures=0)
+    # The log is never empty, but never holds much that wasn't sent: far more
+    # than max_log_bytes goes through it, without drops or a growing file,
+    # and across resets
+    box.put('first')
+    largest = 0
+    for n in range(2000):
+        box.put('message %04da' % n)
+        box.put('message %04db' % n)
+        box.drain(client, 'sensors/test', limit=2)
+        largest = max(largest, os.path.getsize(path))
+        if n % 500 == 499:
+            box = outbox.Outbox(path, ram_slots=1, max_log_bytes=200, sync_every=3)
+    assert box.stats[3] == 0
+    assert largest <= 200
+
+    _catch_up(box, client)
+    first = []
+    for msg in client.received:
+        if msg not in first[-8:]:
+            first.append(msg)
+    assert first == [b'first'] + [b'message %04d' % n + c for n in range(2000) for c in (b'a', b'b')]
+    assert len(client.received) - len(first) <= 4 * 3
+
+
+def test_full_log_counts_only_unsent_messages(tmp_path):
+    box = outbox.Outbox(str(tmp_path / 'outbox.log'), ram_slots=1, max_log_bytes=100)
+    client = FakeClient(random.Random(6), failures=0)
+    box.put('in ram')
+    for n in range(8):
+        box.put('message %02d' % n)
+    box.drain(client, 'sensors/test', limit=5)
+    # 4 of the 8 messages in the log were sent, so 4 more fit in it
+    for n in range(8, 16):
+        box.put('message %02d' % n)
+    assert box.stats[3] == 4
+    _catch_up(box, client)
+    assert client.received == [b'in ram'] + [b'message %02d' % n for n in range(12)]
+
+
+def test_reset_while_compacting(tmp_path):
+    path = str(tmp_path / 'outbox.log')
+    box = outbox.Outbox(path, ram_slots=1, max_log_bytes=1000)
+    client = FakeClient(random.Random(7), failures=0)
+    box.put('in ram')
+    for n in range(10):
+        box.put('message %02d' % n)
+    box.drain(client, 'sensors/test', limit=4)
+    with open(path, 'rb') as f:
+        f.seek(box.log_pos)
+        rest = f.read()
+
+    # The new log was written and the old one removed, the saved position
+    # was still there
+    with open(path + '.tmp', 'wb') as f:
+        f.write(rest)
+    os.remove(path)
+    with open(path + '.pos', 'w') as f:
+        f.write('24')
+    box = outbox.Outbox(path, ram_slots=1, max_log_bytes=1000)
+    _catch_up(box, client)
+    assert client.received == [b'in ram'] + [b'message %02d' % n for n in range(10)]
+    assert not os.listdir(str(tmp_path))
@@ -0,0 +1,116 @@
+"""
+    --------------------------------------------------------------------------------------
+    sensor_batch.py
+    --------------------------------------------------------------------------------------
+    Collects sensor readings into batches that are published as one compact binary
+    MQTT message, instead of one JSON message per reading.
+
+    The device and location names and the names of the values are sent once per
+    batch, in the header.  Each reading is then stored as the change since the
+    previous one: the number of seconds since the previous reading, and the change
+    of each value, as a fixed point number with the given number of decimals.
+    Readings of a slowly changing sensor usually fit in a few bytes this way.
+
+    Format (all integers little endian):
+        header      ustruct '<BBHI': format version (1), number of values per reading,
+                    number of readings, time of the first reading (Unix seconds)
+        device      1 byte length + UTF-8 name (at most 255 bytes)
+        location    1 byte length + UTF-8 name (at most 255 bytes)
+        values      for each value: 1 byte length + UTF-8 name, 1 byte decimals
+        readings    for each reading: the seconds since the previous reading, then
+                    for each value the change since the previous reading (the first
+                    reading is relative to 0), all as zigzag encoded varints
+
+    collector/batch_decoder.py decodes the batches on the host.
+
+    Example:
+        import sensor_batch
+        batch = sensor_batch.Batch('node1', 'living room',
+                                   (('temperature_F', 2), ('humidity', 1)),
+                                   max_readings=12, max_seconds=60)
+        batch.add(71.5, 40.2)
+        if batch.ready():
+            client.publish('sensors/environmental/batch', batch.encode())
+    --------------------------------------------------------------------------------------
+"""
+
+import time
+import ustruct
+
+VERSION = 1
+
+# Unix time of 2000-01-01. time.time() counts from there on most MicroPython
+# ports, and from 1970 on others (and CPython); localtime() is on all of them.
+EPOCH_2000 = 946684800
+EPOCH_OFFSET = EPOCH_2000 if time.localtime(0)[0] == 2000 else 0
+
+
+def _name(name):
+    encoded = name.encode()
+    if len(encoded) > 255:
+        raise ValueError('name longer than 255 bytes: {}...'.format(name[:20]))
+    return bytes((len(encoded),)) + encoded
+
+
+class Batch:
+    def __init__(self, device, location, values, max_readings=12, max_seconds=60):
+        """
+        values is a sequence of (name, decimals) pairs, in the order add() is
+        given the values. Raises ValueError for names longer than 255 bytes in
+        UTF-8.
+        """
+        self.scales = [10 ** decimals for name, decimals in values]
+        self.max_readings = max_readings
+        self.max_seconds = max_seconds
+
+        # The part of the header that is the same for every batch
+        self.names = _name(device) + _name(location) + b''.join(
+            _name(name) + bytes((decimals,)) for name, decimals in values)
+
+        self.last = [0] * len(values)
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.first_time = 0
+        self.last_time = 0
+        self.body = bytearray()
+        for i in range(len(self.last)):
+            self.last[i] = 0
+
+    def _varint(self, n):
+        # zigzag encoding, so small negative changes are small too
+        n = -2 * n - 1 if n < 0 else 2 * n
+        while n > 0x7F:
+            self.body.append((n & 0x7F) | 0x80)
+            n >>= 7
+        self.body.append(n)
+
+    def add(self, *values):
+        """Adds a reading taken now, with one value per name given to the constructor."""
+        now = int(time.time()) + EPOCH_OFFSET
+        if self.count == 0:
+            self.first_time = self.last_time = now
+        self._varint(now - self.last_time)
+        self.last_time = now
+
+        last = self.last
+        scales = self.scales
+        for i in range(len(last)):
+            value = int(round(values[i] * scales[i]))
+            self._varint(value - last[i])
+            last[i] = value
+        self.count += 1
+
+    def ready(self):
+        """True when the batch is full, or its first reading is max_seconds old."""
+        if self.count == 0:
+            return False
+        return (self.count >= self.max_readings or
+                int(time.time()) + EPOCH_OFFSET - self.first_time >= self.max_seconds)
+
+    def encode(self):
+        """Returns the batch as a message, and starts a new batch."""
+        msg = ustruct.pack('<BBHI', VERSION, len(self.scales), self.count, self.first_time) + self.names + self.body
+        self.reset()
+        return msg
@@ -0,0 +1,125 @@
+"""
+    --------------------------------------------------------------------------------------
+    topic_router.py
+    --------------------------------------------------------------------------------------
+    Routes incoming MQTT messages to handlers by topic, with the usual MQTT wildcards:
+    '+' matches exactly one topic level, and '#' (only as the last level) matches any
+    number of levels, including none.
+
+    The topic filters are compiled into a tree with one level per node, so finding
+    the handlers for a topic only walks as many nodes as the topic has levels (plus
+    the '+' branches), however many filters there are.  Every handler whose filter
+    matches is called, like the broker does for overlapping subscriptions.
+
+    Handlers are called with the topic as bytes and the payload as a memoryview, so
+    payloads aren't copied; use bytes(msg) to keep one after the handler returns.
+
+    Example:
+        import topic_router
+
+        def reading(topic, msg):
+            print(topic, bytes(msg))
+
+        router = topic_router.Router()
+        router.add('sensors/+/temperature', reading)
+        router.add('sensors/kitchen/#', reading)
+        client.set_callback(router.dispatch)
+    --------------------------------------------------------------------------------------
+"""
+
+
+class _Node:
+    def __init__(self):
+        self.children = {}
+        # Handlers of the filters that end at this node, and of the filters that
+        # end with '#' right after it
+        self.handlers = []
+        self.rest = []
+
+
+def _levels(topic):
+    if isinstance(topic, str):
+        topic = topic.encode()
+    return topic.split(b'/')
+
+
+class Router:
+    def __init__(self):
+        self.root = _Node()
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, topic_filter, handler):
+        """Calls handler(topic, msg) for messages with topics that match topic_filter."""
+        levels = _levels(topic_filter)
+        node = self.root
+        for i in range(len(levels)):
+            level = levels[i]
+            if level == b'#':
+                if i != len(levels) - 1:
+                    raise ValueError("'#' must be the last level of a topic filter")
+                node.rest.append(handler)
+                self.count += 1
+                return
+            child = node.children.get(level)
+            if child is None:
+                child = node.children[level] = _Node()
+            node = child
+        node.handlers.append(handler)
+        self.count += 1
+
+    def remove(self, topic_filter, handler):
+        """Removes a handler added with add(). Raises ValueError if there is none."""
+        levels = _levels(topic_filter)
+        node = self.root
+        for level in levels[:-1]:
+            node = node.children.get(level)
+            if node is None:
+                raise ValueError('no such subscription')
+        if levels[-1] == b'#':
+            handlers = node.rest
+        else:
+            node = node.children.get(levels[-1])
+            if node is None:
+                raise ValueError('no such subscription')
+            handlers = node.handlers
+        handlers.remove(handler)
+        self.count -= 1
+
+    def dispatch(self, topic, msg):
+        """
+        Calls the handlers of all the filters that match topic (bytes), and returns
+        how many were called.
+        """
+        levels = topic.split(b'/')
+        if not isinstance(msg, memoryview):
+            msg = memoryview(msg)
+        depth = len(levels)
+        # Topics starting with '$' (broker topics) don't match wildcards at the first level
+        wildcards = not topic.startswith(b'$')
+
+        called = 0
+        stack = [(self.root, 0)]
+        while stack:
+            node, i = stack.pop()
+            if wildcards or i > 0:
+                for handler in node.rest:
+                    handler(topic, msg)
+                    called += 1
+            if i == depth:
+                for handler in node.handlers:
+                    handler(topic, msg)
+                    called += 1
+                continue
+
+            children = node.children
+            child = children.get(levels[i])
+            if child is not None:
+                stack.append((child, i + 1))
+            if wildcards or i > 0:
+                child = children.get(b'+')
+                if child is not None:
+                    stack.append((child, i + 1))
+        return called
@@ -0,0 +1,66 @@
+"""
+    --------------------------------------------------------------------------------------
+    topic_router_bench.py
+    --------------------------------------------------------------------------------------
+    Measures how long topic_router.py takes to dispatch a message with 10,000
+    subscriptions, compared with checking every filter in turn, and checks that both
+    call the same handlers.
+
+    Runs on a computer with CPython (or on a board, with fewer subscriptions):
+        python topic_router_bench.py [subscriptions]
+    --------------------------------------------------------------------------------------
+"""
+
+import random
+import sys
+import time
+
+import topic_router
+from topic_router_test import matches
+
+SUBSCRIPTIONS = 10000
+MESSAGES = 2000
+
+
+def filters(count):
+    # One subscription per device, some to all of its readings and some to one,
+    # plus a few catch-alls, like a collector serving many dashboards
+    result = ['sensors/#', 'sensors/+/temperature', '+/+/humidity']
+    for i in range(count - len(result)):
+        result.append('sensors/dev%d/+' % i if i % 2 else 'sensors/dev%d/temperature' % i)
+    return result
+
+
+def run(subscriptions=SUBSCRIPTIONS, messages=MESSAGES):
+    rnd = random.Random(0)
+    subscribed = filters(subscriptions)
+    counts = [0] * len(subscribed)
+    router = topic_router.Router()
+    for k, topic_filter in enumerate(subscribed):
+        router.add(topic_filter, lambda topic, msg, k=k: counts.__setitem__(k, counts[k] + 1))
+    topics = ['sensors/dev%d/%s' % (rnd.randrange(subscriptions), rnd.choice(('temperature', 'humidity')))
+              for _ in range(messages)]
+
+    start = time.perf_counter()
+    called = 0
+    for topic in topics:
+        called += router.dispatch(topic.encode(), b'payload')
+    tree_us = (time.perf_counter() - start) * 1000000 / messages
+    by_tree = list(counts)
+
+    counts[:] = [0] * len(subscribed)
+    start = time.perf_counter()
+    for topic in topics:
+        for k, topic_filter in enumerate(subscribed):
+            if matches(topic_filter, topic):
+                counts[k] += 1
+    linear_us = (time.perf_counter() - start) * 1000000 / messages
+
+    assert by_tree == counts, 'the router must call the same handlers as the brute force check'
+    print('{} subscriptions: {:.1f} us per message with the tree, {:.0f} us checking every filter, '
+          '{:.1f} handlers called per message'.format(len(subscribed), tree_us, linear_us, called / messages))
+    return tree_us, linear_us
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else SUBSCRIPTIONS)
@@ -0,0 +1,93 @@
+"""
+Checks topic_router.py against a brute force reference: a plain implementation of
+the MQTT topic matching rules, tried on every filter for every topic, with random
+filters and topics full of wildcards, empty levels and '$' topics.
+"""
+
+import random
+
+import pytest
+
+import topic_router
+
+
+def matches(topic_filter, topic):
+    """The MQTT 3.1.1 matching rules (section 4.7), one level at a time."""
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+    if topic.startswith('$') and filter_levels[0] in ('+', '#'):
+        return False
+    for i, level in enumerate(filter_levels):
+        if level == '#':
+            # Matches the parent level too: 'a/#' matches 'a'
+            return True
+        if i == len(topic_levels):
+            return False
+        if level != '+' and level != topic_levels[i]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+LEVELS = ['a', 'b', 'c', '']
+
+
+def random_topic(rnd):
+    levels = [rnd.choice(LEVELS + ['$SYS', 'x']) if i == 0 else rnd.choice(LEVELS + ['x'])
+              for i in range(rnd.randint(1, 5))]
+    return '/'.join(levels)
+
+
+def random_filter(rnd):
+    levels = [rnd.choice(LEVELS + ['+', '+', '$SYS']) for _ in range(rnd.randint(1, 5))]
+    if rnd.random() < 0.4:
+        levels[-1] = '#'
+    return '/'.join(levels)
+
+
+def test_matches_reference():
+    rnd = random.Random(1)
+    for _ in range(500):
+        router = topic_router.Router()
+        filters = [random_filter(rnd) for _ in range(20)]
+        called = []
+        for k, topic_filter in enumerate(filters):
+            router.add(topic_filter, lambda topic, msg, k=k: called.append(k))
+        for _ in range(20):
+            topic = random_topic(rnd)
+            del called[:]
+            n = router.dispatch(topic.encode(), b'payload')
+            expected = sorted(k for k, topic_filter in enumerate(filters) if matches(topic_filter, topic))
+            assert sorted(called) == expected and n == len(expected), (topic, filters, called, expected)
+
+
+def test_handler_arguments():
+    router = topic_router.Router()
+    got = []
+    router.add('sensors/+/temperature', lambda topic, msg: got.append((topic, msg)))
+    router.dispatch(b'sensors/kitchen/temperature', b'21.5')
+    topic, msg = got[0]
+    assert topic == b'sensors/kitchen/temperature'
+    assert isinstance(msg, memoryview) and bytes(msg) == b'21.5'
+
+
+def test_remove():
+    router = topic_router.Router()
+    first = lambda topic, msg: None
+    second = lambda topic, msg: None
+    router.add('a/#', first)
+    router.add('a/+', second)
+    router.add('a/+', first)
+    assert len(router) == 3
+    router.remove('a/#', first)
+    router.remove('a/+', first)
+    assert len(router) == 1
+    assert router.dispatch(b'a/b', b'') == 1
+    for topic_filter in ('a/#', 'b/+', 'a/b/c'):
+        with pytest.raises(ValueError):
+            router.remove(topic_filter, first)
+
+
+def test_bad_filter():
+    with pytest.raises(ValueError):
+        topic_router.Router().add('a/#/b', lambda topic, msg: None)
+
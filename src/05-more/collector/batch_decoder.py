@@ -0,0 +1,114 @@
+"""
+    --------------------------------------------------------------------------------------
+    batch_decoder.py
+    --------------------------------------------------------------------------------------
+    Decodes the binary batches of readings published by sensor nodes with
+    sensor_batch.py (see that file for the format).  Runs on a regular computer with
+    CPython, not on the board.
+
+    Each reading is returned as a dict shaped like the JSON messages that nodes send
+    when they don't batch, plus the time the reading was taken.
+
+    Example:
+        import batch_decoder
+
+        for reading in batch_decoder.decode(payload):
+            print(reading['time'], reading['temperature_F'], reading['humidity'])
+    --------------------------------------------------------------------------------------
+"""
+
+import struct
+
+VERSION = 1
+HEADER = struct.Struct('<BBHI')
+
+
+class Batch:
+    """
+    A decoded batch: the device and location, the names of the values, and
+    their timestamps (Unix seconds) and values as columns.
+    """
+
+    def __init__(self, device, location, names, times, columns):
+        self.device = device
+        self.location = location
+        self.names = names
+        self.times = times
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.times)
+
+    def readings(self):
+        for i in range(len(self.times)):
+            reading = {'device': self.device, 'location': self.location, 'time': self.times[i]}
+            for name, column in zip(self.names, self.columns):
+                reading[name] = column[i]
+            yield reading
+
+
+def _varint(payload, pos):
+    n = 0
+    shift = 0
+    while True:
+        b = payload[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            break
+        shift += 7
+    # undo the zigzag encoding
+    return (n >> 1) ^ -(n & 1), pos
+
+
+def _name(payload, pos):
+    length = payload[pos]
+    end = pos + 1 + length
+    return bytes(payload[pos + 1:end]).decode('utf-8'), end
+
+
+def decode_batch(payload):
+    """
+    Decodes a batch message into a Batch. Raises ValueError if the payload isn't
+    a valid batch.
+    """
+    try:
+        version, nvalues, count, first_time = HEADER.unpack_from(payload)
+        if version != VERSION:
+            raise ValueError('unsupported batch version {}'.format(version))
+        pos = HEADER.size
+
+        device, pos = _name(payload, pos)
+        location, pos = _name(payload, pos)
+        names = []
+        scales = []
+        for _ in range(nvalues):
+            name, pos = _name(payload, pos)
+            names.append(name)
+            scales.append(10 ** payload[pos])
+            pos += 1
+
+        times = []
+        columns = [[] for _ in range(nvalues)]
+        last = [0] * nvalues
+        timestamp = first_time
+        for _ in range(count):
+            delta, pos = _varint(payload, pos)
+            timestamp += delta
+            times.append(timestamp)
+            for i in range(nvalues):
+                delta, pos = _varint(payload, pos)
+                last[i] += delta
+                columns[i].append(last[i] / scales[i])
+    except (IndexError, struct.error, UnicodeError) as e:
+        raise ValueError('truncated or corrupt batch: {}'.format(e))
+
+    if pos != len(payload):
+        raise ValueError('{} extra bytes after the batch'.format(len(payload) - pos))
+
+    return Batch(device, location, names, times, columns)
+
+
+def decode(payload):
+    """Decodes a batch message into a list of reading dicts."""
+    return list(decode_batch(payload).readings())
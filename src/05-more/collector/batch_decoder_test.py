@@ -0,0 +1,62 @@
+"""
+Checks that batch_decoder.py gives back the times and values that sensor_batch.py
+was given on the node, rounded to their fixed point decimals, and that names that don't fit
+the format are refused when the batch is made.
+"""
+
+import random
+import types
+
+import pytest
+
+import batch_decoder
+import sensor_batch
+
+VALUES = (('temperature_F', 2), ('humidity', 1), ('pressure', 0), ('light', 3))
+
+
+def test_round_trip(monkeypatch):
+    rnd = random.Random(1)
+    clock = [1700000000]
+    monkeypatch.setattr(sensor_batch, 'time', types.SimpleNamespace(time=lambda: clock[0]))
+    batch = sensor_batch.Batch('node1', 'living room é', VALUES, max_readings=50)
+
+    for _ in range(20):
+        times = []
+        readings = []
+        for i in range(rnd.randint(1, 50)):
+            # Steady readings with small changes, and jumps both ways
+            reading = (rnd.uniform(-40, 120), rnd.uniform(0, 100),
+                       rnd.choice((0, 101325, -5, 2 ** 40)), rnd.uniform(-1e6, 1e6))
+            times.append(clock[0])
+            readings.append(reading)
+            batch.add(*reading)
+            clock[0] += rnd.choice((0, 1, 5, 60, 100000))
+
+        decoded = batch_decoder.decode_batch(batch.encode())
+        assert (decoded.device, decoded.location) == ('node1', 'living room é')
+        assert decoded.names == [name for name, decimals in VALUES]
+        assert decoded.times == times
+        for i, (name, decimals) in enumerate(VALUES):
+            scale = 10 ** decimals
+            assert decoded.columns[i] == [int(round(reading[i] * scale)) / scale for reading in readings]
+        assert batch_decoder.decode(batch.encode()) == []
+
+
+@pytest.mark.parametrize('device, location, values', [
+    ('n' * 256, 'attic', VALUES),
+    ('node1', 'é' * 128, VALUES),
+    ('node1', 'attic', (('v' * 300, 1),)),
+])
+def test_long_names(device, location, values):
+    with pytest.raises(ValueError):
+        sensor_batch.Batch(device, location, values)
+
+
+def test_longest_names(monkeypatch):
+    monkeypatch.setattr(sensor_batch, 'time', types.SimpleNamespace(time=lambda: 1700000000))
+    batch = sensor_batch.Batch('n' * 255, 'é' * 127, (('v' * 255, 1),))
+    batch.add(1.5)
+    decoded = batch_decoder.decode_batch(batch.encode())
+    assert (decoded.device, decoded.location, decoded.names) == ('n' * 255, 'é' * 127, ['v' * 255])
+    assert decoded.columns == [[1.5]]
@@ -0,0 +1,170 @@
+"""
+    --------------------------------------------------------------------------------------
+    bme280_compensation.py
+    --------------------------------------------------------------------------------------
+    Compensates raw BME280 readings in bulk on the collector, instead of on the sensor
+    node.  Runs on a regular computer with CPython and NumPy, not on the board.
+
+    Nodes send the 33 byte calibration block returned by BME280.read_calibration()
+    once, and then raw (adc_T, adc_P, adc_H) triples from BME280.read_raw_data().
+    The results are identical to the driver's read_temperature(), read_pressure() and
+    read_humidity(), since the same integer formulas are applied with 64-bit integers
+    (the width the formulas were written for in the Bosch datasheet).
+
+    64 bits are enough for the temperature and humidity formulas with any 20-bit and
+    16-bit readings and any calibration values.  The pressure formula only stays within
+    them for calibration values like those of real sensors: when the readings and the
+    calibration could take an intermediate value out of range, the pressure is worked
+    out with Python integers instead (much slower, but still identical to the driver),
+    and returned as an object array if it doesn't fit in 64 bits either.
+
+    Example:
+        import numpy as np
+        import bme280_compensation
+
+        calibration = bme280_compensation.Calibration(calibration_block)
+        raw = np.array([(519888, 415148, 28312), (519904, 415136, 28320)])
+        temperature, pressure, humidity = calibration.compensate(raw)
+
+    Dependencies
+    ------------
+        - numpy
+    --------------------------------------------------------------------------------------
+"""
+
+import struct
+
+import numpy as np
+
+CALIBRATION_TP_LENGTH = 26
+CALIBRATION_H_LENGTH = 7
+CALIBRATION_LENGTH = CALIBRATION_TP_LENGTH + CALIBRATION_H_LENGTH
+INT64_MAX = 2 ** 63 - 1
+
+
+class Calibration:
+    """
+    The trimming parameters of one BME280, decoded from its calibration block.
+    """
+
+    def __init__(self, block):
+        if len(block) != CALIBRATION_LENGTH:
+            raise ValueError('Calibration block must be {0} bytes, got {1}'.format(
+                CALIBRATION_LENGTH, len(block)))
+
+        (self.dig_T1, self.dig_T2, self.dig_T3,
+         self.dig_P1, self.dig_P2, self.dig_P3, self.dig_P4, self.dig_P5,
+         self.dig_P6, self.dig_P7, self.dig_P8, self.dig_P9) = struct.unpack_from('<HhhHhhhhhhhh', block)
+        self.dig_H1 = block[25]
+
+        self.dig_H2, self.dig_H3, e4, e5, e6, self.dig_H6 = struct.unpack_from(
+            '<hBbBbb', block, CALIBRATION_TP_LENGTH)
+        self.dig_H4 = (e4 << 4) | (e5 & 0x0F)
+        self.dig_H5 = (e6 << 4) | (e5 >> 4)
+
+    def compensate(self, raw):
+        """
+        Compensates an (N, 3) array of raw (adc_T, adc_P, adc_H) readings.
+        Returns three int64 arrays: temperature in 0.01 degree Celsius,
+        pressure in Pascals as Q24.8 fixed point, and humidity in %RH as Q22.10
+        fixed point (the pressure is an object array of Python ints for
+        calibration values no real sensor has, see above).
+        """
+
+        raw = np.asarray(raw, dtype=np.int64)
+        if raw.ndim != 2 or raw.shape[1] != 3:
+            raise ValueError('Expected an (N, 3) array of raw readings')
+
+        t_fine, temperature = self.compensate_temperature(raw[:, 0])
+        pressure = self.compensate_pressure(raw[:, 1], t_fine)
+        humidity = self.compensate_humidity(raw[:, 2], t_fine)
+
+        return temperature, pressure, humidity
+
+    def compensate_temperature(self, adc):
+        """Returns the t_fine values and the temperatures for the raw readings."""
+
+        adc = np.asarray(adc, dtype=np.int64)
+        var1 = ((adc >> 3) - (self.dig_T1 << 1)) * (self.dig_T2 >> 11)
+        var2 = ((adc >> 4) - self.dig_T1)
+        var2 = (((var2 * var2) >> 12) * self.dig_T3) >> 14
+        t_fine = var1 + var2
+
+        return t_fine, (t_fine * 5 + 128) >> 8
+
+    def compensate_pressure(self, adc, t_fine):
+        adc = np.asarray(adc, dtype=np.int64)
+        t_fine = np.asarray(t_fine, dtype=np.int64)
+        if not len(adc):
+            return np.zeros(0, dtype=np.int64)
+        if self._pressure_fits_int64(adc, t_fine):
+            return self._pressure(adc, t_fine)
+
+        p = self._pressure(adc.astype(object), t_fine.astype(object))
+        if all(-2 ** 63 <= value < 2 ** 63 for value in p):
+            return p.astype(np.int64)
+        return p
+
+    def _pressure_fits_int64(self, adc, t_fine):
+        # Upper bounds of the magnitudes of the intermediate values of _pressure(),
+        # worked out with Python integers from the largest inputs (x >> n is at
+        # most |x| >> n, plus one when x is negative)
+        v = int(np.abs(t_fine - 128000).max())
+        var2 = v * v * abs(self.dig_P6) + (v * abs(self.dig_P5) << 17) + (abs(self.dig_P4) << 35)
+        var1 = (v * v * abs(self.dig_P3) >> 8) + (v * abs(self.dig_P2) >> 12) + 2
+        var1_p1 = ((1 << 47) + var1) * self.dig_P1
+        p = int(np.abs(1048576 - adc).max())
+        numerator = ((p << 31) + var2) * 3125
+        if max(v * v * max(abs(self.dig_P6), abs(self.dig_P3)), var2, var1_p1, numerator) > INT64_MAX:
+            return False
+
+        # The divisor is known once the steps before it are done
+        divisor = np.abs(self._pressure_divisor(t_fine))
+        divisor = int(divisor[divisor > 0].min()) if (divisor > 0).any() else 1
+        p = numerator // divisor + 1
+        return max(abs(self.dig_P9) * ((p >> 13) + 1) ** 2, abs(self.dig_P8) * p) <= INT64_MAX
+
+    def _pressure_divisor(self, t_fine):
+        var1 = t_fine - 128000
+        var1 = (((var1 * var1 * self.dig_P3) >> 8) + ((var1 * self.dig_P2) >> 12))
+        return (((1 << 47) + var1) * self.dig_P1) >> 33
+
+    def _pressure(self, adc, t_fine):
+        var1 = t_fine - 128000
+        var2 = var1 * var1 * self.dig_P6
+        var2 = var2 + ((var1 * self.dig_P5) << 17)
+        var2 = var2 + (self.dig_P4 << 35)
+        var1 = self._pressure_divisor(t_fine)
+
+        # The driver returns 0 instead of dividing by zero.
+        invalid = var1 == 0
+        var1 = np.where(invalid, 1, var1)
+
+        p = 1048576 - adc
+        p = (((p << 31) - var2) * 3125) // var1
+        var1 = (self.dig_P9 * (p >> 13) * (p >> 13)) >> 25
+        var2 = (self.dig_P8 * p) >> 19
+        p = ((p + var1 + var2) >> 8) + (self.dig_P7 << 4)
+
+        return np.where(invalid, 0, p)
+
+    def compensate_humidity(self, adc, t_fine):
+        adc = np.asarray(adc, dtype=np.int64)
+        h = t_fine - 76800
+        h = (((((adc << 14) - (self.dig_H4 << 20) - (self.dig_H5 * h)) +
+            16384) >> 15) * (((((((h * self.dig_H6) >> 10) * (((h *
+            self.dig_H3) >> 11) + 32768)) >> 10) + 2097152) *
+            self.dig_H2 + 8192) >> 14))
+        h = h - (((((h >> 15) * (h >> 15)) >> 7) * self.dig_H1) >> 4)
+        h = np.clip(h, 0, 419430400)
+
+        return h >> 12
+
+
+def to_units(temperature, pressure, humidity):
+    """
+    Converts compensated readings to degrees Celsius, hPa and percent, the same way
+    as BME280.temperature(), pressure() and humidity().
+    """
+
+    return temperature / 100, (pressure // 256) / 100, humidity / 1024
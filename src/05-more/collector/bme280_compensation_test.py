@@ -0,0 +1,81 @@
+"""
+Checks that bme280_compensation.py gives exactly the driver's results, bit for bit,
+on readings of the simulated sensor of bme280_sim.py, with the calibration of a
+real sensor and with random, out of spec calibration values.
+"""
+
+import random
+
+import numpy as np
+
+import bme280_sim
+import bme280
+import bme280_compensation
+
+
+def driver_readings(sensor, bus, raw):
+    # What the driver returns for each raw reading, read from the simulated sensor
+    results = []
+    for adc_t, adc_p, adc_h in raw:
+        bus.set_raw(adc_t, adc_p, adc_h)
+        results.append((sensor.read_temperature(), sensor.read_pressure(), sensor.read_humidity()))
+    return [list(column) for column in zip(*results)]
+
+
+def random_raw(rnd, count):
+    # Readings around those of a room, and anywhere in the registers' range
+    raw = [(rnd.randint(480000, 560000), rnd.randint(300000, 450000), rnd.randint(20000, 40000))
+           for _ in range(count // 2)]
+    raw += [(rnd.randrange(1 << 20), rnd.randrange(1 << 20), rnd.randrange(1 << 16))
+            for _ in range(count - len(raw))]
+    raw.append((0, 0, 0))
+    raw.append(((1 << 20) - 1, (1 << 20) - 1, (1 << 16) - 1))
+    return raw
+
+
+def test_matches_the_driver():
+    rnd = random.Random(1)
+    bus = bme280_sim.FakeI2C()
+    sensor = bme280.BME280(i2c=bus)
+    raw = random_raw(rnd, 2000)
+
+    calibration = bme280_compensation.Calibration(sensor.read_calibration())
+    temperature, pressure, humidity = calibration.compensate(raw)
+    assert pressure.dtype == np.int64
+    assert [list(temperature), list(pressure), list(humidity)] == driver_readings(sensor, bus, raw)
+
+
+def test_matches_the_driver_out_of_spec():
+    # Calibration words anywhere in their range take the pressure formula's
+    # intermediate values past 64 bits
+    rnd = random.Random(2)
+    for _ in range(30):
+        bus = bme280_sim.FakeI2C()
+        bus.regs[0x88:0x88 + 26] = bytes(rnd.randrange(256) for _ in range(26))
+        bus.regs[0xE1:0xE8] = bytes(rnd.randrange(256) for _ in range(7))
+        sensor = bme280.BME280(i2c=bus)
+        raw = random_raw(rnd, 40)
+
+        calibration = bme280_compensation.Calibration(sensor.read_calibration())
+        temperature, pressure, humidity = calibration.compensate(raw)
+        assert [list(temperature), list(pressure), list(humidity)] == driver_readings(sensor, bus, raw)
+
+
+def test_extreme_calibration_falls_back_to_python_ints():
+    block = bytearray(bme280_sim.CALIBRATION)
+    block[0:2] = (0xFFFF).to_bytes(2, 'little')   # dig_T1
+    block[2:4] = (0x7FFF).to_bytes(2, 'little')   # dig_T2
+    block[4:6] = (0x7FFF).to_bytes(2, 'little')   # dig_T3
+    block[6:8] = (0xFFFF).to_bytes(2, 'little')   # dig_P1
+    block[10:12] = (0x7FFF).to_bytes(2, 'little')  # dig_P3
+    block[16:18] = (0x7FFF).to_bytes(2, 'little')  # dig_P6
+    bus = bme280_sim.FakeI2C()
+    bus.regs[0x88:0x88 + 26] = block[:26]
+    sensor = bme280.BME280(i2c=bus)
+    raw = [(0, 0, 0), ((1 << 20) - 1, 1, 30000)]
+
+    calibration = bme280_compensation.Calibration(sensor.read_calibration())
+    assert not calibration._pressure_fits_int64(np.array([r[1] for r in raw]),
+                                                calibration.compensate_temperature([r[0] for r in raw])[0])
+    temperature, pressure, humidity = calibration.compensate(raw)
+    assert [list(temperature), list(pressure), list(humidity)] == driver_readings(sensor, bus, raw)
@@ -0,0 +1,11 @@
+import os
+import struct
+import sys
+
+# ingest_test.py and batch_decoder_test.py make batches with the node side's sensor_batch.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '04-networkedSensors'))
+if 'ustruct' not in sys.modules:
+    sys.modules['ustruct'] = struct
+
+# bme280_compensation_test.py checks the results against the driver on the simulated sensor
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'other_sensors'))
@@ -0,0 +1,505 @@
+"""
+    --------------------------------------------------------------------------------------
+    ingest.py
+    --------------------------------------------------------------------------------------
+    Collects the readings that sensor nodes publish under sensors/#, and stores them in
+    append-only binary column files, one directory per day.  Runs on a regular
+    computer with CPython, e.g. next to the Mosquitto broker set up by
+    init-mosquitto.sh, not on the board.
+
+    Messages are queued as they arrive, and decoded and written in batches: each
+    JSON reading is decoded on its own, so a bad message is dropped without
+    affecting the others, and each column of a batch is written with a single
+    write.  Binary batches of readings from sensor_batch.py (topics ending in
+    /batch) are decoded with batch_decoder.py.
+
+    Each day directory (data/2024-01-31/...) holds one file per field of the readings,
+    all with one entry per reading, in the order the readings were stored:
+        time.f8         when the reading was taken (Unix seconds, float64), or when it
+                        was received for readings that don't say, or that come from a
+                        node whose clock isn't set
+        <field>.f8      numeric fields (float64, NaN when a reading doesn't have it)
+        <field>.u4      text fields such as device and location, as indexes (uint32,
+                        0xFFFFFFFF when missing) into <field>.dict, which lists the
+                        distinct values, one JSON string per line
+        topic.u4        the topic the reading was published on
+    Field names are used as file names: characters other than letters, digits and
+    '_' are written as '-' and the hex of their UTF-8 bytes (e.g. 'temp F' is
+    stored as temp-20F), so different fields never share a file.  Fields of a
+    message that have the name of a column ingest adds itself, such as a 'topic'
+    field, are stored as <name>-msg.
+    read() loads a day back as NumPy arrays.
+
+    Usage:
+        python ingest.py --host localhost --user sensors --password secret --data data
+
+    Example (reading the data back):
+        import ingest
+        day = ingest.ColumnStore('data').read('2024-01-31')
+        print(day['time'], day['temperature_F'], day['device'])
+
+    Dependencies
+    ------------
+        - numpy
+        - paho-mqtt (only to subscribe to the broker)
+        - batch_decoder.py
+    --------------------------------------------------------------------------------------
+"""
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+import batch_decoder
+
+TOPIC = 'sensors/#'
+MISSING = 0xFFFFFFFF
+SECONDS_PER_DAY = 86400
+# Readings stamped before this (2020-01-01), or further ahead of the time they were
+# received than this many seconds, come from a node whose clock isn't set
+EARLIEST_TIME = 1577836800
+MAX_CLOCK_AHEAD = 3600
+
+_decode_json = json.JSONDecoder().decode
+
+
+class Partition:
+    """The column files of one day."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        self.rows = 0
+        self.numeric = set()
+        self.text = {}
+        for name in os.listdir(path):
+            column, ext = os.path.splitext(name)
+            if ext == '.f8':
+                self.numeric.add(column)
+            elif ext == '.u4':
+                self.text[column] = _load_dictionary(self._file(column, '.dict'))
+
+        # Drop whatever was written after the last complete row, e.g. when the
+        # program was stopped in the middle of an append. Without time.f8 not even
+        # the first append got that far, so every column is emptied.
+        self.rows = _rows(path)
+        for column in self.numeric:
+            self._truncate(self._file(column, '.f8'))
+        for column in self.text:
+            self._truncate(self._file(column, '.u4'))
+
+    def _truncate(self, path):
+        size = self.rows * (8 if path.endswith('.f8') else 4)
+        if os.path.getsize(path) > size:
+            os.truncate(path, size)
+
+    def _file(self, column, ext):
+        return os.path.join(self.path, column + ext)
+
+    def _encode(self, column, values):
+        # Replaces text values with their index in the column's dictionary, adding
+        # the ones that are new to it
+        dictionary = self.text[column]
+        new = []
+        ids = np.empty(len(values), dtype='<u4')
+        for i, value in enumerate(values):
+            if value is None:
+                ids[i] = MISSING
+                continue
+            value = str(value)
+            index = dictionary.get(value)
+            if index is None:
+                index = dictionary[value] = len(dictionary)
+                new.append(value)
+            ids[i] = index
+
+        if new:
+            with open(self._file(column, '.dict'), 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(value) + '\n' for value in new))
+        return ids
+
+    def append(self, columns, count):
+        """
+        Appends count readings, given as a dict of column name -> list or array of
+        values. Columns this day has never seen are created, and columns missing
+        from the readings are padded, so all the files stay the same length.
+        Raises ValueError, before writing anything, if a column doesn't have count
+        values.
+        """
+        _check_lengths(columns, count)
+        for column, values in columns.items():
+            if column in self.numeric or column in self.text:
+                continue
+            if isinstance(values, np.ndarray) or not any(isinstance(v, str) for v in values):
+                self.numeric.add(column)
+                padding = np.full(self.rows, np.nan, dtype='<f8')
+                ext = '.f8'
+            else:
+                self.text[column] = {}
+                padding = np.full(self.rows, MISSING, dtype='<u4')
+                ext = '.u4'
+            with open(self._file(column, ext), 'ab') as f:
+                padding.tofile(f)
+
+        for column in self.text:
+            values = columns.get(column)
+            if values is None:
+                data = np.full(count, MISSING, dtype='<u4')
+            else:
+                data = self._encode(column, values)
+            with open(self._file(column, '.u4'), 'ab') as f:
+                data.tofile(f)
+
+        # time.f8 is written last, since its length is the number of complete rows
+        # when a day is opened again
+        for column in sorted(self.numeric, key=lambda c: c == 'time'):
+            values = columns.get(column)
+            if values is None:
+                data = np.full(count, np.nan, dtype='<f8')
+            else:
+                data = _floats(values)
+            with open(self._file(column, '.f8'), 'ab') as f:
+                data.tofile(f)
+
+        self.rows += count
+
+
+def _floats(values):
+    if isinstance(values, np.ndarray):
+        return values.astype('<f8', copy=False)
+    try:
+        return np.array(values, dtype='<f8')
+    except (TypeError, ValueError):
+        # Some readings have a value that isn't a number in a numeric column
+        data = np.empty(len(values), dtype='<f8')
+        for i, value in enumerate(values):
+            try:
+                data[i] = float(value)
+            except (TypeError, ValueError):
+                data[i] = np.nan
+        return data
+
+
+class ColumnStore:
+    """Append-only column files under root, partitioned by the UTC day of the readings."""
+
+    def __init__(self, root):
+        self.root = root
+        self.partitions = {}
+
+    def partition(self, day):
+        partition = self.partitions.get(day)
+        if partition is None:
+            name = time.strftime('%Y-%m-%d', time.gmtime(day * SECONDS_PER_DAY))
+            partition = self.partitions[day] = Partition(os.path.join(self.root, name))
+        return partition
+
+    def append(self, columns):
+        """
+        Appends readings given as a dict of column -> values, including 'time'.
+        Column names are used as file names, so they may only have letters, digits,
+        '_' and '-'; others raise ValueError.
+        """
+        _check_names(columns)
+        _check_lengths(columns, len(columns['time']))
+        times = _floats(columns['time'])
+        columns['time'] = times
+        days = (times // SECONDS_PER_DAY).astype(np.int64)
+        first = days[0]
+
+        if (days == first).all():
+            self.partition(int(first)).append(columns, len(times))
+            return
+
+        for day in np.unique(days):
+            rows = np.nonzero(days == day)[0]
+            self.partition(int(day)).append(
+                {column: _take(values, rows) for column, values in columns.items()}, len(rows))
+
+    def read(self, day):
+        """
+        Returns the columns of a day ('YYYY-MM-DD') as a dict of NumPy arrays. Text
+        columns are returned as object arrays of strings, with None when missing.
+        The files are only read, so a day can be read while it is being written:
+        rows after the last complete one are left out, not truncated.
+        """
+        path = os.path.join(self.root, day)
+        if not os.path.isdir(path):
+            raise FileNotFoundError('no readings for {}'.format(day))
+        rows = _rows(path)
+        columns = {}
+        for name in os.listdir(path):
+            column, ext = os.path.splitext(name)
+            if ext == '.f8':
+                columns[column] = np.fromfile(os.path.join(path, name), dtype='<f8')[:rows]
+            elif ext == '.u4':
+                ids = np.fromfile(os.path.join(path, name), dtype='<u4')[:rows]
+                dictionary = _load_dictionary(os.path.join(path, column + '.dict'))
+                values = np.array(list(dictionary) + [None], dtype=object)
+                columns[column] = values[np.minimum(ids, len(dictionary))]
+        return columns
+
+
+def _rows(path):
+    # The number of complete rows of a day, i.e. the length of time.f8
+    try:
+        return os.path.getsize(os.path.join(path, 'time.f8')) // 8
+    except FileNotFoundError:
+        return 0
+
+
+def _load_dictionary(path):
+    values = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                values[json.loads(line)] = len(values)
+    except FileNotFoundError:
+        pass
+    return values
+
+
+def _escape(match):
+    return ''.join('-%02x' % b for b in match.group().encode('utf-8', 'surrogatepass'))
+
+
+def _field_columns(fields, reserved):
+    # The columns for the fields of messages. Only letters, digits and '_' are kept
+    # as they are in the names, the others are escaped rather than replaced, so
+    # that two fields never end up in the same file. Fields named like a column
+    # that ingest adds itself get a name that escaped names can't have ('-' then
+    # not hex).
+    columns = {}
+    for name, values in fields.items():
+        name = re.sub(r'[^A-Za-z0-9_]', _escape, str(name))
+        if name in reserved:
+            name += '-msg'
+        if name:
+            columns[name] = values
+    return columns
+
+
+def _check_names(columns):
+    for column in columns:
+        if not isinstance(column, str) or not re.fullmatch(r'[A-Za-z0-9_-]+', column):
+            raise ValueError('bad column name {!r}'.format(column))
+
+
+def _check_lengths(columns, count):
+    for column, values in columns.items():
+        if len(values) != count:
+            raise ValueError('column {} has {} values for {} readings'.format(column, len(values), count))
+
+
+def _take(values, rows):
+    if isinstance(values, np.ndarray):
+        return values[rows]
+    return [values[i] for i in rows]
+
+
+class Ingest:
+    """
+    Queues messages as they arrive (from any thread), and decodes and stores them
+    in batches when flush() is called.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.topics = []
+        self.payloads = []
+        self.received = []
+
+        # messages stored, and messages that couldn't be decoded
+        self.stats = [0, 0]
+
+    def add(self, topic, payload):
+        now = time.time()
+        with self.lock:
+            self.topics.append(topic)
+            self.payloads.append(payload)
+            self.received.append(now)
+
+    def pending(self):
+        return len(self.payloads)
+
+    def flush(self):
+        """Decodes and stores the queued messages. Returns how many readings were stored."""
+        with self.lock:
+            topics, self.topics = self.topics, []
+            payloads, self.payloads = self.payloads, []
+            received, self.received = self.received, []
+        if not payloads:
+            return 0
+
+        readings = []
+        readings_topics = []
+        readings_times = []
+        batches = []
+        for topic, payload, when in zip(topics, payloads, received):
+            if topic.endswith('/batch'):
+                batches.append((topic, payload, when))
+            else:
+                readings.append(payload)
+                readings_topics.append(topic)
+                readings_times.append(when)
+
+        stored = 0
+        if readings:
+            stored += self._store_json(readings, readings_topics, readings_times)
+        for topic, payload, when in batches:
+            stored += self._store_batch(topic, payload, when)
+        return stored
+
+    def _store_json(self, payloads, topics, received):
+        # Each message is decoded on its own: decoding the whole batch as one JSON
+        # array is faster, but a message that isn't a single JSON value (e.g.
+        # '1,{"a": 1}', or '[1' and '2]') would shift the rows against the topics
+        # and receive times.
+        rows = []
+        for payload in payloads:
+            try:
+                rows.append(_decode_json(payload.decode('utf-8')))
+            except ValueError:
+                rows.append(None)
+
+        keep = [i for i, row in enumerate(rows) if isinstance(row, dict)]
+        self.stats[1] += len(rows) - len(keep)
+        if not keep:
+            return 0
+        if len(keep) < len(rows):
+            rows = [rows[i] for i in keep]
+            topics = [topics[i] for i in keep]
+            received = [received[i] for i in keep]
+
+        columns = _field_columns({name: [row.get(name) for row in rows] for name in set().union(*rows)},
+                                 ('topic',))
+        columns['topic'] = topics
+        # Readings from dht_sensor_mqtt.py don't carry a time, so the time they were
+        # received is used for them
+        times = columns.get('time')
+        if times is None:
+            columns['time'] = received
+        else:
+            columns['time'] = [t if _plausible(t, r) else r for t, r in zip(times, received)]
+
+        self.store.append(columns)
+        self.stats[0] += len(rows)
+        return len(rows)
+
+    def _store_batch(self, topic, payload, received):
+        try:
+            batch = batch_decoder.decode_batch(payload)
+        except ValueError:
+            self.stats[1] += 1
+            return 0
+        if not len(batch):
+            return 0
+
+        count = len(batch)
+        columns = _field_columns(dict(zip(batch.names, batch.columns)), ('time', 'device', 'location', 'topic'))
+        columns['time'] = _batch_times(batch.times, received)
+        columns['device'] = [batch.device] * count
+        columns['location'] = [batch.location] * count
+        columns['topic'] = [topic] * count
+
+        self.store.append(columns)
+        self.stats[0] += count
+        return count
+
+
+def _is_time(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and 0 <= value < 1e11
+
+
+def _plausible(value, received):
+    return _is_time(value) and EARLIEST_TIME <= value <= received + MAX_CLOCK_AHEAD
+
+
+def _batch_times(times, received):
+    # A node whose clock was never set (e.g. no NTP server reachable since it
+    # started) stamps its readings from 2000-01-01. The times in a batch are still
+    # right relative to each other, so such a batch is moved to end when it was
+    # received. Readings that are implausible even then get the receive time.
+    if all(_plausible(t, received) for t in times):
+        return times
+    last = times[-1]
+    shift = 0 if _plausible(last, received) else received - last
+    fixed = []
+    for t in times:
+        if not _plausible(t, received):
+            t = t + shift if shift and _plausible(t + shift, received) else received
+        fixed.append(t)
+    return fixed
+
+
+def subscribe(ingest, host, port=1883, user=None, password=None):
+    """
+    Connects to the broker and queues the messages published under sensors/# in
+    ingest, from paho-mqtt's network thread. Returns the client; stop it with
+    client.loop_stop().
+    """
+    import paho.mqtt.client as mqtt
+
+    def on_connect(client, userdata, flags, *args):
+        # Subscribe again after each reconnection
+        client.subscribe(TOPIC)
+
+    def on_message(client, userdata, message):
+        ingest.add(message.topic, message.payload)
+
+    try:
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    except AttributeError:
+        # paho-mqtt 1.x
+        client = mqtt.Client()
+    if user:
+        client.username_pw_set(user, password)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(host, port)
+
+    # The network loop runs in its own thread, and only queues the messages
+    client.loop_start()
+    return client
+
+
+def run(host, port, user, password, data, interval):
+    """Subscribes to sensors/# on the broker, and stores the readings until Ctrl-C."""
+    ingest = Ingest(ColumnStore(data))
+    client = subscribe(ingest, host, port, user, password)
+    try:
+        while True:
+            time.sleep(interval)
+            stored = ingest.flush()
+            if stored:
+                print('Stored {} readings ({} stored, {} bad messages in total)'.format(
+                    stored, ingest.stats[0], ingest.stats[1]))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.loop_stop()
+        ingest.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stores the readings published under sensors/#')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--user')
+    parser.add_argument('--password')
+    parser.add_argument('--data', default='data', help='directory of the column files')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between writes')
+    args = parser.parse_args()
+
+    run(args.host, args.port, args.user, args.password, args.data, args.interval)
+
+
+if __name__ == '__main__':
+    main()
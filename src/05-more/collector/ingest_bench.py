@@ -0,0 +1,97 @@
+"""
+    --------------------------------------------------------------------------------------
+    ingest_bench.py
+    --------------------------------------------------------------------------------------
+    Measures how many messages per second ingest.py decodes and stores, for JSON
+    readings like dht_sensor_mqtt.py's (flushed in batches, as run() does), with and
+    without a bad message in each batch, and for binary batches from sensor_batch.py,
+    then reads the day back and checks every reading.
+
+    Runs on a computer with CPython and NumPy:
+        python ingest_bench.py [messages]
+    --------------------------------------------------------------------------------------
+"""
+
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(1, os.path.join(HERE, '..', '..', '04-networkedSensors'))
+if 'ustruct' not in sys.modules:
+    sys.modules['ustruct'] = struct
+
+import numpy as np
+
+import ingest
+import sensor_batch
+
+MESSAGES = 200000
+FLUSH_EVERY = 20000
+
+
+def json_messages(count):
+    return [json.dumps({'device': 'node%d' % (i % 50), 'location': 'room %d' % (i % 7),
+                        'temperature_F': 70 + i % 10 / 10, 'humidity': 40.5}).encode()
+            for i in range(count)]
+
+
+def batch_messages(count, readings=60):
+    clock = [time.time() - readings * 5]
+    sensor_batch.time = types.SimpleNamespace(time=lambda: clock[0])
+    batch = sensor_batch.Batch('node1', 'attic', (('temperature_F', 2), ('humidity', 1)))
+    for i in range(readings):
+        batch.add(60 + i % 10, 30.5)
+        clock[0] += 5
+    return [batch.encode()] * count
+
+
+def _ingest(messages, topic, bad=False):
+    with tempfile.TemporaryDirectory() as tmp:
+        ing = ingest.Ingest(ingest.ColumnStore(tmp))
+        start = time.perf_counter()
+        for i, message in enumerate(messages):
+            ing.add(topic, message)
+            if i % FLUSH_EVERY == FLUSH_EVERY - 1:
+                if bad:
+                    ing.add(topic, b'1,{"device": "x"}')
+                ing.flush()
+        ing.flush()
+        elapsed = time.perf_counter() - start
+
+        days = os.listdir(tmp)
+        columns = {}
+        for day in days:
+            for name, values in ing.store.read(day).items():
+                columns.setdefault(name, []).append(values)
+        columns = {name: np.concatenate(values) for name, values in columns.items()}
+    return elapsed, ing.stats, columns
+
+
+def run(messages=MESSAGES):
+    elapsed, stats, columns = _ingest(json_messages(messages), 'sensors/environmental')
+    assert stats == [messages, 0] and len(columns['time']) == messages
+    assert list(columns['device'][:51]) == ['node%d' % (i % 50) for i in range(51)]
+    assert (columns['temperature_F'] == 70 + np.arange(messages) % 10 / 10).all()
+    print('JSON: {:.0f} messages/s'.format(messages / elapsed))
+
+    elapsed, stats, columns = _ingest(json_messages(messages), 'sensors/environmental', bad=True)
+    assert stats == [messages, messages // FLUSH_EVERY] and len(columns['time']) == messages
+    assert (columns['temperature_F'] == 70 + np.arange(messages) % 10 / 10).all()
+    print('JSON with a bad message in each flush: {:.0f} messages/s'.format(messages / elapsed))
+
+    count = messages // 60
+    elapsed, stats, columns = _ingest(batch_messages(count), 'sensors/environmental/batch')
+    assert stats == [count * 60, 0] and len(columns['time']) == count * 60
+    assert (columns['temperature_F'] == np.tile(60 + np.arange(60) % 10, count)).all()
+    print('Binary batches of 60 readings: {:.0f} batches/s, {:.0f} readings/s'.format(
+        count / elapsed, count * 60 / elapsed))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else MESSAGES)
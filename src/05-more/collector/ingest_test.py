@@ -0,0 +1,326 @@
+"""
+Checks ingest.py on a temporary data directory, with readings as the sensor nodes
+publish them: JSON messages, and binary batches made with sensor_batch.py, bad
+messages, appends cut short, and messages through an in-process fake broker.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+import types
+
+import numpy as np
+import pytest
+
+import ingest
+import sensor_batch
+
+BATCH_TOPIC = 'sensors/environmental/batch'
+
+
+def make_batch(monkeypatch, start, count=5, step=5):
+    """A batch of count readings, step seconds apart, from a node whose clock reads start."""
+    clock = [start]
+    monkeypatch.setattr(sensor_batch, 'time', types.SimpleNamespace(time=lambda: clock[0]))
+    batch = sensor_batch.Batch('node1', 'attic', (('temperature_F', 2), ('humidity', 1)))
+    for i in range(count):
+        batch.add(60 + i, 30.5)
+        clock[0] += step
+    return batch.encode()
+
+
+def stored_times(ing, day):
+    return ing.store.read(time.strftime('%Y-%m-%d', time.gmtime(day)))['time']
+
+
+def test_batch_times_from_a_set_clock_are_kept(tmp_path, monkeypatch):
+    ing = ingest.Ingest(ingest.ColumnStore(str(tmp_path)))
+    start = int(time.time()) - 100
+    ing.add(BATCH_TOPIC, make_batch(monkeypatch, start))
+    assert ing.flush() == 5
+    assert list(stored_times(ing, start)) == [start + 5 * i for i in range(5)]
+
+
+def test_batch_times_from_an_unset_clock_end_when_received(tmp_path, monkeypatch):
+    ing = ingest.Ingest(ingest.ColumnStore(str(tmp_path)))
+    # A node that was never synced counts from 2000-01-01 when it starts
+    ing.add(BATCH_TOPIC, make_batch(monkeypatch, sensor_batch.EPOCH_2000 + 300))
+    received = ing.received[0]
+    assert ing.flush() == 5
+    times = stored_times(ing, received)
+    assert len(times) == 5
+    assert times[-1] == received
+    assert list(np.diff(times)) == [5] * 4
+
+
+def test_batch_times_across_a_clock_sync():
+    # The clock was set between the second and third readings
+    received = 1700000000.0
+    times = [946684900, 946684905, 1699999990, 1699999995, 1700000000]
+    assert ingest._batch_times(times, received) == [received, received] + times[2:]
+
+    # Times too far ahead of the collector are not believed either
+    times = [received + 7200, received + 7205]
+    assert ingest._batch_times(times, received) == [received - 5, received]
+
+
+def test_json_times(tmp_path):
+    ing = ingest.Ingest(ingest.ColumnStore(str(tmp_path)))
+    now = int(time.time())
+    for t in (now - 10, 946684800 + 300, 'soon', True):
+        ing.add('sensors/x', json.dumps({'device': 'n', 'time': t}).encode())
+    ing.add('sensors/x', b'{"device": "n"}')
+    received = ing.received
+    assert ing.flush() == 5
+    times = stored_times(ing, now)
+    assert list(times) == [now - 10] + received[1:]
+
+
+# Messages that aren't one JSON value each must not shift the rows against their
+# topics, whether or not the row count still adds up
+@pytest.mark.parametrize('bad', [
+    [b'1,{"device": "x"}'],
+    [b'{"device": "x"},{"device": "y"}'],
+    [b'[1', b'2]'],
+    [b'{"device": "x"},{"device": ', b'"y"}'],
+    # Each looks like an object, and together they still make one row each
+    [b'{"x": "}', b'{"}', b'{"device": "x"},{"device": "y"}'],
+])
+def test_misaligned_payloads(tmp_path, bad):
+    ing = ingest.Ingest(ingest.ColumnStore(str(tmp_path)))
+    ing.add('sensors/a', b'{"device": "a", "v": 1}')
+    for n, payload in enumerate(bad):
+        ing.add('sensors/bad%d' % n, payload)
+    ing.add('sensors/b', b' {"device": "b", "v": 2}\n')
+    received = ing.received[0]
+    assert ing.flush() == 2
+    assert ing.stats == [2, len(bad)]
+    day = ing.store.read(time.strftime('%Y-%m-%d', time.gmtime(received)))
+    assert list(day['device']) == ['a', 'b']
+    assert list(day['topic']) == ['sensors/a', 'sensors/b']
+    assert list(day['v']) == [1, 2]
+
+
+def test_field_names(tmp_path, monkeypatch):
+    ing = ingest.Ingest(ingest.ColumnStore(str(tmp_path)))
+    fields = {'temp F': 1, 'temp_F': 2, 'temp-20F': 3, 'topic': 'mine', 'topic-msg': 4, 'é': 5, '': 6}
+    ing.add('sensors/a', json.dumps(dict(fields, device='a')).encode())
+    monkeypatch.setattr(sensor_batch, 'time', types.SimpleNamespace(time=time.time))
+    batch = sensor_batch.Batch('node1', 'attic', (('device', 0), ('time', 0), ('v', 0)))
+    batch.add(7, 8, 9)
+    ing.add(BATCH_TOPIC, batch.encode())
+    received = ing.received[0]
+    assert ing.flush() == 2
+
+    # Every field gets its own column, and the columns ingest adds are kept
+    day = ing.store.read(time.strftime('%Y-%m-%d', time.gmtime(received)))
+    assert sorted(day) == sorted(['device', 'device-msg', 'temp-20F', 'temp-2d20F', 'temp_F', 'time', 'location',
+                                  'time-msg', 'topic', 'topic-2dmsg', 'topic-msg', 'v', '-c3-a9'])
+    assert [list(day[name][:1]) for name in ('temp-20F', 'temp_F', 'temp-2d20F', 'topic-2dmsg', '-c3-a9')] == [
+        [1], [2], [3], [4], [5]]
+    assert list(day['topic']) == ['sensors/a', BATCH_TOPIC]
+    assert list(day['topic-msg']) == ['mine', None]
+    assert list(day['device']) == ['a', 'node1']
+    assert list(day['device-msg'][1:]) == [7] and list(day['time-msg'][1:]) == [8]
+
+    with pytest.raises(ValueError):
+        ing.store.append({'time': [received], 'temp F': [1.0]})
+
+
+def test_column_lengths(tmp_path):
+    store = ingest.ColumnStore(str(tmp_path))
+    now = time.time()
+    for columns in ({'time': [now, now], 'v': [1.0]},
+                    {'time': [now, now + 86400], 'device': ['a', 'b', 'c']}):
+        with pytest.raises(ValueError):
+            store.append(columns)
+    partition = store.partition(int(now // 86400))
+    with pytest.raises(ValueError):
+        partition.append({'time': [now], 'v': [1.0, 2.0]}, 1)
+    assert os.listdir(partition.path) == []
+
+
+def _day_files(path):
+    return {name: os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)}
+
+
+def test_interrupted_append(tmp_path):
+    store = ingest.ColumnStore(str(tmp_path))
+    now = time.time()
+    store.append({'time': [now, now], 'v': [1.0, 2.0], 'device': ['a', 'b']})
+    day = time.strftime('%Y-%m-%d', time.gmtime(now))
+    path = os.path.join(str(tmp_path), day)
+
+    # Stopped in the middle of the next append: some columns got their
+    # values, time.f8 didn't
+    with open(os.path.join(path, 'v.f8'), 'ab') as f:
+        f.write(b'\0' * 12)
+    with open(os.path.join(path, 'device.u4'), 'ab') as f:
+        f.write(b'\0' * 4)
+    with open(os.path.join(path, 'w.f8'), 'wb') as f:
+        # A new column: padding for the rows before, then part of a value
+        np.full(2, np.nan).tofile(f)
+        f.write(b'\0' * 3)
+    sizes = _day_files(path)
+
+    # Reading leaves the files alone
+    columns = ingest.ColumnStore(str(tmp_path)).read(day)
+    assert _day_files(path) == sizes
+    assert list(columns['v']) == [1.0, 2.0] and list(columns['device']) == ['a', 'b']
+    assert len(columns['w']) == 2
+
+    # Opening the day to append drops the partial rows
+    store = ingest.ColumnStore(str(tmp_path))
+    store.append({'time': [now], 'v': [3.0], 'device': ['c']})
+    columns = store.read(day)
+    assert list(columns['v']) == [1.0, 2.0, 3.0] and list(columns['device']) == ['a', 'b', 'c']
+    assert all(len(values) == 3 for values in columns.values())
+    assert np.isnan(columns['w']).all()
+
+
+def test_interrupted_first_append(tmp_path):
+    now = time.time()
+    day = time.strftime('%Y-%m-%d', time.gmtime(now))
+    path = os.path.join(str(tmp_path), day)
+    os.makedirs(path)
+    # The first append of the day never got to time.f8
+    with open(os.path.join(path, 'v.f8'), 'wb') as f:
+        f.write(b'\0' * 16)
+    with open(os.path.join(path, 'device.u4'), 'wb') as f:
+        f.write(b'\0' * 8)
+    with open(os.path.join(path, 'device.dict'), 'w') as f:
+        f.write('"a"\n')
+
+    assert all(len(values) == 0 for values in ingest.ColumnStore(str(tmp_path)).read(day).values())
+    store = ingest.ColumnStore(str(tmp_path))
+    store.append({'time': [now], 'v': [1.0], 'device': ['b']})
+    columns = store.read(day)
+    assert list(columns['v']) == [1.0] and list(columns['device']) == ['b']
+    assert list(columns['time']) == [now]
+
+
+class FakeBroker(socketserver.ThreadingTCPServer):
+    """Just enough of an MQTT broker for QoS 0: CONNECT, SUBSCRIBE to a filter ending in '#', PUBLISH."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), FakeBrokerHandler)
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.published = 0
+
+
+def _packet(kind, body):
+    header = bytearray([kind])
+    n = len(body)
+    while True:
+        header.append((n & 0x7F) | (0x80 if n > 0x7F else 0))
+        n >>= 7
+        if not n:
+            return bytes(header) + body
+
+
+class FakeBrokerHandler(socketserver.StreamRequestHandler):
+    def _read(self, n):
+        data = self.rfile.read(n)
+        if len(data) < n:
+            raise EOFError
+        return data
+
+    def handle(self):
+        broker = self.server
+        try:
+            while True:
+                kind = self._read(1)[0]
+                n = shift = 0
+                while True:
+                    byte = self._read(1)[0]
+                    n |= (byte & 0x7F) << shift
+                    shift += 7
+                    if byte < 0x80:
+                        break
+                body = self._read(n)
+                with broker.lock:
+                    if kind & 0xF0 == 0x10:
+                        self.wfile.write(b'\x20\x02\x00\x00')
+                    elif kind & 0xF0 == 0x80:
+                        size = struct.unpack('>H', body[2:4])[0]
+                        prefix = body[4:4 + size].decode().rstrip('#')
+                        broker.subscribers.append((prefix, self.wfile))
+                        self.wfile.write(b'\x90\x03' + body[:2] + b'\x00')
+                    elif kind & 0xF0 == 0x30:
+                        size = struct.unpack('>H', body[:2])[0]
+                        topic = body[2:2 + size].decode()
+                        broker.published += 1
+                        for prefix, wfile in broker.subscribers:
+                            if topic.startswith(prefix):
+                                wfile.write(_packet(0x30, body))
+                    elif kind & 0xF0 == 0xC0:
+                        self.wfile.write(b'\xd0\x00')
+                    elif kind & 0xF0 == 0xE0:
+                        break
+        except (EOFError, OSError):
+            pass
+        with broker.lock:
+            broker.subscribers = [s for s in broker.subscribers if s[1] is not self.wfile]
+
+
+def _publisher(port):
+    sock = socket.create_connection(('127.0.0.1', port))
+    client_id = b'test'
+    sock.sendall(_packet(0x10, b'\x00\x04MQTT\x04\x02\x00\x3c' + struct.pack('>H', len(client_id)) + client_id))
+    assert sock.recv(4) == b'\x20\x02\x00\x00'
+    return sock
+
+
+def _publish(sock, topic, payload):
+    topic = topic.encode()
+    sock.sendall(_packet(0x30, struct.pack('>H', len(topic)) + topic + payload))
+
+
+@pytest.fixture
+def broker():
+    broker = FakeBroker()
+    threading.Thread(target=broker.serve_forever, daemon=True).start()
+    yield broker
+    broker.shutdown()
+    broker.server_close()
+
+
+def test_through_a_broker(broker, tmp_path, monkeypatch):
+    pytest.importorskip('paho.mqtt.client')
+    port = broker.server_address[1]
+    ing = ingest.Ingest(ingest.ColumnStore(str(tmp_path)))
+    client = ingest.subscribe(ing, '127.0.0.1', port)
+    deadline = time.time() + 5
+    while not broker.subscribers and time.time() < deadline:
+        time.sleep(0.01)
+
+    count = 2000
+    sock = _publisher(port)
+    for i in range(count):
+        _publish(sock, 'sensors/environmental', b'{"device": "n%d", "temperature_F": %d}' % (i % 3, i))
+    _publish(sock, 'other/topic', b'{"device": "x"}')
+    _publish(sock, 'sensors/environmental/batch', make_batch(monkeypatch, int(time.time()) - 100))
+
+    stored = 0
+    while stored < count + 5 and time.time() < deadline:
+        time.sleep(0.05)
+        stored += ing.flush()
+    sock.close()
+    client.loop_stop()
+    client.disconnect()
+
+    assert stored == count + 5 and broker.published == count + 2
+    columns = ing.store.read(time.strftime('%Y-%m-%d', time.gmtime()))
+    assert len(columns['time']) == count + 5
+    assert list(columns['temperature_F'][:count]) == list(range(count))
+    assert list(columns['device'][:3]) == ['n0', 'n1', 'n2']
+    assert list(columns['topic'][count:]) == ['sensors/environmental/batch'] * 5
+
@@ -20,16 +20,59 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-import ustruct
 import time
+from array import array
+
+
+class ChecksumError(OSError):
+    """Raised when a reading fails its CRC check on every attempt."""
+    pass
+
+
+def _crc16_table():
+    table = array('H', bytearray(512))
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            if crc & 0x01:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+        table[i] = crc
+    return table
+
+
+# CRC-16/MODBUS lookup table, one entry per byte value
+_CRC16_TABLE = _crc16_table()
+
 
 class AM2320:
-    def __init__(self, i2c=None, address=0x5c):
+    def __init__(self, i2c=None, address=0x5c, retries=2, retry_delay_ms=5, select=None):
         self.i2c = i2c
         self.address = address
         self.buf = bytearray(8)
+        self.retries = retries
+        self.retry_delay_ms = retry_delay_ms
+        # optional callable that routes the bus to this sensor, e.g. a
+        # multiplexer channel: select=lambda: mux.select(3)
+        self.select = select
     def measure(self):
-        buf = self.buf
+        # retry up to self.retries more times on a bad checksum
+        attempts = self.retries
+        while True:
+            self.request()
+            # wait at least 1.5ms
+            time.sleep_ms(2)
+            if self.collect():
+                return
+            if attempts <= 0:
+                raise ChecksumError("checksum error")
+            attempts -= 1
+            time.sleep_ms(self.retry_delay_ms)
+    def request(self):
+        # wake the sensor and ask it for a reading, without waiting for it
+        if self.select:
+            self.select()
         address = self.address
         # wake sensor
         try:
@@ -38,23 +81,19 @@ class AM2320:
             pass
         # read 4 registers starting at offset 0x00
         self.i2c.writeto(address, b'\x03\x00\x04')
-        # wait at least 1.5ms
-        time.sleep_ms(2)
-        # read data
-        self.i2c.readfrom_mem_into(address, 0, buf)
-        crc = ustruct.unpack('<H', bytearray(buf[-2:]))[0]
-        if (crc != self.crc16(buf[:-2])):
-            raise Exception("checksum error")
-    def crc16(self, buf):
+    def collect(self):
+        # read the data requested at least 1.5ms earlier, True if the CRC is good
+        if self.select:
+            self.select()
+        buf = self.buf
+        self.i2c.readfrom_mem_into(self.address, 0, buf)
+        return self.crc16(buf, 6) == buf[6] | buf[7] << 8
+    def crc16(self, buf, n=None):
+        # CRC of the first n bytes of buf (default all), without slicing
+        table = _CRC16_TABLE
         crc = 0xFFFF
-        for c in buf:
-            crc ^= c
-            for i in range(8):
-                if crc & 0x01:
-                    crc >>= 1
-                    crc ^= 0xA001
-                else:
-                    crc >>= 1
+        for i in range(len(buf) if n is None else n):
+            crc = (crc >> 8) ^ table[(crc ^ buf[i]) & 0xFF]
         return crc
     def humidity(self):
         return (self.buf[2] << 8 | self.buf[3]) * 0.1
@@ -62,4 +101,49 @@ class AM2320:
         t = ((self.buf[4] & 0x7f) << 8 | self.buf[5]) * 0.1
         if self.buf[4] & 0x80:
             t = -t
-        return t
\ No newline at end of file
+        return t
+
+_NAN = float('nan')
+
+class AM2320Group:
+    # Samples several AM2320s with a single wait: every sensor is woken and
+    # commanded first, then all readings are collected after one 2ms delay.
+    # Sensors can sit on separate buses, or behind a multiplexer through
+    # their select callables (all AM2320s share address 0x5c).
+    # A sensor that fails (bad checksums on every retry, or no answer on the
+    # bus) reads NaN and is flagged in failed, the others are still read.
+    def __init__(self, sensors):
+        self.sensors = sensors
+        self.temperatures = array('f', bytearray(4 * len(sensors)))
+        self.humidities = array('f', bytearray(4 * len(sensors)))
+        self.failed = bytearray(len(sensors))
+    def measure(self):
+        # returns the number of sensors that failed
+        sensors = self.sensors
+        failed = self.failed
+        for i in range(len(sensors)):
+            try:
+                sensors[i].request()
+                failed[i] = 0
+            except OSError:
+                failed[i] = 1
+        time.sleep_ms(2)
+        temperatures = self.temperatures
+        humidities = self.humidities
+        failures = 0
+        for i in range(len(sensors)):
+            sensor = sensors[i]
+            if not failed[i]:
+                try:
+                    if not sensor.collect():
+                        # fall back to the retry policy of that sensor alone
+                        sensor.measure()
+                    temperatures[i] = sensor.temperature()
+                    humidities[i] = sensor.humidity()
+                    continue
+                except OSError:
+                    failed[i] = 1
+            temperatures[i] = _NAN
+            humidities[i] = _NAN
+            failures += 1
+        return failures
@@ -0,0 +1,64 @@
+"""
+    --------------------------------------------------------------------------------------
+    am2320_bench.py
+    --------------------------------------------------------------------------------------
+    Compares the AM2320 driver's table-driven CRC16 with the bit-by-bit loop it
+    replaced, on the 6 bytes of a reading.
+
+    Runs on the board or on a computer:
+        import am2320_bench
+        am2320_bench.run()
+    --------------------------------------------------------------------------------------
+"""
+
+import time
+import am2320
+
+try:
+    ticks_us = time.ticks_us
+    ticks_diff = time.ticks_diff
+except AttributeError:
+    # CPython
+    def ticks_us():
+        return int(time.perf_counter() * 1000000)
+
+    def ticks_diff(a, b):
+        return a - b
+
+
+def crc16_bitwise(buf):
+    # The CRC the driver used to compute
+    crc = 0xFFFF
+    for c in buf:
+        crc ^= c
+        for i in range(8):
+            if crc & 0x01:
+                crc >>= 1
+                crc ^= 0xA001
+            else:
+                crc >>= 1
+    return crc
+
+
+def run(count=1000):
+    sensor = am2320.AM2320()
+    buf = bytearray(b'\x03\x04\x01\xf4\x00\xfa\x31\xa5')
+    assert sensor.crc16(buf, 6) == crc16_bitwise(buf[:6])
+
+    start = ticks_us()
+    for _ in range(count):
+        crc16_bitwise(buf[:6])
+    bitwise = ticks_diff(ticks_us(), start)
+
+    start = ticks_us()
+    for _ in range(count):
+        sensor.crc16(buf, 6)
+    table = ticks_diff(ticks_us(), start)
+
+    print('bit loop: {:.1f} us per reading'.format(bitwise / count))
+    print('table:    {:.1f} us per reading ({:.1f}x faster)'.format(table / count, bitwise / table))
+    return bitwise, table
+
+
+if __name__ == '__main__':
+    run()
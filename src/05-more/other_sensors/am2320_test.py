@@ -0,0 +1,144 @@
+"""
+Golden-vector tests of the AM2320 driver's CRC16 (CRC-16/MODBUS), and of its
+retry policy and AM2320Group on fake I2C buses that return corrupted readings.
+"""
+
+import time
+
+import pytest
+
+import am2320
+import tca9548a
+
+# (data, CRC-16/MODBUS)
+VECTORS = [
+    (b'123456789', 0x4B37),  # the standard check value
+    (b'', 0xFFFF),
+    (b'\x00', 0x40BF),
+    (b'\xff' * 6, 0x9401),
+    (bytes.fromhex('030401F400FA'), 0xA531),  # the reading in the AM2320 datasheet
+    (bytes(range(256)), 0xDE6C),
+]
+
+# A reading of 50.0 %RH and 25.0 degrees C, with its CRC (low byte first)
+READING = bytes.fromhex('030401F400FA31A5')
+
+if not hasattr(time, 'sleep_ms'):
+    time.sleep_ms = lambda ms: None
+
+
+class FakeI2C:
+    """Returns the given readings, one per read, and then the last one forever."""
+
+    def __init__(self, readings):
+        self.readings = list(readings)
+        self.reads = 0
+
+    def writeto(self, address, data):
+        pass
+
+    def readfrom_mem_into(self, address, register, buf):
+        buf[:] = self.readings[min(self.reads, len(self.readings) - 1)]
+        self.reads += 1
+
+
+def corrupt(reading):
+    bad = bytearray(reading)
+    bad[3] ^= 0x01
+    return bytes(bad)
+
+
+def test_vectors():
+    sensor = am2320.AM2320()
+    for data, crc in VECTORS:
+        assert sensor.crc16(data) == crc, (data, hex(sensor.crc16(data)))
+
+
+def test_length_argument():
+    sensor = am2320.AM2320()
+    buf = bytearray(b'123456789\xAA\xBB')
+    assert sensor.crc16(buf, 9) == 0x4B37
+    assert sensor.crc16(memoryview(buf), 9) == 0x4B37
+
+
+def test_measure():
+    sensor = am2320.AM2320(FakeI2C([READING]))
+    sensor.measure()
+    assert round(sensor.humidity(), 1) == 50.0
+    assert round(sensor.temperature(), 1) == 25.0
+
+
+def test_retries_bad_checksums():
+    bus = FakeI2C([corrupt(READING), corrupt(READING), READING])
+    sensor = am2320.AM2320(bus, retries=2)
+    sensor.measure()
+    assert bus.reads == 3
+
+
+def test_checksum_error_after_retries():
+    bus = FakeI2C([corrupt(READING)])
+    sensor = am2320.AM2320(bus, retries=1)
+    with pytest.raises(am2320.ChecksumError):
+        sensor.measure()
+    assert bus.reads == 2
+    assert issubclass(am2320.ChecksumError, OSError)
+
+
+
+class MuxBus:
+    """A TCA9548A at 0x70, with a FakeI2C standing in for the AM2320 on some of its channels."""
+
+    def __init__(self, channels):
+        self.channels = channels
+        self.channel = None
+
+    def _sensor(self):
+        if self.channel not in self.channels:
+            raise OSError(19)  # nothing answers at 0x5c
+        return self.channels[self.channel]
+
+    def writeto(self, address, data):
+        if address == tca9548a.TCA9548A_I2CADDR:
+            self.channel = data[0].bit_length() - 1
+        else:
+            self._sensor().writeto(address, data)
+
+    def readfrom_mem_into(self, address, register, buf):
+        self._sensor().readfrom_mem_into(address, register, buf)
+
+
+def test_group_keeps_going_after_a_failure(monkeypatch):
+    waits = []
+    monkeypatch.setattr(time, 'sleep_ms', waits.append, raising=False)
+    # 25.0 degrees C on channel 0, -1.0 degrees C and 60.1 %RH on channel 2
+    cold = bytearray.fromhex('03040259800A')
+    crc = am2320.AM2320().crc16(cold)
+    cold += bytes((crc & 0xFF, crc >> 8))
+    channels = {
+        0: FakeI2C([READING]),
+        1: FakeI2C([corrupt(READING)]),              # always fails its checksum
+        2: FakeI2C([corrupt(READING), bytes(cold)]),  # good on the retry
+    }
+    bus = MuxBus(channels)
+    mux = tca9548a.TCA9548A(bus)
+    sensors = [am2320.AM2320(bus, retries=1, select=lambda ch=ch: mux.select(ch)) for ch in range(4)]
+    group = am2320.AM2320Group(sensors)
+
+    # Channel 3 has no sensor at all
+    assert group.measure() == 2
+    assert list(group.failed) == [0, 1, 0, 1]
+    assert round(group.temperatures[0], 1) == 25.0 and round(group.humidities[0], 1) == 50.0
+    assert round(group.temperatures[2], 1) == -1.0 and round(group.humidities[2], 1) == 60.1
+    for i in (1, 3):
+        assert group.temperatures[i] != group.temperatures[i]  # NaN
+        assert group.humidities[i] != group.humidities[i]
+    # One wait for the whole group, then the retries of the failing sensors alone
+    assert waits[0] == 2 and waits.count(2) == 1 + 2 + 1
+    assert channels[1].reads == 3
+
+    # A sensor that recovers reads again on the next measurement
+    channels[1].readings = [READING]
+    channels[1].reads = 0
+    assert group.measure() == 1
+    assert list(group.failed) == [0, 0, 0, 1]
+    assert round(group.temperatures[1], 1) == 25.0
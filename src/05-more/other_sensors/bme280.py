@@ -5,17 +5,34 @@
 
 from machine import I2C
 import time
+import ustruct
 
 # BME280 default address.
 BME280_I2CADDR = 0x76
 
 # Operating Modes
+BME280_OSAMPLE_SKIP = 0
 BME280_OSAMPLE_1 = 1
 BME280_OSAMPLE_2 = 2
 BME280_OSAMPLE_4 = 3
 BME280_OSAMPLE_8 = 4
 BME280_OSAMPLE_16 = 5
 
+# Power Modes
+BME280_SLEEP_MODE = 0
+BME280_FORCED_MODE = 1
+BME280_NORMAL_MODE = 3
+
+# Standby time between conversions in normal mode
+BME280_STANDBY_0_5 = 0
+BME280_STANDBY_62_5 = 1
+BME280_STANDBY_125 = 2
+BME280_STANDBY_250 = 3
+BME280_STANDBY_500 = 4
+BME280_STANDBY_1000 = 5
+BME280_STANDBY_10 = 6
+BME280_STANDBY_20 = 7
+
 # BME280 Registers
 
 BME280_REGISTER_DIG_T1 = 0x88  # Trimming parameter registers
@@ -45,12 +62,23 @@ BME280_REGISTER_VERSION = 0xD1
 BME280_REGISTER_SOFTRESET = 0xE0
 
 BME280_REGISTER_CONTROL_HUM = 0xF2
+BME280_REGISTER_STATUS = 0xF3
 BME280_REGISTER_CONTROL = 0xF4
 BME280_REGISTER_CONFIG = 0xF5
 BME280_REGISTER_PRESSURE_DATA = 0xF7
 BME280_REGISTER_TEMP_DATA = 0xFA
 BME280_REGISTER_HUMIDITY_DATA = 0xFD
 
+# Status register bit that is set while a conversion is running
+BME280_STATUS_MEASURING = 0x08
+
+# Lengths of the trimming parameter blocks (0x88 - 0xA1 and 0xE1 - 0xE7)
+BME280_CALIBRATION_TP_LENGTH = 26
+BME280_CALIBRATION_H_LENGTH = 7
+
+# Length of the pressure/temperature/humidity data block (0xF7 - 0xFE)
+BME280_DATA_LENGTH = 8
+
 
 class Device:
     """
@@ -97,6 +125,14 @@ class Device:
 
         return int.from_bytes(self._i2c.readfrom(self._address, 1),'little') & 0xFF
 
+    def readInto(self, register, buf):
+        """
+        Read len(buf) consecutive registers, starting at the specified
+        register, into buf using a single bus transaction.
+        """
+
+        self._i2c.readfrom_mem_into(self._address, register, buf)
+
     def readU8(self, register):
         """Read an unsigned byte from the specified register."""
 
@@ -169,7 +205,19 @@ class Device:
 
 class BME280:
 
-    def __init__(self, mode=BME280_OSAMPLE_1, address=BME280_I2CADDR, i2c=None, **kwargs):
+    def __init__(self, mode=BME280_OSAMPLE_1, address=BME280_I2CADDR, i2c=None,
+                 osample_t=None, osample_p=None, osample_h=None,
+                 power_mode=BME280_FORCED_MODE, standby=BME280_STANDBY_1000, **kwargs):
+        """
+        mode sets the oversampling of all three channels. Use osample_t,
+        osample_p and osample_h to override it per channel, or set them to
+        BME280_OSAMPLE_SKIP to leave a channel out of the conversion.
+
+        In BME280_FORCED_MODE a conversion is triggered on every read. In
+        BME280_NORMAL_MODE the sensor converts continuously, pausing for the
+        standby time between conversions, and reads return the latest values.
+        """
+
         # Check that mode is valid.
         if mode not in [BME280_OSAMPLE_1, BME280_OSAMPLE_2, BME280_OSAMPLE_4,
                         BME280_OSAMPLE_8, BME280_OSAMPLE_16]:
@@ -186,51 +234,135 @@ class BME280:
 
         self._device = Device(address, i2c)
 
+        # Buffer for burst reads of the whole data block.
+        self._data = bytearray(BME280_DATA_LENGTH)
+
         # Load calibration values.
         self._load_calibration()
-        self._device.write8(BME280_REGISTER_CONTROL, 0x3F)
         self.t_fine = 0
 
+        self.configure(mode if osample_t is None else osample_t,
+                       mode if osample_p is None else osample_p,
+                       mode if osample_h is None else osample_h,
+                       power_mode, standby)
+
+    def configure(self, osample_t, osample_p, osample_h,
+                  power_mode=BME280_FORCED_MODE, standby=BME280_STANDBY_1000):
+        """
+        Sets the per channel oversampling, the power mode and the normal mode
+        standby time, and works out how long a conversion takes with them.
+        """
+
+        for osample in (osample_t, osample_p, osample_h):
+            if not BME280_OSAMPLE_SKIP <= osample <= BME280_OSAMPLE_16:
+                raise ValueError('Unexpected oversampling value {0}'.format(osample))
+
+        if power_mode not in (BME280_FORCED_MODE, BME280_NORMAL_MODE):
+            raise ValueError('Unexpected power mode {0}'.format(power_mode))
+
+        self._power_mode = power_mode
+        self._ctrl_meas = osample_t << 5 | osample_p << 2
+
+        # Conversion time from the datasheet (section 9.1), in microseconds.
+        # Each enabled channel takes 2ms (2.3ms max) per sample, and pressure
+        # and humidity add 0.5ms (0.575ms max) of setup time.
+        typ = 1000
+        max_ = 1250
+        for i, osample in enumerate((osample_t, osample_p, osample_h)):
+            if osample:
+                samples = 1 << (osample - 1)
+                typ += 2000 * samples + (500 if i else 0)
+                max_ += 2300 * samples + (575 if i else 0)
+        self._typ_time = typ
+        self._max_time = max_
+
+        # The sensor must be in sleep mode for the config register to be
+        # written, and ctrl_hum only takes effect after ctrl_meas is written.
+        self._device.write8(BME280_REGISTER_CONTROL, self._ctrl_meas | BME280_SLEEP_MODE)
+        self._device.write8(BME280_REGISTER_CONFIG, (standby & 0x07) << 5)
+        self._device.write8(BME280_REGISTER_CONTROL_HUM, osample_h)
+
+        if power_mode == BME280_NORMAL_MODE:
+            # Start converting, and give the first conversion time to finish.
+            self._device.write8(BME280_REGISTER_CONTROL, self._ctrl_meas | power_mode)
+            time.sleep_us(self._max_time)
+
+    def measurement_time(self):
+        """
+        Returns the typical and maximum conversion time, in microseconds,
+        for the current oversampling settings as (typical, maximum).
+        """
+
+        return self._typ_time, self._max_time
+
     def _load_calibration(self):
-        self.dig_T1 = self._device.readU16LE(BME280_REGISTER_DIG_T1)
-        self.dig_T2 = self._device.readS16LE(BME280_REGISTER_DIG_T2)
-        self.dig_T3 = self._device.readS16LE(BME280_REGISTER_DIG_T3)
-
-        self.dig_P1 = self._device.readU16LE(BME280_REGISTER_DIG_P1)
-        self.dig_P2 = self._device.readS16LE(BME280_REGISTER_DIG_P2)
-        self.dig_P3 = self._device.readS16LE(BME280_REGISTER_DIG_P3)
-        self.dig_P4 = self._device.readS16LE(BME280_REGISTER_DIG_P4)
-        self.dig_P5 = self._device.readS16LE(BME280_REGISTER_DIG_P5)
-        self.dig_P6 = self._device.readS16LE(BME280_REGISTER_DIG_P6)
-        self.dig_P7 = self._device.readS16LE(BME280_REGISTER_DIG_P7)
-        self.dig_P8 = self._device.readS16LE(BME280_REGISTER_DIG_P8)
-        self.dig_P9 = self._device.readS16LE(BME280_REGISTER_DIG_P9)
-
-        self.dig_H1 = self._device.readU8(BME280_REGISTER_DIG_H1)
-        self.dig_H2 = self._device.readS16LE(BME280_REGISTER_DIG_H2)
-        self.dig_H3 = self._device.readU8(BME280_REGISTER_DIG_H3)
-        self.dig_H6 = self._device.readS8(BME280_REGISTER_DIG_H7)
-
-        h4 = self._device.readS8(BME280_REGISTER_DIG_H4)
-        h4 = (h4 << 24) >> 20
-        self.dig_H4 = h4 | (self._device.readU8(BME280_REGISTER_DIG_H5) & 0x0F)
-
-        h5 = self._device.readS8(BME280_REGISTER_DIG_H6)
-        h5 = (h5 << 24) >> 20
-        self.dig_H5 = h5 | (self._device.readU8(BME280_REGISTER_DIG_H5) >> 4 & 0x0F)
+        # Read the two trimming parameter blocks (0x88 - 0xA1 and 0xE1 - 0xE7)
+        # with one bus transaction each.
+        buf = bytearray(BME280_CALIBRATION_TP_LENGTH)
+        self._device.readInto(BME280_REGISTER_DIG_T1, buf)
+
+        (self.dig_T1, self.dig_T2, self.dig_T3,
+         self.dig_P1, self.dig_P2, self.dig_P3, self.dig_P4, self.dig_P5,
+         self.dig_P6, self.dig_P7, self.dig_P8, self.dig_P9) = ustruct.unpack_from('<HhhHhhhhhhhh', buf)
+        self.dig_H1 = buf[25]
+
+        buf = bytearray(BME280_CALIBRATION_H_LENGTH)
+        self._device.readInto(BME280_REGISTER_DIG_H2, buf)
+
+        self.dig_H2, self.dig_H3, e4, e5, e6, self.dig_H6 = ustruct.unpack('<hBbBbb', buf)
+        self.dig_H4 = (e4 << 4) | (e5 & 0x0F)
+        self.dig_H5 = (e6 << 4) | (e5 >> 4)
+
+        # Precompute the terms of the compensation formulas that only depend
+        # on the calibration values, so they aren't re-derived on every sample.
+        self._t1_x2 = self.dig_T1 << 1
+        self._t2_s11 = self.dig_T2 >> 11
+        self._p4_s35 = self.dig_P4 << 35
+        self._p7_s4 = self.dig_P7 << 4
+        self._h4_s20 = self.dig_H4 << 20
+
+    def read_calibration(self):
+        """
+        Returns the raw trimming parameter blocks (0x88 - 0xA1 followed by
+        0xE1 - 0xE7), so raw readings can be compensated somewhere else.
+        """
+
+        buf = bytearray(BME280_CALIBRATION_TP_LENGTH + BME280_CALIBRATION_H_LENGTH)
+        mv = memoryview(buf)
+        self._device.readInto(BME280_REGISTER_DIG_T1, mv[:BME280_CALIBRATION_TP_LENGTH])
+        self._device.readInto(BME280_REGISTER_DIG_H2, mv[BME280_CALIBRATION_TP_LENGTH:])
+
+        return buf
+
+    def _start_conversion(self):
+        """
+        Triggers a forced conversion and waits for it to complete. Does nothing
+        in normal mode, where the data registers always hold the latest values.
+        """
+
+        if self._power_mode == BME280_NORMAL_MODE:
+            return
+
+        self._device.write8(BME280_REGISTER_CONTROL, self._ctrl_meas | BME280_FORCED_MODE)
+        start = time.ticks_us()
+        time.sleep_us(self._typ_time)
+        self._wait_ready(start)
+
+    def _wait_ready(self, start):
+        """
+        Polls the status register until the running conversion is done, for
+        no longer than the maximum conversion time after it was started at
+        time.ticks_us() value start.
+        """
+
+        while self._device.readU8(BME280_REGISTER_STATUS) & BME280_STATUS_MEASURING:
+            if time.ticks_diff(time.ticks_us(), start) > self._max_time:
+                raise OSError('BME280 conversion timed out')
 
     def read_raw_temp(self):
         """Reads the raw (uncompensated) temperature from the sensor."""
 
-        meas = self._mode
-        self._device.write8(BME280_REGISTER_CONTROL_HUM, meas)
-        meas = self._mode << 5 | self._mode << 2 | 1
-        self._device.write8(BME280_REGISTER_CONTROL, meas)
-        sleep_time = 1250 + 2300 * (1 << self._mode)
-
-        sleep_time = sleep_time + 2300 * (1 << self._mode) + 575
-        sleep_time = sleep_time + 2300 * (1 << self._mode) + 575
-        time.sleep_us(sleep_time)  # Wait the required time
+        self._start_conversion()
         msb = self._device.readU8(BME280_REGISTER_TEMP_DATA)
         lsb = self._device.readU8(BME280_REGISTER_TEMP_DATA + 1)
         xlsb = self._device.readU8(BME280_REGISTER_TEMP_DATA + 2)
@@ -264,13 +396,30 @@ class BME280:
 
         return raw
 
+    def read_raw_data(self):
+        """
+        Triggers a conversion and reads the raw (uncompensated) temperature,
+        pressure and humidity in a single burst read of the data registers.
+        Returns the readings as a tuple of (temperature, pressure, humidity).
+        """
+
+        self._start_conversion()
+        self._device.readInto(BME280_REGISTER_PRESSURE_DATA, self._data)
+        d = self._data
+
+        return (((d[3] << 16) | (d[4] << 8) | d[5]) >> 4,
+                ((d[0] << 16) | (d[1] << 8) | d[2]) >> 4,
+                (d[6] << 8) | d[7])
+
     def read_temperature(self):
         """
         Get the compensated temperature in 0.01 of a degree celsius.
         """
 
-        adc = self.read_raw_temp()
-        var1 = ((adc >> 3) - (self.dig_T1 << 1)) * (self.dig_T2 >> 11)
+        return self._compensate_temperature(self.read_raw_temp())
+
+    def _compensate_temperature(self, adc):
+        var1 = ((adc >> 3) - self._t1_x2) * self._t2_s11
         var2 = ((
             (((adc >> 4) - self.dig_T1) * ((adc >> 4) - self.dig_T1)) >> 12) *
             self.dig_T3) >> 14
@@ -281,11 +430,13 @@ class BME280:
     def read_pressure(self):
         """Gets the compensated pressure in Pascals."""
 
-        adc = self.read_raw_pressure()
+        return self._compensate_pressure(self.read_raw_pressure())
+
+    def _compensate_pressure(self, adc):
         var1 = self.t_fine - 128000
         var2 = var1 * var1 * self.dig_P6
         var2 = var2 + ((var1 * self.dig_P5) << 17)
-        var2 = var2 + (self.dig_P4 << 35)
+        var2 = var2 + self._p4_s35
         var1 = (((var1 * var1 * self.dig_P3) >> 8) + ((var1 * self.dig_P2) >> 12))
         var1 = (((1 << 47) + var1) * self.dig_P1) >> 33
 
@@ -297,13 +448,14 @@ class BME280:
         var1 = (self.dig_P9 * (p >> 13) * (p >> 13)) >> 25
         var2 = (self.dig_P8 * p) >> 19
 
-        return ((p + var1 + var2) >> 8) + (self.dig_P7 << 4)
+        return ((p + var1 + var2) >> 8) + self._p7_s4
 
     def read_humidity(self):
-        adc = self.read_raw_humidity()
-        # print 'Raw humidity = {0:d}'.format (adc)
+        return self._compensate_humidity(self.read_raw_humidity())
+
+    def _compensate_humidity(self, adc):
         h = self.t_fine - 76800
-        h = (((((adc << 14) - (self.dig_H4 << 20) - (self.dig_H5 * h)) +
+        h = (((((adc << 14) - self._h4_s20 - (self.dig_H5 * h)) +
             16384) >> 15) * (((((((h * self.dig_H6) >> 10) * (((h *
             self.dig_H3) >> 11) + 32768)) >> 10) + 2097152) *
             self.dig_H2 + 8192) >> 14))
@@ -332,9 +484,13 @@ class BME280:
         as (temperature, humidity, pressure).
         """
 
-        t = self.temperature()
-        h = self.humidity()
-        p = self.pressure()
+        adc_t, adc_p, adc_h = self.read_raw_data()
+
+        t = self._compensate_temperature(adc_t) / 100
+        if temperature_unit.upper() == 'F':
+            t = t * 1.8 + 32
+        h = self._compensate_humidity(adc_h) / 1024
+        p = (self._compensate_pressure(adc_p) // 256) / 100
 
         if precision > 0:
             return (round(t, precision), round(h, precision), round(p, precision))
@@ -0,0 +1,51 @@
+"""
+    --------------------------------------------------------------------------------------
+    bme280_bench.py
+    --------------------------------------------------------------------------------------
+    Compares the I2C traffic of reading the BME280 registers one by one
+    (read_raw_temp(), read_raw_pressure() and read_raw_humidity()) with the single
+    burst read of read_raw_data(), on the simulated sensor of bme280_sim.py.
+
+    Runs on a computer with CPython:
+        python bme280_bench.py
+    --------------------------------------------------------------------------------------
+"""
+
+import bme280_sim
+import bme280
+
+BUS_FREQUENCY = 10000  # The bus clock used by bme280Sensor.py
+SAMPLES = 100
+
+
+def per_register(sensor):
+    return sensor.read_raw_temp(), sensor.read_raw_pressure(), sensor.read_raw_humidity()
+
+
+def burst(sensor):
+    return sensor.read_raw_data()
+
+
+def run(samples=SAMPLES):
+    bus = bme280_sim.FakeI2C(freq=BUS_FREQUENCY)
+    sensor = bme280.BME280(i2c=bus)
+
+    results = {}
+    for name, read in (('per register', per_register), ('burst', burst)):
+        bus.reset_counts()
+        start = bus.clock.now
+        slept = bus.clock.slept
+        for _ in range(samples):
+            raw = read(sensor)
+        # Time on the bus only, without waiting for the conversions
+        bus_us = bus.clock.now - start - (bus.clock.slept - slept)
+        results[name] = raw
+        print('{:12}  {:5.1f} transactions  {:5.1f} bytes  {:6.0f} us on the bus per sample'.format(
+            name, bus.transactions / samples, bus.bytes / samples, bus_us / samples))
+
+    assert results['per register'] == results['burst'], 'both paths must read the same values'
+    return results
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,78 @@
+"""
+Checks on the simulated sensor of bme280_sim.py that the BME280 driver waits for
+conversions as long as the configured oversampling needs, and no longer.
+"""
+
+import pytest
+
+import bme280_sim
+import bme280
+
+SKIP = bme280.BME280_OSAMPLE_SKIP
+SETTINGS = [
+    (bme280.BME280_OSAMPLE_1, bme280.BME280_OSAMPLE_1, bme280.BME280_OSAMPLE_1),
+    (bme280.BME280_OSAMPLE_16, bme280.BME280_OSAMPLE_16, bme280.BME280_OSAMPLE_16),
+    (bme280.BME280_OSAMPLE_2, SKIP, SKIP),
+    (bme280.BME280_OSAMPLE_1, bme280.BME280_OSAMPLE_8, SKIP),
+    (bme280.BME280_OSAMPLE_4, SKIP, bme280.BME280_OSAMPLE_2),
+]
+
+
+@pytest.fixture
+def bus():
+    return bme280_sim.FakeI2C(freq=400000)
+
+
+def sensor_on(bus, osample_t, osample_p, osample_h):
+    return bme280.BME280(i2c=bus, osample_t=osample_t, osample_p=osample_p, osample_h=osample_h)
+
+
+@pytest.mark.parametrize('setting', SETTINGS)
+def test_measurement_time_tracks_oversampling(bus, setting):
+    typ, max_ = sensor_on(bus, *setting).measurement_time()
+    ctrl_meas = setting[0] << 5 | setting[1] << 2
+    assert typ == bme280_sim.conversion_time(ctrl_meas, setting[2])
+    assert typ < max_
+
+
+@pytest.mark.parametrize('setting', SETTINGS)
+def test_wait_tracks_conversion(bus, setting):
+    sensor_on(bus, *setting).read_raw_data()
+    started, duration = bus.conversion
+    waited = bus.data_read_at - started
+
+    # Never reads before the conversion is done, and at most one status poll
+    # (one byte read) later
+    poll_us = 9 * 4 * 1000000 // bus.freq
+    assert duration <= waited <= duration + poll_us
+
+
+def test_slow_conversion_is_polled(bus):
+    sensor = sensor_on(bus, bme280.BME280_OSAMPLE_4, bme280.BME280_OSAMPLE_4, bme280.BME280_OSAMPLE_4)
+    typ, max_ = sensor.measurement_time()
+    bus.slowdown = 1.1
+    bus.reset_counts()
+    sensor.read_raw_data()
+    started, duration = bus.conversion
+    assert duration > typ
+    assert bus.status_reads > 1
+    assert bus.data_read_at - started >= duration
+
+
+def test_timeout_is_measured_from_the_trigger(bus):
+    sensor = sensor_on(bus, bme280.BME280_OSAMPLE_16, bme280.BME280_OSAMPLE_16, bme280.BME280_OSAMPLE_16)
+    typ, max_ = sensor.measurement_time()
+    bus.slowdown = 10
+    with pytest.raises(OSError):
+        sensor.read_raw_data()
+
+    started, duration = bus.conversion
+    poll_us = 9 * 4 * 1000000 // bus.freq
+    assert max_ < bus.clock.now - started <= max_ + poll_us
+
+
+def test_skipped_channels_shorten_the_wait(bus):
+    full = sensor_on(bus, bme280.BME280_OSAMPLE_1, bme280.BME280_OSAMPLE_1, bme280.BME280_OSAMPLE_1)
+    temperature_only = sensor_on(bus, bme280.BME280_OSAMPLE_1, SKIP, SKIP)
+    assert temperature_only.measurement_time()[0] < full.measurement_time()[0]
+
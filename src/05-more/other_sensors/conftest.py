@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The drivers and simulators import each other by module name, as on the board
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
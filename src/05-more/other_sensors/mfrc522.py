@@ -1,5 +1,29 @@
-from machine import Pin, SPI
+from machine import Pin, SPI, idle
 from os import uname
+from array import array
+import utime
+
+try:
+	import uasyncio as asyncio
+except ImportError:
+	asyncio = None
+
+_crc_a_table = None
+
+
+def crc_a_table():
+	# Lookup table for the ISO14443A CRC_A (reflected 0x1021, i.e. 0x8408),
+	# built on first use and shared by all readers.
+
+	global _crc_a_table
+	if _crc_a_table is None:
+		_crc_a_table = array('H', bytearray(512))
+		for i in range(256):
+			crc = i
+			for _ in range(8):
+				crc = (crc >> 1) ^ 0x8408 if crc & 0x01 else crc >> 1
+			_crc_a_table[i] = crc
+	return _crc_a_table
 
 
 class MFRC522:
@@ -7,13 +31,14 @@ class MFRC522:
 	OK = 0
 	NOTAGERR = 1
 	ERR = 2
+	COLLERR = 3
 
 	REQIDL = 0x26
 	REQALL = 0x52
 	AUTHENT1A = 0x60
 	AUTHENT1B = 0x61
 
-	def __init__(self, sck, mosi, miso, rst, cs):
+	def __init__(self, sck, mosi, miso, rst, cs, irq=None, soft_crc=False):
 
 		self.sck = Pin(sck, Pin.OUT)
 		self.mosi = Pin(mosi, Pin.OUT)
@@ -24,6 +49,24 @@ class MFRC522:
 		self.rst.value(0)
 		self.cs.value(1)
 
+		# Preallocated buffers, so register and FIFO access doesn't allocate.
+		# _tx holds the FIFO write address followed by the frame to send,
+		# _fifo_rx receives burst reads of the FIFO (address echo + data).
+		self._regbuf = bytearray(2)
+		self._regrx = bytearray(2)
+		self._tx = bytearray(19)
+		self._tx[0] = 0x09 << 1
+		self._tx_mv = memoryview(self._tx)
+		self._fifo_tx = bytearray(b'\x92' * 65)
+		self._fifo_tx_mv = memoryview(self._fifo_tx)
+		self._fifo_rx = bytearray(65)
+		self._fifo_rx_mv = memoryview(self._fifo_rx)
+
+		# With soft_crc, frame CRCs are computed locally from a lookup table
+		# instead of on the chip's coprocessor, which costs a FIFO transfer,
+		# several register accesses and a poll loop over SPI per frame.
+		self._crc_table = crc_a_table() if soft_crc else None
+
 		board = uname()[0]
 
 		if board == 'WiPy' or board == 'LoPy' or board == 'FiPy':
@@ -35,24 +78,42 @@ class MFRC522:
 		else:
 			raise RuntimeError("Unsupported platform")
 
+		# Optional IRQ pin. The chip drives it low when an enabled interrupt
+		# is pending, so waits for the card don't have to poll over SPI.
+		self.irq = None
+		if irq is not None:
+			self.irq = Pin(irq, Pin.IN)
+			self._irq_fired = False
+			self._irq_flag = asyncio.ThreadSafeFlag() if asyncio else None
+			self.irq.irq(trigger=Pin.IRQ_FALLING, handler=self._irq_handler)
+
 		self.rst.value(1)
 		self.init()
 
+	def _irq_handler(self, pin):
+		self._irq_fired = True
+		if self._irq_flag:
+			self._irq_flag.set()
+
 	def _wreg(self, reg, val):
 
+		buf = self._regbuf
+		buf[0] = (reg << 1) & 0x7e
+		buf[1] = val & 0xff
 		self.cs.value(0)
-		self.spi.write(b'%c' % int(0xff & ((reg << 1) & 0x7e)))
-		self.spi.write(b'%c' % int(0xff & val))
+		self.spi.write(buf)
 		self.cs.value(1)
 
 	def _rreg(self, reg):
 
+		buf = self._regbuf
+		buf[0] = ((reg << 1) & 0x7e) | 0x80
+		buf[1] = 0
 		self.cs.value(0)
-		self.spi.write(b'%c' % int(0xff & (((reg << 1) & 0x7e) | 0x80)))
-		val = self.spi.read(1)
+		self.spi.write_readinto(buf, self._regrx)
 		self.cs.value(1)
 
-		return val[0]
+		return self._regrx[1]
 
 	def _sflags(self, reg, mask):
 		self._wreg(reg, self._rreg(reg) | mask)
@@ -60,11 +121,26 @@ class MFRC522:
 	def _cflags(self, reg, mask):
 		self._wreg(reg, self._rreg(reg) & (~mask))
 
-	def _tocard(self, cmd, send):
+	def _wfifo(self, n):
+		# Writes the first n bytes of the frame in _tx to the FIFO, in one burst.
+		self.cs.value(0)
+		self.spi.write(self._tx_mv[:n + 1])
+		self.cs.value(1)
 
-		recv = []
-		bits = irq_en = wait_irq = n = 0
-		stat = self.ERR
+	def _rfifo(self, n):
+		# Reads n bytes from the FIFO in one burst, returning a memoryview that
+		# is only valid until the next FIFO read.
+		self.cs.value(0)
+		self.spi.write_readinto(self._fifo_tx_mv[:n + 1], self._fifo_rx_mv[:n + 1])
+		self.cs.value(1)
+
+		return self._fifo_rx_mv[1:n + 1]
+
+	def _send(self, cmd, n):
+		# Starts sending the first n bytes of the frame in _tx, returning the
+		# interrupts that signal the command is done.
+
+		irq_en = wait_irq = 0
 
 		if cmd == 0x0E:
 			irq_en = 0x12
@@ -73,30 +149,63 @@ class MFRC522:
 			irq_en = 0x77
 			wait_irq = 0x30
 
-		self._wreg(0x02, irq_en | 0x80)
+		if self.irq:
+			# Only raise the IRQ pin for completion, errors and the timer.
+			self._wreg(0x02, wait_irq | 0x03 | 0x80)
+		else:
+			self._wreg(0x02, irq_en | 0x80)
 		self._cflags(0x04, 0x80)
+		if self.irq:
+			# Forget the edges of earlier commands (and of enabling interrupts
+			# that were still pending), so waits only wake for this one.
+			self._irq_fired = False
+			if self._irq_flag:
+				self._irq_flag.clear()
 		self._sflags(0x0A, 0x80)
 		self._wreg(0x01, 0x00)
 
-		for c in send:
-			self._wreg(0x09, c)
+		self._wfifo(n)
 		self._wreg(0x01, cmd)
 
 		if cmd == 0x0C:
 			self._sflags(0x0D, 0x80)
 
-		i = 2000
-		while True:
+		return irq_en, wait_irq
+
+	def _wait(self, wait_irq):
+		# Waits for the command to finish or the chip's timer to expire.
+		# Returns the interrupt flags, or None if neither happened in time.
+
+		if self.irq:
+			# Sleep until the next interrupt (the IRQ pin's, or the system
+			# tick) instead of spinning, and check the pin's edge was seen.
+			deadline = utime.ticks_add(utime.ticks_ms(), 50)
+			while not self._irq_fired and self.irq.value():
+				if utime.ticks_diff(deadline, utime.ticks_ms()) <= 0:
+					return None
+				idle()
+			return self._rreg(0x04)
+
+		for _ in range(2000):
 			n = self._rreg(0x04)
-			i -= 1
-			if ~((i != 0) and ~(n & 0x01) and ~(n & wait_irq)):
-				break
+			if n & 0x01 or n & wait_irq:
+				return n
+		return None
+
+	def _result(self, cmd, irq_en, n):
+
+		recv = self._fifo_rx_mv[1:1]
+		bits = 0
+		stat = self.ERR
 
 		self._cflags(0x0D, 0x80)
 
-		if i:
-			if (self._rreg(0x06) & 0x1B) == 0x00:
-				stat = self.OK
+		if n is not None:
+			err = self._rreg(0x06) & 0x1B
+			# A bit collision (several tags answering) still delivers the bits
+			# received before it, which anticollision needs.
+			if err == 0x00 or (err == 0x08 and cmd == 0x0C):
+				stat = self.COLLERR if err else self.OK
 
 				if n & irq_en & 0x01:
 					stat = self.NOTAGERR
@@ -113,31 +222,47 @@ class MFRC522:
 					elif n > 16:
 						n = 16
 
-					for _ in range(n):
-						recv.append(self._rreg(0x09))
+					recv = self._rfifo(n)
 			else:
 				stat = self.ERR
 
 		return stat, recv, bits
 
-	def _crc(self, data):
+	def _tocard(self, cmd, n):
+		# Sends the first n bytes of the frame in _tx.
+
+		irq_en, wait_irq = self._send(cmd, n)
+		return self._result(cmd, irq_en, self._wait(wait_irq))
+
+	def _crc(self, n):
+		# Appends the CRC of the first n bytes of the frame in _tx to it.
+
+		tx = self._tx
+		table = self._crc_table
+		if table:
+			crc = 0x6363
+			for i in range(1, n + 1):
+				crc = (crc >> 8) ^ table[(crc ^ tx[i]) & 0xFF]
+			tx[n + 1] = crc & 0xFF
+			tx[n + 2] = crc >> 8
+			return
 
 		self._cflags(0x05, 0x04)
 		self._sflags(0x0A, 0x80)
 
-		for c in data:
-			self._wreg(0x09, c)
+		self._wfifo(n)
 
 		self._wreg(0x01, 0x03)
 
 		i = 0xFF
 		while True:
-			n = self._rreg(0x05)
+			m = self._rreg(0x05)
 			i -= 1
-			if not ((i != 0) and not (n & 0x04)):
+			if not ((i != 0) and not (m & 0x04)):
 				break
 
-		return [self._rreg(0x22), self._rreg(0x21)]
+		tx[n + 1] = self._rreg(0x22)
+		tx[n + 2] = self._rreg(0x21)
 
 	def init(self):
 
@@ -148,6 +273,9 @@ class MFRC522:
 		self._wreg(0x2C, 0)
 		self._wreg(0x15, 0x40)
 		self._wreg(0x11, 0x3D)
+		if self.irq:
+			# Drive the IRQ pin push-pull rather than open drain.
+			self._wreg(0x03, 0x80)
 		self.antenna_on()
 
 	def reset(self):
@@ -163,20 +291,48 @@ class MFRC522:
 	def request(self, mode):
 
 		self._wreg(0x0D, 0x07)
-		(stat, recv, bits) = self._tocard(0x0C, [mode])
+		self._tx[1] = mode
+		(stat, recv, bits) = self._tocard(0x0C, 1)
 
 		if (stat != self.OK) | (bits != 0x10):
 			stat = self.ERR
 
 		return stat, bits
 
+	async def wait_for_card(self, mode=REQIDL, interval_ms=100):
+		# Waits until a card is in the field, without a polling loop. Needs
+		# the irq pin. A request is sent every interval_ms, and the task sleeps
+		# on the IRQ pin until the card answers or the chip's timer expires,
+		# so other tasks run in the meantime. Returns (stat, bits) like
+		# request() once a card answered. Raises ValueError without an irq
+		# pin (or asyncio); use request() in a loop then.
+
+		if self.irq is None or asyncio is None:
+			raise ValueError("wait_for_card() needs the irq pin and asyncio")
+
+		while True:
+			self._wreg(0x0D, 0x07)
+			self._tx[1] = mode
+			irq_en, wait_irq = self._send(0x0C, 1)
+			try:
+				await asyncio.wait_for_ms(self._irq_flag.wait(), 50)
+			except asyncio.TimeoutError:
+				pass
+			(stat, recv, bits) = self._result(0x0C, irq_en, self._rreg(0x04))
+			if stat == self.OK and bits == 0x10:
+				return stat, bits
+			await asyncio.sleep_ms(interval_ms)
+
 	def anticoll(self):
+		# Returns a copy of the UID, since it is used across later transactions.
 
 		ser_chk = 0
-		ser = [0x93, 0x20]
+		tx = self._tx
+		tx[1] = 0x93
+		tx[2] = 0x20
 
 		self._wreg(0x0D, 0x00)
-		(stat, recv, bits) = self._tocard(0x0C, ser)
+		(stat, recv, bits) = self._tocard(0x0C, 2)
 
 		if stat == self.OK:
 			if len(recv) == 5:
@@ -187,43 +343,253 @@ class MFRC522:
 			else:
 				stat = self.ERR
 
-		return stat, recv
+		return stat, bytes(recv)
+
+	def select_uid(self):
+		# ISO14443A anticollision and select over all cascade levels, so it
+		# works with several tags in the field and with 4, 7 and 10 byte UIDs.
+		# On a collision the branch with the colliding bit set is followed, so
+		# exactly one tag ends up selected. Returns (stat, uid, sak).
+
+		tx = self._tx
+		uid = bytearray(10)
+		size = 0
+
+		for sel in (0x93, 0x95, 0x97):
+			tx[1] = sel
+			known = 0
+			while True:
+				full = known >> 3
+				last = known & 0x07
+				tx[2] = ((2 + full) << 4) | last
+				self._wreg(0x0D, (last << 4) | last)
+				self._cflags(0x0E, 0x80)
+				(stat, recv, bits) = self._tocard(0x0C, 2 + full + (1 if last else 0))
+				if (stat != self.OK and stat != self.COLLERR) or not len(recv):
+					self._wreg(0x0D, 0x00)
+					return self.ERR, None, 0
+
+				# Merge the answer into the known bits. The first byte received
+				# is aligned with the partially known byte.
+				i = 3 + full
+				if last:
+					mask = (1 << last) - 1
+					tx[i] = (tx[i] & mask) | (recv[0] & ~mask & 0xFF)
+				else:
+					tx[i] = recv[0]
+				for j in range(1, len(recv)):
+					if i + j < 8:
+						tx[i + j] = recv[j]
+
+				if stat == self.OK:
+					break
+
+				coll = self._rreg(0x0E)
+				if coll & 0x20:
+					self._wreg(0x0D, 0x00)
+					return self.ERR, None, 0
+				pos = full * 8 + ((coll & 0x1F) or 32) - 1
+				if pos < known or pos >= 32:
+					self._wreg(0x0D, 0x00)
+					return self.ERR, None, 0
+				# Take the branch of the tags with a 1 at the colliding bit.
+				tx[3 + (pos >> 3)] |= 1 << (pos & 0x07)
+				known = pos + 1
+
+			self._wreg(0x0D, 0x00)
+			if tx[3] ^ tx[4] ^ tx[5] ^ tx[6] != tx[7]:
+				return self.ERR, None, 0
+
+			tx[2] = 0x70
+			self._crc(7)
+			(stat, recv, bits) = self._tocard(0x0C, 9)
+			if stat != self.OK or bits != 0x18:
+				return self.ERR, None, 0
+			sak = recv[0]
+
+			if sak & 0x04:
+				# UID not complete, tx[3] is the cascade tag (0x88)
+				for j in range(3):
+					uid[size + j] = tx[4 + j]
+				size += 3
+			else:
+				for j in range(4):
+					uid[size + j] = tx[3 + j]
+				size += 4
+				return self.OK, bytes(uid[:size]), sak
+
+		return self.ERR, None, 0
+
+	def halt(self):
+		# Puts the selected tag in the HALT state, so it ignores REQIDL requests.
+
+		tx = self._tx
+		tx[1] = 0x50
+		tx[2] = 0x00
+		self._crc(2)
+		self._tocard(0x0C, 4)
+
+	def inventory(self, max_tags=16):
+		# Enumerates every tag in the field in one pass: selects one tag at a
+		# time, records its UID and halts it, until no more tags answer.
+		# Returns a list of (uid, sak) tuples.
+
+		tags = []
+		tx = self._tx
+		while len(tags) < max_tags:
+			self._wreg(0x0D, 0x07)
+			tx[1] = self.REQIDL
+			(stat, recv, bits) = self._tocard(0x0C, 1)
+			if stat != self.OK and stat != self.COLLERR:
+				break
+			(stat, uid, sak) = self.select_uid()
+			if stat != self.OK:
+				break
+			tags.append((uid, sak))
+			self.halt()
+
+		self._wreg(0x0D, 0x00)
+		return tags
 
 	def select_tag(self, ser):
 
-		buf = [0x93, 0x70] + ser[:5]
-		buf += self._crc(buf)
-		(stat, recv, bits) = self._tocard(0x0C, buf)
+		tx = self._tx
+		tx[1] = 0x93
+		tx[2] = 0x70
+		for i in range(5):
+			tx[3 + i] = ser[i]
+		self._crc(7)
+		(stat, recv, bits) = self._tocard(0x0C, 9)
 		return self.OK if (stat == self.OK) and (bits == 0x18) else self.ERR
 
 	def auth(self, mode, addr, sect, ser):
-		return self._tocard(0x0E, [mode, addr] + sect + ser[:4])[0]
+
+		tx = self._tx
+		tx[1] = mode
+		tx[2] = addr
+		for i in range(6):
+			tx[3 + i] = sect[i]
+		for i in range(4):
+			tx[9 + i] = ser[i]
+		return self._tocard(0x0E, 12)[0]
 
 	def stop_crypto1(self):
 		self._cflags(0x08, 0x08)
 
 	def read(self, addr):
-
-		data = [0x30, addr]
-		data += self._crc(data)
-		(stat, recv, _) = self._tocard(0x0C, data)
+		# Returns a memoryview of the block that is only valid until the next
+		# transaction with the card, copy it to keep it.
+
+		tx = self._tx
+		tx[1] = 0x30
+		tx[2] = addr
+		self._crc(2)
+		(stat, recv, _) = self._tocard(0x0C, 4)
 		return recv if stat == self.OK else None
 
 	def write(self, addr, data):
 
-		buf = [0xA0, addr]
-		buf += self._crc(buf)
-		(stat, recv, bits) = self._tocard(0x0C, buf)
+		tx = self._tx
+		tx[1] = 0xA0
+		tx[2] = addr
+		self._crc(2)
+		(stat, recv, bits) = self._tocard(0x0C, 4)
 
 		if not (stat == self.OK) or not (bits == 4) or not ((recv[0] & 0x0F) == 0x0A):
 			stat = self.ERR
 		else:
-			buf = []
 			for i in range(16):
-				buf.append(data[i])
-			buf += self._crc(buf)
-			(stat, recv, bits) = self._tocard(0x0C, buf)
+				tx[1 + i] = data[i]
+			self._crc(16)
+			(stat, recv, bits) = self._tocard(0x0C, 18)
 			if not (stat == self.OK) or not (bits == 4) or not ((recv[0] & 0x0F) == 0x0A):
 				stat = self.ERR
 
 		return stat
+
+	def select_card(self, mode=REQIDL):
+		# Runs request, anticoll and select_tag, returning the UID of the
+		# selected card, or None. The card stays selected for any number of
+		# auth/read/write calls, e.g. the sector and card operations below.
+
+		(stat, bits) = self.request(mode)
+		if stat != self.OK:
+			return None
+		(stat, uid) = self.anticoll()
+		if stat != self.OK or self.select_tag(uid) != self.OK:
+			return None
+		return uid
+
+	def read_sector(self, sector, key, uid, mode=AUTHENT1A, buf=None):
+		# Authenticates once, then reads the 4 blocks of a MIFARE Classic
+		# sector back to back into buf (64 bytes, allocated if not given).
+		# Returns buf, or None if authentication or a read fails.
+
+		if buf is None:
+			buf = bytearray(64)
+		mv = memoryview(buf)
+		block = sector * 4
+
+		if self.auth(mode, block, key, uid) != self.OK:
+			return None
+		for i in range(4):
+			data = self.read(block + i)
+			if data is None or len(data) != 16:
+				return None
+			mv[i * 16:(i + 1) * 16] = data
+		return buf
+
+	def write_sector(self, sector, data, key, uid, mode=AUTHENT1A):
+		# Authenticates once, then writes the 3 data blocks of a sector from
+		# data (the first 48 bytes, so the 64 bytes read_sector() returns can
+		# be passed back). The sector trailer (keys and access bits) is never
+		# written, nor is the manufacturer block 0 (data[0:16] is skipped for
+		# sector 0).
+
+		block = sector * 4
+		mv = memoryview(data)
+
+		if self.auth(mode, block, key, uid) != self.OK:
+			return self.ERR
+		for i in range(1 if sector == 0 else 0, 3):
+			if self.write(block + i, mv[i * 16:(i + 1) * 16]) != self.OK:
+				return self.ERR
+		return self.OK
+
+	def read_card(self, key, uid, mode=AUTHENT1A, sectors=16, buf=None):
+		# Reads every sector of the selected card (16 for a MIFARE Classic 1K)
+		# into one contiguous buffer. Returns it, or None if a sector fails.
+
+		if buf is None:
+			buf = bytearray(64 * sectors)
+		mv = memoryview(buf)
+
+		for sector in range(sectors):
+			if self.read_sector(sector, key, uid, mode, mv[sector * 64:(sector + 1) * 64]) is None:
+				self.stop_crypto1()
+				return None
+		self.stop_crypto1()
+		return buf
+
+	def write_card(self, data, key, uid, mode=AUTHENT1A, sectors=16):
+		# Writes the data blocks of every sector from data, skipping sector
+		# trailers and block 0 like write_sector(). data is either laid out
+		# like read_card() returns it, 64 bytes per sector with the trailer
+		# (which is ignored), or holds just the data blocks, 48 bytes per
+		# sector. So a card can be copied with write_card(read_card(...)).
+
+		if len(data) == 64 * sectors:
+			size = 64
+		elif len(data) == 48 * sectors:
+			size = 48
+		else:
+			raise ValueError("data must hold 64 or 48 bytes per sector")
+		mv = memoryview(data)
+		stat = self.OK
+
+		for sector in range(sectors):
+			if self.write_sector(sector, mv[sector * size:(sector + 1) * size], key, uid, mode) != self.OK:
+				stat = self.ERR
+				break
+		self.stop_crypto1()
+		return stat
@@ -0,0 +1,48 @@
+"""
+    --------------------------------------------------------------------------------------
+    mfrc522_bench.py
+    --------------------------------------------------------------------------------------
+    Compares the SPI traffic of computing frame CRCs on the MFRC522's coprocessor with
+    the table-driven software CRC_A (soft_crc=True), on the simulated reader and tag of
+    mfrc522_sim.py: selecting a card, reading all of it and writing all of it.
+
+    Runs on a computer with CPython:
+        python mfrc522_bench.py
+    --------------------------------------------------------------------------------------
+"""
+
+import mfrc522_sim
+
+SPI_BAUDRATE = 100000  # The SPI clock mfrc522.py uses on the ESP8266
+KEY = [0xFF] * 6
+
+
+def run():
+    results = {}
+    for name, soft_crc in (('coprocessor', False), ('software', True)):
+        tag = mfrc522_sim.Tag(b'\x11\x22\x33\x44')
+        reader, chip = mfrc522_sim.make([tag], soft_crc=soft_crc)
+
+        counts = []
+        uid = reader.select_card()
+        counts.append((chip.transfers, chip.transactions))
+        data = reader.read_card(KEY, uid)
+        counts.append((chip.transfers, chip.transactions))
+        assert reader.write_card(data, KEY, uid) == reader.OK
+        counts.append((chip.transfers, chip.transactions))
+        assert chip.crc_errors == 0
+
+        results[name] = bytes(data)
+        previous = (0, 0)
+        for operation, (transfers, transactions) in zip(('select', 'read card', 'write card'), counts):
+            transfers -= previous[0]
+            print('{:12} {:10}  {:6} bytes  {:5} transactions  {:6.0f} ms on the bus'.format(
+                name, operation, transfers, transactions - previous[1], transfers * 8000 / SPI_BAUDRATE))
+            previous = (transfers + previous[0], transactions)
+
+    assert results['coprocessor'] == results['software'], 'both must read the same data'
+    return results
+
+
+if __name__ == '__main__':
+    run()
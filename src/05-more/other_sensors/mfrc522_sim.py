@@ -0,0 +1,459 @@
+"""
+    --------------------------------------------------------------------------------------
+    mfrc522_sim.py
+    --------------------------------------------------------------------------------------
+    A simulated MFRC522 reader with MIFARE Classic 1K tags in its field, to test and
+    benchmark mfrc522.py on a computer with CPython instead of on the board.
+
+    The chip answers register and FIFO accesses over a fake SPI bus, which counts
+    the bytes transferred, and runs the commands the driver uses: CalcCRC,
+    Transceive, MFAuthent and SoftReset.  The tags answer REQA/WUPA, anticollision
+    and select on every cascade level (4, 7 and 10 byte UIDs, several tags at once
+    with bit collisions), HLTA, and MIFARE authenticate, read and write.  Frames with
+    a bad CRC_A are ignored like a real tag does, and counted in `crc_errors`.  The
+    Crypto1 encryption is not simulated.
+
+    The IRQ pin, if the reader has one, is low while an enabled interrupt is pending,
+    and its handler is called on each falling edge.  With `defer` set, Transceive
+    commands only complete when complete() is called, like a tag that takes a while
+    to answer.  A uasyncio made from asyncio is installed if there isn't one.
+
+    Example:
+        import mfrc522_sim
+        tag = mfrc522_sim.Tag(b'\x11\x22\x33\x44')
+        reader, chip = mfrc522_sim.make([tag])
+        uid = reader.select_card()
+        print(reader.read_card([0xFF] * 6, uid), chip.transfers)
+    --------------------------------------------------------------------------------------
+"""
+
+import asyncio
+import sys
+import time
+import types
+
+# Key A and B of a new tag, and its access bits (transport configuration)
+DEFAULT_KEY = b'\xff' * 6
+TRAILER = DEFAULT_KEY + b'\xff\x07\x80\x69' + DEFAULT_KEY
+
+ACK = 0x0A
+NAK = 0x04
+
+_chip = None
+
+
+def crc_a(data):
+    """CRC_A of ISO14443A, computed bit by bit, independently of mfrc522.py's table."""
+    crc = 0x6363
+    for b in data:
+        b ^= crc & 0xFF
+        b = (b ^ (b << 4)) & 0xFF
+        crc = ((crc >> 8) ^ (b << 8) ^ (b << 3) ^ (b >> 4)) & 0xFFFF
+    return crc
+
+
+def _bits(data, n=None):
+    # The first n bits of data, least significant bit of each byte first
+    if n is None:
+        n = len(data) * 8
+    return [(data[i >> 3] >> (i & 7)) & 1 for i in range(n)]
+
+
+def _with_crc(data):
+    crc = crc_a(data)
+    return bytes(data) + bytes((crc & 0xFF, crc >> 8))
+
+
+class Tag:
+    """A MIFARE Classic 1K tag: 16 sectors of 4 blocks of 16 bytes."""
+
+    def __init__(self, uid, mem=None):
+        self.uid = bytes(uid)
+        if mem is None:
+            mem = bytearray(1024)
+            mem[0:4] = self.uid[:4]
+            mem[4] = self.uid[0] ^ self.uid[1] ^ self.uid[2] ^ self.uid[3]
+            mem[5:8] = b'\x08\x04\x00'
+            for sector in range(16):
+                mem[sector * 64 + 48:sector * 64 + 64] = TRAILER
+        self.mem = bytearray(mem)
+
+        self.state = 'idle'
+        self.woken_from_halt = False
+        self.level = 0
+        self.sector = None
+        self.write_block = None
+
+    def cascade_levels(self):
+        # The UID as sent in each cascade level, with the cascade tag (0x88)
+        # in front of the UID bytes of all but the last level, and the BCC
+        uid = self.uid
+        if len(uid) == 4:
+            levels = [uid]
+        elif len(uid) == 7:
+            levels = [b'\x88' + uid[:3], uid[3:]]
+        else:
+            levels = [b'\x88' + uid[:3], b'\x88' + uid[3:6], uid[6:]]
+        return [cl + bytes((cl[0] ^ cl[1] ^ cl[2] ^ cl[3],)) for cl in levels]
+
+    def block(self, n):
+        data = self.mem[n * 16:(n + 1) * 16]
+        if n % 4 == 3:
+            # Key A of the sector trailer always reads as zeroes
+            data[0:6] = bytes(6)
+        return bytes(data)
+
+
+class Chip:
+    def __init__(self, tags):
+        self.tags = tags
+        self.reg = bytearray(64)
+        self.fifo = bytearray()
+        self.irq_pin = None
+        self.irq_handler = None
+        self.defer = False
+        self._deferred = False
+        self.crc_errors = 0
+        self._address = None
+        self._read = False
+        self.reset_counts()
+
+    def reset_counts(self):
+        self.transfers = 0
+        self.transactions = 0
+        self.requests = 0
+        self.collisions = 0
+
+    # SPI side: the first byte of a transaction is the address, then data is
+    # written to that register, or read from it while the next address is sent
+
+    def begin(self):
+        self.transactions += 1
+        self._address = None
+
+    def exchange(self, b):
+        self.transfers += 1
+        if self._address is None:
+            self._address = (b >> 1) & 0x3F
+            self._read = bool(b & 0x80)
+            return 0
+        if self._read:
+            value = self._read_reg(self._address)
+            self._address = (b >> 1) & 0x3F
+            return value
+        self._write_reg(self._address, b)
+        return 0
+
+    def irq_pending(self):
+        return bool(self.reg[0x04] & self.reg[0x02] & 0x7F)
+
+    def _read_reg(self, r):
+        if r == 0x09:
+            if not self.fifo:
+                return 0
+            value = self.fifo[0]
+            del self.fifo[0]
+            return value
+        if r == 0x0A:
+            return len(self.fifo)
+        return self.reg[r]
+
+    def _write_reg(self, r, v):
+        pending = self.irq_pending()
+        self._write(r, v)
+        self._edge(pending)
+
+    def _edge(self, pending):
+        if self.irq_handler and not pending and self.irq_pending():
+            self.irq_handler()
+
+    def complete(self):
+        """Completes a deferred Transceive command."""
+        if self._deferred:
+            self._deferred = False
+            pending = self.irq_pending()
+            self._transceive()
+            self._edge(pending)
+
+    def _write(self, r, v):
+        if r == 0x09:
+            self.fifo.append(v)
+        elif r == 0x0A:
+            if v & 0x80:
+                self.fifo = bytearray()
+        elif r == 0x04 or r == 0x05:
+            # Bit 7 says whether the marked interrupt bits are set or cleared
+            if v & 0x80:
+                self.reg[r] |= v & 0x7F
+            else:
+                self.reg[r] &= ~v & 0x7F
+        else:
+            self.reg[r] = v
+            if r == 0x01:
+                self._command(v)
+            elif r == 0x0D and v & 0x80 and self.reg[0x01] == 0x0C:
+                if v & 0x07 == 7:
+                    # REQA or WUPA
+                    self.requests += 1
+                if self.defer:
+                    self._deferred = True
+                else:
+                    self._transceive()
+
+    def _command(self, command):
+        if command == 0x03:
+            # CalcCRC
+            crc = crc_a(self.fifo)
+            self.fifo = bytearray()
+            self.reg[0x22] = crc & 0xFF
+            self.reg[0x21] = crc >> 8
+            self.reg[0x05] |= 0x04
+        elif command == 0x0E:
+            # MFAuthent: mode, block, key and UID
+            self._authenticate(bytes(self.fifo))
+            self.fifo = bytearray()
+        elif command == 0x0F:
+            # SoftReset
+            self.reg = bytearray(64)
+            self.fifo = bytearray()
+
+    def _authenticate(self, data):
+        self.reg[0x06] = 0
+        self.reg[0x04] |= 0x10
+        mode, block, key, uid = data[0], data[1], data[2:8], data[8:12]
+        for tag in self.tags:
+            if tag.state == 'active' and tag.uid[:4] == uid:
+                trailer = tag.mem[(block | 3) * 16:(block | 3) * 16 + 16]
+                if key == (trailer[0:6] if mode == 0x60 else trailer[10:16]):
+                    tag.sector = block // 4
+                    self.reg[0x08] |= 0x08
+                    return
+        self.reg[0x06] = 0x01
+
+    def _respond(self, answers):
+        # answers holds the bits sent back by each tag that answered, all
+        # starting at the same bit. The chip receives the bits up to the first
+        # collision, aligned to RxAlign in the first byte.
+        self.reg[0x06] = 0
+        self.reg[0x0E] = 0x20
+        if not answers:
+            # Nothing answered: the timer expires
+            self.reg[0x04] |= 0x11
+            return
+
+        align = (self.reg[0x0D] >> 4) & 0x07
+        received = []
+        for i in range(max(len(a) for a in answers)):
+            values = set(a[i] for a in answers if i < len(a))
+            if len(values) > 1:
+                self.collisions += 1
+                received.append(0)
+                self.reg[0x06] = 0x08
+                self.reg[0x0E] = (align + i + 1) & 0x1F
+                break
+            received.append(values.pop())
+
+        bits = [0] * align + received
+        fifo = bytearray((len(bits) + 7) // 8)
+        for i, bit in enumerate(bits):
+            fifo[i >> 3] |= bit << (i & 7)
+        self.fifo = fifo
+        self.reg[0x0C] = len(bits) % 8
+        self.reg[0x04] |= 0x30
+
+    def _transceive(self):
+        data = bytes(self.fifo)
+        self.fifo = bytearray()
+        last = self.reg[0x0D] & 0x07
+        nbits = len(data) * 8 - (8 - last if last else 0)
+
+        if nbits == 7:
+            # REQA, or WUPA which also wakes halted tags
+            answers = []
+            for tag in self.tags:
+                if tag.state == 'idle' or data[0] == 0x52 and tag.state == 'halt':
+                    tag.woken_from_halt = tag.state == 'halt'
+                    tag.state = 'ready'
+                    tag.level = 0
+                    answers.append(_bits(b'\x04\x00'))
+            return self._respond(answers)
+
+        if not data:
+            return self._respond([])
+        command = data[0]
+        if command in (0x93, 0x95, 0x97):
+            level = (command - 0x93) // 2
+            if data[1] != 0x70:
+                return self._anticollision(level, _bits(data, nbits)[16:])
+            if not self._check_crc(data):
+                return self._respond([])
+            return self._select(level, data[2:7])
+
+        if not self._check_crc(data):
+            return self._respond([])
+        active = [tag for tag in self.tags if tag.state == 'active']
+        if not active:
+            return self._respond([])
+        tag = active[0]
+
+        if tag.write_block is not None and len(data) == 18:
+            tag.mem[tag.write_block * 16:(tag.write_block + 1) * 16] = data[:16]
+            tag.write_block = None
+            return self._respond([_bits(bytes((ACK,)), 4)])
+        tag.write_block = None
+
+        if command == 0x50:
+            # HLTA: no answer
+            tag.state = 'halt'
+            return self._respond([])
+        if tag.sector is None or len(data) != 4 or data[1] // 4 != tag.sector:
+            return self._respond([_bits(bytes((NAK,)), 4)])
+        if command == 0x30:
+            return self._respond([_bits(_with_crc(tag.block(data[1])))])
+        if command == 0xA0 and data[1]:
+            # Block 0 holds the UID and is read only
+            tag.write_block = data[1]
+            return self._respond([_bits(bytes((ACK,)), 4)])
+        return self._respond([_bits(bytes((NAK,)), 4)])
+
+    def _check_crc(self, data):
+        if len(data) < 3 or crc_a(data[:-2]) != data[-2] | data[-1] << 8:
+            self.crc_errors += 1
+            return False
+        return True
+
+    def _anticollision(self, level, known):
+        answers = []
+        for tag in self.tags:
+            levels = tag.cascade_levels()
+            if tag.state != 'ready' or tag.level != level or level >= len(levels):
+                continue
+            bits = _bits(levels[level])
+            if bits[:len(known)] == known:
+                answers.append(bits[len(known):])
+        return self._respond(answers)
+
+    def _select(self, level, cl):
+        # Every tag whose UID has these bytes in this cascade level is selected
+        # (at the last level) or goes on to the next one, the others go back to
+        # idle, or to halt if a WUPA woke them from it
+        answers = []
+        for tag in self.tags:
+            if tag.state != 'ready' or tag.level != level:
+                continue
+            levels = tag.cascade_levels()
+            if level < len(levels) and levels[level] == cl:
+                if level == len(levels) - 1:
+                    tag.state = 'active'
+                    tag.sector = None
+                    sak = 0x08
+                else:
+                    tag.level += 1
+                    sak = 0x04
+                answers.append(_bits(_with_crc(bytes((sak,)))))
+            else:
+                tag.state = 'halt' if tag.woken_from_halt else 'idle'
+        return self._respond(answers)
+
+
+class FakeSPI:
+    # Every SPI call of the driver is one transaction, between CS low and high
+    def __init__(self, chip):
+        self.chip = chip
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def write(self, buf):
+        self.chip.begin()
+        for b in bytes(buf):
+            self.chip.exchange(b)
+
+    def write_readinto(self, write_buf, read_buf):
+        self.chip.begin()
+        for i, b in enumerate(bytes(write_buf)):
+            read_buf[i] = self.chip.exchange(b)
+
+
+class FakePin:
+    OUT = 1
+    IN = 0
+    IRQ_FALLING = 2
+
+    def __init__(self, id, mode=None, *args, **kwargs):
+        self.id = id
+        self.chip = _chip
+        self.level = 1
+
+    def value(self, v=None):
+        if v is not None:
+            self.level = v
+            return None
+        if self.chip is not None and self.id == self.chip.irq_pin:
+            return 0 if self.chip.irq_pending() else 1
+        return self.level
+
+    def irq(self, trigger=None, handler=None):
+        self.handler = handler
+        if self.chip is not None and self.id == self.chip.irq_pin:
+            self.chip.irq_handler = lambda: handler(self)
+
+
+def _ticks_ms():
+    return int(time.monotonic() * 1000)
+
+
+# The MicroPython modules the driver imports. machine may already be there from
+# another simulator in the same process.
+machine = sys.modules.setdefault('machine', types.ModuleType('machine'))
+machine.Pin = FakePin
+machine.SPI = lambda *args, **kwargs: FakeSPI(_chip)
+if not hasattr(machine, 'idle'):
+    machine.idle = lambda: None
+if 'utime' not in sys.modules:
+    sys.modules['utime'] = types.SimpleNamespace(ticks_ms=_ticks_ms, ticks_add=lambda a, b: a + b,
+                                                 ticks_diff=lambda a, b: a - b,
+                                                 sleep_ms=lambda ms: time.sleep(ms / 1000))
+
+
+class _ThreadSafeFlag:
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    def set(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+
+if 'uasyncio' not in sys.modules:
+    # All of asyncio, so that other modules that prefer uasyncio still work
+    uasyncio = types.ModuleType('uasyncio')
+    uasyncio.__dict__.update((name, getattr(asyncio, name)) for name in asyncio.__all__)
+    uasyncio.ThreadSafeFlag = _ThreadSafeFlag
+    uasyncio.TimeoutError = asyncio.TimeoutError
+    uasyncio.wait_for_ms = lambda aw, ms: asyncio.wait_for(aw, ms / 1000)
+    uasyncio.sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+    sys.modules['uasyncio'] = uasyncio
+
+
+def make(tags, irq=None, **kwargs):
+    """
+    Returns an mfrc522.MFRC522 reader (created with kwargs) connected to a
+    simulated chip with `tags` in its field, and the chip.
+    """
+    global _chip
+    _chip = Chip(tags)
+    _chip.irq_pin = irq
+
+    import mfrc522
+    # Pretend to be an ESP8266, the board the workshop uses
+    mfrc522.uname = lambda: ('esp8266',)
+    reader = mfrc522.MFRC522(sck=14, mosi=13, miso=12, rst=5, cs=4, irq=irq, **kwargs)
+    _chip.reset_counts()
+    return reader, _chip
@@ -0,0 +1,242 @@
+"""
+Tests of the MFRC522 driver's card operations on the simulated reader and tags
+of mfrc522_sim.py.
+"""
+
+import asyncio
+import random
+
+import pytest
+
+import mfrc522_sim
+
+KEY = [0xFF] * 6
+UID = b'\x11\x22\x33\x44'
+
+
+@pytest.fixture
+def card(request):
+    # A reader with one selected tag; parametrize indirectly to pass reader options
+    tag = mfrc522_sim.Tag(UID)
+    reader, chip = mfrc522_sim.make([tag], **getattr(request, 'param', {}))
+    uid = reader.select_card()
+    assert uid is not None
+    return reader, chip, tag, uid
+
+
+def pattern(size, seed):
+    return bytes((i * 7 + seed) & 0xFF for i in range(size))
+
+
+def check_data_blocks(tag, data, size):
+    # Every data block holds the data written, block 0 and the trailers are
+    # untouched
+    original = mfrc522_sim.Tag(UID).mem
+    for block in range(64):
+        written = tag.mem[block * 16:(block + 1) * 16]
+        if block == 0 or block % 4 == 3:
+            assert written == original[block * 16:(block + 1) * 16], block
+        else:
+            start = block // 4 * size + block % 4 * 16
+            assert written == data[start:start + 16], block
+
+
+def test_read_card(card):
+    reader, chip, tag, uid = card
+    data = reader.read_card(KEY, uid)
+    assert len(data) == 1024
+    for block in range(64):
+        assert data[block * 16:(block + 1) * 16] == tag.block(block), block
+    assert chip.crc_errors == 0
+
+
+def test_write_card_takes_what_read_card_returns(card):
+    reader, chip, tag, uid = card
+    data = bytearray(reader.read_card(KEY, uid))
+    # Change every block, including block 0 and the trailers, which must be
+    # left alone
+    data[:] = pattern(1024, 1)
+    assert reader.write_card(data, KEY, uid) == reader.OK
+    check_data_blocks(tag, data, 64)
+
+    # A copy of the card reads back the same, the card stays selected
+    copy = reader.read_card(KEY, uid)
+    assert reader.write_card(copy, KEY, uid) == reader.OK
+    assert reader.read_card(KEY, uid) == copy
+    assert chip.crc_errors == 0
+
+
+def test_write_card_data_blocks_only(card):
+    reader, chip, tag, uid = card
+    data = pattern(48 * 16, 2)
+    assert reader.write_card(data, KEY, uid) == reader.OK
+    check_data_blocks(tag, data, 48)
+
+
+def test_write_card_rejects_other_lengths(card):
+    reader, chip, tag, uid = card
+    for size in (0, 47 * 16, 1000, 1025):
+        with pytest.raises(ValueError):
+            reader.write_card(bytes(size), KEY, uid)
+
+
+def test_sector_round_trip(card):
+    reader, chip, tag, uid = card
+    data = pattern(64, 3)
+    assert reader.write_sector(5, data, KEY, uid) == reader.OK
+    read = reader.read_sector(5, KEY, uid)
+    assert read[:48] == data[:48]
+    assert read[48:] == tag.block(23)
+
+
+def test_wrong_key(card):
+    reader, chip, tag, uid = card
+    assert reader.read_sector(1, [0] * 6, uid) is None
+    assert reader.write_sector(1, bytes(48), [0] * 6, uid) == reader.ERR
+
+
+@pytest.mark.parametrize('card', [{'soft_crc': False}, {'soft_crc': True}], indirect=True)
+def test_crc(card):
+    reader, chip, tag, uid = card
+    for n in range(1, 17):
+        frame = bytes((i * 37 + n) & 0xFF for i in range(n))
+        reader._tx[1:1 + n] = frame
+        reader._crc(n)
+        assert reader._tx[1 + n] | reader._tx[2 + n] << 8 == mfrc522_sim.crc_a(frame)
+    assert reader.read_card(KEY, uid) is not None
+    assert chip.crc_errors == 0
+
+
+
+def test_irq_pin():
+    # Every wait in the card operations ends on the IRQ pin's edge
+    tag = mfrc522_sim.Tag(UID)
+    reader, chip = mfrc522_sim.make([tag], irq=16)
+    uid = reader.select_card()
+    assert uid is not None
+    assert reader.read_card(KEY, uid) is not None
+    assert chip.crc_errors == 0
+
+
+def test_wait_for_card_ignores_earlier_edges():
+    tag = mfrc522_sim.Tag(UID)
+    reader, chip = mfrc522_sim.make([tag], irq=16)
+    # Synchronous commands leave their completion edges behind
+    assert reader.select_card() is not None
+    reader.halt()
+
+    # The next card takes a while to answer the request
+    chip.tags = []
+    chip.defer = True
+    chip.reset_counts()
+
+    async def arrive():
+        await asyncio.sleep(0.01)
+        chip.tags.append(mfrc522_sim.Tag(UID))
+        chip.defer = False
+        chip.complete()
+
+    async def main():
+        task = asyncio.create_task(arrive())
+        result = await asyncio.wait_for(reader.wait_for_card(interval_ms=200), 2)
+        await task
+        return result
+
+    assert asyncio.run(main()) == (reader.OK, 0x10)
+    # Woken by the answer to the first request, not by an edge from before it
+    assert chip.requests == 1
+
+
+def test_irq_wait_sleeps_instead_of_polling(monkeypatch):
+    import mfrc522
+    tag = mfrc522_sim.Tag(UID)
+    reader, chip = mfrc522_sim.make([tag], irq=16)
+    chip.defer = True
+    idles = []
+
+    def idle():
+        # The tag answers while the CPU sleeps for the third time
+        idles.append(chip.transactions)
+        if len(idles) == 3:
+            chip.complete()
+
+    monkeypatch.setattr(mfrc522, 'idle', idle)
+    assert reader.request(reader.REQIDL) == (reader.OK, 0x10)
+    assert len(idles) == 3
+    # Nothing goes over SPI while waiting
+    assert idles[0] == idles[-1]
+
+
+@pytest.mark.parametrize('uid', [
+    b'\x11\x22\x33\x44',
+    b'\x04\x5A\x6B\x7C\x8D\x9E\xAF',
+    b'\x04\x5A\x6B\x7C\x8D\x9E\xAF\x10\x21\x32',
+])
+def test_select_uid_sizes(uid):
+    reader, chip = mfrc522_sim.make([mfrc522_sim.Tag(uid)])
+    assert reader.request(reader.REQIDL)[0] == reader.OK
+    assert reader.select_uid() == (reader.OK, uid, 0x08)
+
+
+def random_uids(rnd, count):
+    # UIDs of all sizes from a few shared prefixes, so they collide in the first
+    # cascade level and in the later ones
+    prefixes = [bytes(rnd.randrange(256) for _ in range(3)) for _ in range(2)]
+    uids = set()
+    while len(uids) < count:
+        size = rnd.choice((4, 7, 10))
+        uid = rnd.choice(prefixes)[:rnd.randint(0, 3)]
+        uid += bytes(rnd.randrange(256) for _ in range(size - len(uid)))
+        if size == 4 and uid[0] == 0x88:
+            continue  # the cascade tag, never the first byte of a 4 byte UID
+        uids.add(uid)
+    return sorted(uids)
+
+
+def test_inventory_collisions():
+    rnd = random.Random(1)
+    collisions = 0
+    for _ in range(100):
+        uids = random_uids(rnd, rnd.randint(2, 6))
+        reader, chip = mfrc522_sim.make([mfrc522_sim.Tag(uid) for uid in uids])
+        tags = reader.inventory()
+        assert sorted(uid for uid, sak in tags) == uids
+        assert all(sak == 0x08 for uid, sak in tags)
+        collisions += chip.collisions
+    assert collisions > 200
+
+
+def test_two_tags_differing_in_the_last_bit():
+    uids = [b'\x11\x22\x33\x44\x55\x66\x70', b'\x11\x22\x33\x44\x55\x66\x71']
+    reader, chip = mfrc522_sim.make([mfrc522_sim.Tag(uid) for uid in uids])
+    assert sorted(uid for uid, sak in reader.inventory()) == uids
+    assert chip.collisions == 1
+
+
+def test_halt_and_inventory_again():
+    uids = [b'\x11\x22\x33\x44', b'\x11\x22\x33\x45\x66\x77\x88', b'\x12\x22\x33\x44']
+    tags = [mfrc522_sim.Tag(uid) for uid in uids]
+    reader, chip = mfrc522_sim.make(tags)
+    assert len(reader.inventory()) == 3
+    assert all(tag.state == 'halt' for tag in tags)
+
+    # Halted tags ignore REQIDL, so the next pass finds nothing...
+    assert reader.inventory() == []
+    assert reader.request(reader.REQIDL)[0] != reader.OK
+
+    # ...until a WUPA wakes them, and a tag that leaves and comes back is
+    # found again
+    assert reader.request(reader.REQALL)[0] == reader.OK
+    assert reader.select_uid()[1] in uids
+    reader.halt()
+    tags[2].state = 'idle'
+    assert reader.inventory() == [(uids[2], 0x08)]
+
+
+def test_inventory_limit():
+    uids = [bytes((1, 2, 3, n)) for n in range(5)]
+    reader, chip = mfrc522_sim.make([mfrc522_sim.Tag(uid) for uid in uids])
+    first = reader.inventory(max_tags=2)
+    assert len(first) == 2
+    rest = reader.inventory()
+    assert sorted(uid for uid, sak in first + rest) == uids
@@ -0,0 +1,28 @@
+"""
+    Minimal driver for the TCA9548A 8 channel I2C multiplexer.
+
+    Lets several devices with the same I2C address share one bus, e.g. AM2320s:
+        mux = TCA9548A(i2c)
+        sensors = [AM2320(i2c, select=lambda ch=ch: mux.select(ch)) for ch in range(4)]
+"""
+
+TCA9548A_I2CADDR = 0x70
+
+
+class TCA9548A:
+
+    def __init__(self, i2c, address=TCA9548A_I2CADDR):
+        self._i2c = i2c
+        self._address = address
+        self._buf = bytearray(1)
+        self._channel = None
+
+    def select(self, channel):
+        """Connects the given channel (0 - 7) to the bus, disconnecting the others."""
+
+        if channel == self._channel:
+            return
+
+        self._buf[0] = 1 << channel
+        self._i2c.writeto(self._address, self._buf)
+        self._channel = channel
@@ -7,10 +7,19 @@
     This example was inspired by a great Random Nerd Tutorials post:
     https://randomnerdtutorials.com/esp32-esp8266-micropython-web-server/
 
+    Requests are served by webServer.py, an asyncio server that handles several
+    clients at once, and dispatched through its route table:
+        /?led=on, /?led=off     Turn the LED on or off, and return the page
+        /status                 Return the state of the LED as JSON
+        /events                 Server-Sent Events stream that pushes the state of
+                                the LED to the page whenever it changes
+
     Dependencies
     ------------
         - networkUtils.py
         - networkCredentials.py
+        - webServer.py
+        - template.py
         - index.html
 
     Parts
@@ -33,79 +42,98 @@
     --------------------------------------------------------------------------------------
 """
 
-import socket
-import machine
-import os
 import sys
 import gc
 import networkUtils
 from machine import Pin
 import secrets
+import webServer
+import template
 
 led = Pin(16, Pin.OUT)
-htmlTemplate = ''
+htmlTemplate = None
+
+# Rendered pages for each LED state, so each page is only rendered once
+pages = {}
+
+# Pushes the LED state to the browsers that have the page open
+events = webServer.EventStream()
 
 
 def htmlPage():
     """
-    Replaces the {LED_STATE} placeholder in our HTML template with the current
-    on/off state of the LED.
+    Returns our HTML page with the {LED_STATE} and {NEXT_LED_STATE} placeholders
+    filled in with the current on/off state of the LED.
     """
-    if led.value() == 1:
-        current_state = "on"
-        next_state = "off"
-    else:
-        current_state = "off"
-        next_state = "on"
+    state = led.value()
+    page = pages.get(state)
 
-    return htmlTemplate.replace("{LED_STATE}", current_state).replace("{NEXT_LED_STATE}", next_state)
+    if page is None:
+        if state == 1:
+            values = {"LED_STATE": b"on", "NEXT_LED_STATE": b"off"}
+        else:
+            values = {"LED_STATE": b"off", "NEXT_LED_STATE": b"on"}
+        page = pages[state] = htmlTemplate.render(values)
 
+    return page
+
+
+def handleIndex(request):
+    """
+    Toggles the LED as indicated by the request's led query parameter, and returns
+    the page showing its new state.
+    """
+    state = request.param(b'led')
+    if state == b'on' and not led.value():
+        print('LED ON')
+        led.on()
+        events.publish(ledStatus())
+    elif state == b'off' and led.value():
+        print('LED OFF')
+        led.off()
+        events.publish(ledStatus())
+
+    return 200, b'text/html', htmlPage()
 
-# ------ Main script execution starts here ------
 
-# Start the garbage collector
-gc.collect()
+def ledStatus():
+    return b'{"led": "on"}' if led.value() else b'{"led": "off"}'
 
-networkUtils.connect_to_network(secrets.wifi_network, secrets.wifi_password, hostname="fireant")
-print("My IP address is {}".format(networkUtils.get_station().ifconfig()[0]))
 
-# Read our HTML template from storage.
-# The HTML content contains placeholders {LED_STATE} and {NEXT_LED_STATE} that we
-# will replace with the current LED state whenever it changes.
-with open('index.html', 'r') as htmlFile:
-    htmlTemplate = htmlFile.read()
+def handleStatus(request):
+    """
+    Returns the state of the LED as JSON, for scripts that don't need the page.
+    """
+    return 200, b'application/json', ledStatus()
+
+
+def main():
+    global htmlTemplate
+
+    # Start the garbage collector
+    gc.collect()
 
-sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-sock.bind(('', 80))
-sock.listen(5)
+    networkUtils.connect_to_network(secrets.wifi_network, secrets.wifi_password, hostname="fireant")
+    print("My IP address is {}".format(networkUtils.get_station().ifconfig()[0]))
 
-# Main loop
-# Listens for incomming socket requests, and toggles the LED as indicated
-# in the request.
-while True:
+    # Read our HTML template from storage, and split it into static chunks and the
+    # {LED_STATE} and {NEXT_LED_STATE} placeholders that we fill in with the LED state.
+    htmlTemplate = template.Template.load('index.html')
+
+    # Listens for incomming requests, and serves each connection in its own task.
+    # Each open page keeps a connection for its event stream, which counts
+    # against max_streams instead of the request slots.
+    server = webServer.WebServer(max_connections=4, timeout=10, max_streams=4)
+    server.add_route(b'/', handleIndex)
+    server.add_route(b'/status', handleStatus)
+    server.add_stream(b'/events', events.subscribe)
+    events.publish(ledStatus())
     try:
-        print("Waiting")
-        connection, address = sock.accept()
-        print("Got connection from {}".format(address[0]))
-
-        request = str(connection.recv(1024))
-
-        if request.find('/?led=on') == 6:
-            print('LED ON')
-            led.on()
-        elif request.find('/?led=off') == 6:
-            print('LED OFF')
-            led.off()
-
-        response = htmlPage()
-
-        connection.send('HTTP/1.1 200 OK\n')
-        connection.send('Content-Type: text/html\n')
-        connection.send('Connection: close\n\n')
-        connection.sendall(response)
-        connection.close()
+        webServer.asyncio.run(server.serve(port=80))
     except KeyboardInterrupt:
         print('Ctrl-C pressed...exiting')
         sys.exit()
-    except:
-        pass
+
+
+# ------ Main script execution starts here ------
+main()
@@ -0,0 +1,74 @@
+"""
+    --------------------------------------------------------------------------------------
+    template.py
+    --------------------------------------------------------------------------------------
+    Precompiled HTML templates with {PLACEHOLDER} slots.
+
+    The template is split into static byte chunks and slot names once, when it is
+    loaded.  Rendering then never searches or copies the whole template: parts()
+    returns the chunks and slot values in order, ready to be written to a socket
+    one after the other, and render() joins them into a single bytes object.
+
+    Only names made of capital letters, digits and underscores count as slots, so
+    CSS and JavaScript braces in the page are left alone.
+
+    Example:
+        import template
+        page = template.Template.load('index.html')
+        body = page.render({'LED_STATE': b'on', 'NEXT_LED_STATE': b'off'})
+    --------------------------------------------------------------------------------------
+"""
+
+
+def _is_slot(name):
+    if not name:
+        return False
+    for c in name:
+        if not (c.isupper() or c.isdigit() or c == '_'):
+            return False
+    return True
+
+
+class Template:
+    def __init__(self, text):
+        self.chunks = []
+        self.slots = []
+
+        start = 0
+        pos = 0
+        while True:
+            open_ = text.find('{', pos)
+            if open_ < 0:
+                break
+            close = text.find('}', open_ + 1)
+            if close < 0:
+                break
+            name = text[open_ + 1:close]
+            if _is_slot(name):
+                self.chunks.append(text[start:open_].encode())
+                self.slots.append(name)
+                start = close + 1
+            pos = open_ + 1
+        self.chunks.append(text[start:].encode())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            return cls(f.read())
+
+    def parts(self, values):
+        """
+        Returns the static chunks with the slot values (bytes) between them, in
+        order, without copying any of them.
+        """
+        parts = []
+        chunks = self.chunks
+        slots = self.slots
+        for i in range(len(slots)):
+            parts.append(chunks[i])
+            parts.append(values[slots[i]])
+        parts.append(chunks[-1])
+        return parts
+
+    def render(self, values):
+        return b''.join(self.parts(values))
@@ -0,0 +1,417 @@
+"""
+    --------------------------------------------------------------------------------------
+    webServer.py
+    --------------------------------------------------------------------------------------
+    A small asyncio HTTP/1.1 server used by socketServer.py.
+
+    Each connection is served by its own task, so a slow or idle client doesn't hold
+    up anybody else.  Connections are kept alive between requests, closed when they
+    have been idle for `timeout` seconds or a response couldn't be sent within
+    `timeout` seconds, and at most `max_connections` are served at once (extra
+    clients get a 503 response).
+
+    Requests are parsed incrementally, in a buffer that is allocated once per
+    connection slot and reused for every request, so requests that arrive in
+    several pieces or several at once (pipelining) are handled correctly, and
+    parsing doesn't build strings.  Requests are dispatched to handlers through a
+    route table.
+
+    EventStream pushes events to browsers with Server-Sent Events: each subscriber
+    keeps its connection open, and publish() sends new data to all of them from the
+    same event loop, so clients don't need to poll.  A stream gives its connection
+    slot back once its response head is sent, so open pages don't use up the
+    slots for requests; at most `max_streams` streams are open at once.
+
+    The server only depends on asyncio, so it runs unchanged on MicroPython
+    (uasyncio) and on CPython, e.g. to test it on a computer.
+
+    Example:
+        import webServer
+
+        def hello(request):
+            name = request.param(b'name') or b'world'
+            return 200, b'text/plain', b'Hello ' + name
+
+        server = webServer.WebServer()
+        server.add_route(b'/hello', hello)
+
+        events = webServer.EventStream()
+        server.add_stream(b'/events', events.subscribe)
+        ...
+        events.publish(b'{"led": "on"}')
+
+        webServer.asyncio.run(server.serve(port=80))
+    --------------------------------------------------------------------------------------
+"""
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+REASONS = {
+    200: b'OK',
+    400: b'Bad Request',
+    404: b'Not Found',
+    503: b'Service Unavailable',
+}
+
+
+def _lower(c):
+    return c + 32 if 65 <= c <= 90 else c
+
+
+class Request:
+    """
+    An HTTP/1.1 request, parsed in place in a reusable buffer. Positions in the
+    buffer are kept instead of copies of the request's parts.
+    """
+
+    def __init__(self, size=1024):
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.length = 0
+        self.reset()
+
+    def reset(self):
+        self.scan = 0
+        self.newline = False
+        self.end = -1
+        self.method_end = 0
+        self.path_start = 0
+        self.path_end = 0
+        self.query_start = 0
+        self.query_end = 0
+        self.content_length = 0
+        self.keep_alive = True
+
+    def space(self):
+        """The free part of the buffer, to read more data into."""
+        return self.mv[self.length:]
+
+    def received(self, n):
+        self.length += n
+
+    def parse(self):
+        """
+        Returns True once a complete request (head and body) is in the buffer.
+        Can be called again after every read. Raises ValueError for requests
+        that are malformed or don't fit in the buffer.
+        """
+        if self.end >= 0:
+            return self.length >= self.end
+
+        # Look for the blank line that ends the head, where we left off
+        buf = self.buf
+        i = self.scan
+        newline = self.newline
+        while i < self.length:
+            c = buf[i]
+            i += 1
+            if c == 10:
+                if newline:
+                    break
+                newline = True
+            elif c != 13:
+                newline = False
+        else:
+            self.scan = i
+            self.newline = newline
+            if self.length == len(buf):
+                raise ValueError('request too large')
+            return False
+
+        self._parse_head(i)
+        if self.end > len(buf):
+            raise ValueError('request too large')
+        return self.length >= self.end
+
+    def _parse_head(self, head_end):
+        buf = self.buf
+
+        # Request line: METHOD SP target SP version
+        i = 0
+        while i < head_end and buf[i] != 32:
+            i += 1
+        self.method_end = i
+        self.path_start = i = i + 1
+        while i < head_end and buf[i] not in (32, 63, 13, 10):
+            i += 1
+        self.path_end = i
+        if i < head_end and buf[i] == 63:
+            self.query_start = i = i + 1
+            while i < head_end and buf[i] not in (32, 13, 10):
+                i += 1
+        else:
+            self.query_start = i
+        self.query_end = i
+        if self.method_end == 0 or self.path_end == self.path_start or buf[i] != 32:
+            raise ValueError('bad request line')
+        self.keep_alive = self._equals(i + 1, b'HTTP/1.1')
+        while buf[i] != 10:
+            i += 1
+
+        # Headers. Only the ones the server needs are looked at.
+        i += 1
+        while i < head_end:
+            start = i
+            while buf[i] != 10:
+                i += 1
+            if self._iequals(start, b'content-length:'):
+                self.content_length = int(bytes(self.mv[start + 15:i]).strip())
+                if self.content_length < 0:
+                    raise ValueError('bad content length')
+            elif self._iequals(start, b'connection:'):
+                j = start + 11
+                while buf[j] == 32:
+                    j += 1
+                if self._iequals(j, b'close'):
+                    self.keep_alive = False
+                elif self._iequals(j, b'keep-alive'):
+                    self.keep_alive = True
+            i += 1
+
+        self.end = head_end + self.content_length
+
+    def _equals(self, start, value):
+        buf = self.buf
+        if start + len(value) > self.length:
+            return False
+        for i in range(len(value)):
+            if buf[start + i] != value[i]:
+                return False
+        return True
+
+    def _iequals(self, start, value):
+        buf = self.buf
+        if start + len(value) > self.length:
+            return False
+        for i in range(len(value)):
+            if _lower(buf[start + i]) != value[i]:
+                return False
+        return True
+
+    def is_method(self, method):
+        return self.method_end == len(method) and self._equals(0, method)
+
+    def is_path(self, path):
+        return self.path_end - self.path_start == len(path) and self._equals(self.path_start, path)
+
+    def param(self, name):
+        """Returns the value of the query parameter name as bytes, or None."""
+        buf = self.buf
+        i = self.query_start
+        end = self.query_end
+        while i < end:
+            j = i
+            while j < end and buf[j] != 38:
+                j += 1
+            if j - i > len(name) and buf[i + len(name)] == 61 and self._equals(i, name):
+                return bytes(self.mv[i + len(name) + 1:j])
+            i = j + 1
+        return None
+
+    def body(self):
+        return self.mv[self.end - self.content_length:self.end]
+
+    def consume(self):
+        """Drops the request that was handled, keeping any pipelined data after it."""
+        remaining = self.length - self.end
+        if remaining > 0:
+            self.buf[:remaining] = self.buf[self.end:self.length]
+        self.length = max(remaining, 0)
+        self.reset()
+
+
+async def _readinto(reader, mv):
+    if hasattr(reader, 'readinto'):
+        return await reader.readinto(mv)
+    data = await reader.read(len(mv))
+    mv[:len(data)] = data
+    return len(data)
+
+
+class WebServer:
+    def __init__(self, max_connections=4, timeout=10, buffer_size=1024, max_streams=4):
+        # One request buffer per connection slot, reused by every connection
+        # that gets the slot
+        self.free = [Request(buffer_size) for _ in range(max_connections)]
+        self.timeout = timeout
+        self.max_streams = max_streams
+        self.streams = 0
+        self.routes = []
+
+    def add_route(self, path, handler, method=b'GET'):
+        """
+        handler(request) is called for requests to path, and returns
+        (status, content_type, body). body is bytes or a list of byte chunks.
+        """
+        self.routes.append((method, path, handler, None))
+
+    def add_stream(self, path, handler, method=b'GET', content_type=b'text/event-stream'):
+        """
+        Requests to path get a 200 response head with content_type, then the
+        coroutine handler(writer) is given the connection, and writes the body
+        for as long as it likes. The connection is closed when it returns.
+        handler must time out its own writes, and write something now and then
+        so that a client that went away is noticed.
+        """
+        self.routes.append((method, path, handler, content_type))
+
+    def find_route(self, request):
+        """Returns the handler for request, and the content type of a stream or None."""
+        for method, path, handler, stream in self.routes:
+            if request.is_path(path) and request.is_method(method):
+                return handler, stream
+        return None, None
+
+    async def serve(self, host='0.0.0.0', port=80, backlog=5):
+        """Starts listening, and serves requests until the program is stopped."""
+        await asyncio.start_server(self._serve, host, port, backlog=backlog)
+        while True:
+            await asyncio.sleep(3600)
+
+    async def _serve(self, reader, writer):
+        if not self.free:
+            try:
+                await self._respond(writer, 503, b'text/plain', b'Too many connections', False)
+            except (asyncio.TimeoutError, OSError):
+                pass
+            await self._close(writer)
+            return
+
+        request = self.free.pop()
+        request.length = 0
+        request.reset()
+        try:
+            try:
+                handler, stream = await self._requests(request, reader, writer)
+            finally:
+                # A stream doesn't need the request buffer any more
+                self.free.append(request)
+            if stream:
+                self.streams += 1
+                try:
+                    writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: %s\r\n'
+                                 b'Cache-Control: no-cache\r\nConnection: keep-alive\r\n\r\n' % stream)
+                    await asyncio.wait_for(writer.drain(), self.timeout)
+                    await handler(writer)
+                finally:
+                    self.streams -= 1
+        except asyncio.TimeoutError:
+            pass
+        except OSError as e:
+            print('Connection error: {}'.format(e))
+        finally:
+            await self._close(writer)
+
+    async def _requests(self, request, reader, writer):
+        # Serves the requests on the connection until it is to be closed, or
+        # turned into a stream: then returns the stream's handler and content type
+        while True:
+            try:
+                while not request.parse():
+                    n = await asyncio.wait_for(_readinto(reader, request.space()), self.timeout)
+                    if not n:
+                        return None, None
+                    request.received(n)
+            except ValueError:
+                await self._respond(writer, 400, b'text/plain', b'Bad request', False)
+                return None, None
+
+            handler, stream = self.find_route(request)
+            if stream:
+                if self.streams < self.max_streams:
+                    return handler, stream
+                status, content_type, body = 503, b'text/plain', b'Too many streams'
+                request.keep_alive = False
+            elif handler:
+                status, content_type, body = handler(request)
+            else:
+                status, content_type, body = 404, b'text/plain', b'Not found'
+            await self._respond(writer, status, content_type, body, request.keep_alive)
+
+            if not request.keep_alive:
+                return None, None
+            request.consume()
+
+    async def _respond(self, writer, status, content_type, body, keep_alive):
+        # body is either bytes, or a list of byte chunks (e.g. from
+        # Template.parts()) that are written out one after the other
+        if isinstance(body, list):
+            length = 0
+            for chunk in body:
+                length += len(chunk)
+        else:
+            length = len(body)
+
+        writer.write(b'HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n' % (
+            status, REASONS.get(status, b''), content_type, length,
+            b'keep-alive' if keep_alive else b'close'))
+
+        if isinstance(body, list):
+            for chunk in body:
+                writer.write(chunk)
+        else:
+            writer.write(body)
+        # A client that doesn't read its responses is dropped like an idle one
+        await asyncio.wait_for(writer.drain(), self.timeout)
+
+    async def _close(self, writer):
+        try:
+            writer.close()
+            await asyncio.wait_for(writer.wait_closed(), self.timeout)
+        except (asyncio.TimeoutError, OSError):
+            # On CPython, close() waits to send what's still buffered: drop it
+            transport = getattr(writer, 'transport', None)
+            if transport:
+                transport.abort()
+
+
+class EventStream:
+    """
+    Sends Server-Sent Events to every subscribed client. Only the latest event is
+    kept, so a client that falls behind skips straight to the current state
+    instead of queueing up old ones. A client that takes more than `timeout`
+    seconds to take an event is dropped.
+    """
+
+    def __init__(self, keepalive=15, timeout=10):
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.message = None
+        self.version = 0
+        self.changed = asyncio.Event()
+        self.clients = 0
+
+    def publish(self, data):
+        """Sends data (bytes, one line) to all the subscribers."""
+        self.message = b'data: %s\n\n' % data
+        self.version += 1
+        # Wake up every subscriber, and give the next wait a fresh event
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self, writer):
+        """Stream handler for WebServer.add_stream()."""
+        writer.write(b'retry: 2000\n\n')
+        self.clients += 1
+        sent = 0
+        try:
+            await asyncio.wait_for(writer.drain(), self.timeout)
+            while True:
+                if sent != self.version:
+                    sent = self.version
+                    writer.write(self.message)
+                else:
+                    try:
+                        await asyncio.wait_for(self.changed.wait(), self.keepalive)
+                        continue
+                    except asyncio.TimeoutError:
+                        # A comment line, so a client that went away is noticed
+                        writer.write(b':\n\n')
+                await asyncio.wait_for(writer.drain(), self.timeout)
+        except (asyncio.TimeoutError, OSError):
+            pass
+        finally:
+            self.clients -= 1
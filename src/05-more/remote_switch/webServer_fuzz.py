@@ -0,0 +1,248 @@
+"""
+    --------------------------------------------------------------------------------------
+    webServer_fuzz.py
+    --------------------------------------------------------------------------------------
+    Replays requests recorded from browsers and command line clients against
+    webServer.py's request parser and server, to check and benchmark them:
+
+      - the parser gets the recorded requests pipelined in random orders and split
+        into random pieces, and must find the same method, path, parameters, body
+        and keep-alive in each, whatever the split
+      - randomly corrupted, truncated and oversized requests must be rejected with
+        ValueError (a 400 response), never crash the parser
+      - the parser's speed on the recorded requests
+      - a local server gets the recorded requests over real connections, in random
+        pieces and pipelined, and must answer each in order
+
+    Runs on a computer with CPython:
+        python webServer_fuzz.py [trials]
+    --------------------------------------------------------------------------------------
+"""
+
+import asyncio
+import random
+import sys
+import time
+
+import webServer
+
+# Requests as sent to socketServer.py, with what the parser must find in them:
+# (request, method, path, led parameter, keep-alive, body)
+RECORDED = [
+    (b'GET /?led=on HTTP/1.1\r\n'
+     b'Host: 192.168.1.50\r\n'
+     b'Connection: keep-alive\r\n'
+     b'Upgrade-Insecure-Requests: 1\r\n'
+     b'User-Agent: Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) '
+     b'Chrome/120.0.0.0 Safari/537.36\r\n'
+     b'Accept: text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,'
+     b'image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7\r\n'
+     b'Referer: http://192.168.1.50/?led=off\r\n'
+     b'Accept-Encoding: gzip, deflate\r\n'
+     b'Accept-Language: en-US,en;q=0.9\r\n'
+     b'\r\n',
+     b'GET', b'/', b'on', True, b''),
+    (b'GET /?led=off HTTP/1.1\r\n'
+     b'Host: 192.168.1.50\r\n'
+     b'User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:121.0) Gecko/20100101 Firefox/121.0\r\n'
+     b'Accept: text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8\r\n'
+     b'Accept-Language: en-US,en;q=0.5\r\n'
+     b'Accept-Encoding: gzip, deflate\r\n'
+     b'Connection: keep-alive\r\n'
+     b'Referer: http://192.168.1.50/\r\n'
+     b'Upgrade-Insecure-Requests: 1\r\n'
+     b'\r\n',
+     b'GET', b'/', b'off', True, b''),
+    (b'GET /status HTTP/1.1\r\n'
+     b'Host: 192.168.1.50\r\n'
+     b'User-Agent: Mozilla/5.0 (Linux; Android 14) AppleWebKit/537.36 (KHTML, like Gecko) '
+     b'Chrome/120.0.0.0 Mobile Safari/537.36\r\n'
+     b'Accept: */*\r\n'
+     b'Referer: http://192.168.1.50/\r\n'
+     b'Accept-Encoding: gzip, deflate\r\n'
+     b'\r\n',
+     b'GET', b'/status', None, True, b''),
+    (b'GET /favicon.ico HTTP/1.1\r\n'
+     b'Host: 192.168.1.50\r\n'
+     b'Connection: keep-alive\r\n'
+     b'Accept: image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8\r\n'
+     b'\r\n',
+     b'GET', b'/favicon.ico', None, True, b''),
+    (b'GET /status HTTP/1.1\r\nHost: 192.168.1.50\r\nUser-Agent: curl/8.5.0\r\nAccept: */*\r\n\r\n',
+     b'GET', b'/status', None, True, b''),
+    (b'GET /?led=on HTTP/1.0\r\nHost: 192.168.1.50\r\nUser-Agent: Wget/1.21.4\r\n\r\n',
+     b'GET', b'/', b'on', False, b''),
+    (b'GET /status HTTP/1.1\r\nHost: 192.168.1.50\r\nconnection: Close\r\n\r\n',
+     b'GET', b'/status', None, False, b''),
+    (b'POST /?x=1&led=off HTTP/1.1\r\nHost: 192.168.1.50\r\n'
+     b'Content-Type: application/x-www-form-urlencoded\r\nContent-Length: 7\r\n\r\nled=off',
+     b'POST', b'/', b'off', True, b'led=off'),
+    (b'GET /status HTTP/1.1\nHost: 192.168.1.50\n\n',
+     b'GET', b'/status', None, True, b''),
+]
+
+METHODS = (b'GET', b'POST')
+PATHS = (b'/', b'/status', b'/favicon.ico')
+
+# Requests that must be rejected
+BAD = [
+    b'GET\r\n\r\n',
+    b'GET /\r\n\r\n',
+    b' / HTTP/1.1\r\n\r\n',
+    b'GET  HTTP/1.1\r\n\r\n',
+    b'GET / HTTP/1.1\r\nContent-Length: zz\r\n\r\n',
+    b'GET / HTTP/1.1\r\nContent-Length: -1\r\n\r\n',
+    b'GET / HTTP/1.1\r\nContent-Length: 5000\r\n\r\n',
+    b'GET /' + b'x' * 2000 + b' HTTP/1.1\r\n\r\n',
+]
+
+
+def _found(request):
+    method = [m for m in METHODS if request.is_method(m)]
+    path = [p for p in PATHS if request.is_path(p)]
+    return (method[0] if method else None, path[0] if path else None, request.param(b'led'),
+            request.keep_alive, bytes(request.body()))
+
+
+def parse_stream(data, rnd, size=1024, max_piece=64):
+    """Feeds data to a parser in random pieces, returning what it found in each request."""
+    request = webServer.Request(size)
+    found = []
+    pos = 0
+    while True:
+        while not request.parse():
+            if pos == len(data):
+                return found
+            n = min(rnd.randint(1, max_piece), len(data) - pos, len(request.space()))
+            request.space()[:n] = data[pos:pos + n]
+            request.received(n)
+            pos += n
+        found.append(_found(request))
+        request.consume()
+
+
+def fuzz_parser(trials, rnd):
+    for _ in range(trials):
+        sample = [rnd.choice(RECORDED) for _ in range(rnd.randint(1, 6))]
+        data = b''.join(r[0] for r in sample)
+        found = parse_stream(data, rnd, max_piece=rnd.choice((1, 7, 64, 1024)))
+        assert found == [r[1:] for r in sample], (found, sample)
+
+
+def _mutate(data, rnd):
+    data = bytearray(data)
+    for _ in range(rnd.randint(1, 4)):
+        kind = rnd.randrange(4)
+        i = rnd.randrange(len(data) + 1)
+        if kind == 0 and i < len(data):
+            data[i] = rnd.randrange(256)
+        elif kind == 1:
+            data[i:i] = bytes(rnd.choice((b' ', b'\r', b'\n', b'?', b'&', b'=', b':', b'\x00', b'\xff')))
+        elif kind == 2:
+            del data[i:i + rnd.randint(1, 20)]
+        else:
+            data[i:i] = rnd.choice(RECORDED)[0][:rnd.randint(1, 60)]
+    return bytes(data)
+
+
+def fuzz_malformed(trials, rnd):
+    for data in BAD:
+        try:
+            parse_stream(data + b'\r\n\r\n', rnd, size=1024)
+        except ValueError:
+            continue
+        raise AssertionError('accepted {!r}'.format(data))
+
+    rejected = 0
+    for _ in range(trials):
+        data = _mutate(rnd.choice(RECORDED)[0], rnd)
+        try:
+            parse_stream(data, rnd, size=rnd.choice((256, 1024)))
+        except ValueError:
+            rejected += 1
+    return rejected
+
+
+def bench_parser(rounds=2000):
+    request = webServer.Request(1024)
+    total = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for data in RECORDED:
+            data = data[0]
+            request.space()[:len(data)] = data
+            request.received(len(data))
+            assert request.parse()
+            request.param(b'led')
+            request.consume()
+            total += 1
+    return total / (time.perf_counter() - start)
+
+
+async def replay_server(connections, rnd):
+    def page(request):
+        return 200, b'text/html', b'led ' + (request.param(b'led') or b'-')
+
+    def status(request):
+        return 200, b'application/json', b'{"led": "off"}'
+
+    server = webServer.WebServer(max_connections=connections, timeout=5)
+    server.add_route(b'/', page)
+    server.add_route(b'/', page, method=b'POST')
+    server.add_route(b'/status', status)
+    listener = await asyncio.start_server(server._serve, '127.0.0.1', 0)
+    port = listener.sockets[0].getsockname()[1]
+
+    async def client():
+        # Keep-alive requests, then one that closes the connection
+        sample = [r for r in (rnd.choice(RECORDED) for _ in range(rnd.randint(1, 8))) if r[4]]
+        sample.append(RECORDED[6])
+        data = b''.join(r[0] for r in sample)
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        pos = 0
+        while pos < len(data):
+            n = rnd.randint(1, 200)
+            writer.write(data[pos:pos + n])
+            await writer.drain()
+            pos += n
+            await asyncio.sleep(0)
+        responses = await reader.read()
+        writer.close()
+
+        # One answer per request, in order
+        expected = []
+        for r in sample:
+            if r[2] == b'/':
+                expected.append(b'200 OK' + b'led ' + (r[3] or b'-'))
+            elif r[2] == b'/status':
+                expected.append(b'200 OK{"led": "off"}')
+            else:
+                expected.append(b'404 Not FoundNot found')
+        got = []
+        for response in responses.split(b'HTTP/1.1 ')[1:]:
+            head, body = response.split(b'\r\n\r\n', 1)
+            got.append(head.split(b'\r\n')[0] + body)
+        assert got == expected, (got, expected)
+        return len(sample)
+
+    start = time.perf_counter()
+    counts = await asyncio.gather(*[client() for _ in range(connections)])
+    elapsed = time.perf_counter() - start
+    listener.close()
+    return sum(counts), elapsed
+
+
+def run(trials=2000, seed=0):
+    rnd = random.Random(seed)
+    fuzz_parser(trials, rnd)
+    print('parser: {} random pipelines of recorded requests in random pieces, all parsed'.format(trials))
+    rejected = fuzz_malformed(trials, rnd)
+    print('parser: {} corrupted requests, {} rejected with ValueError, no crashes'.format(trials, rejected))
+    print('parser: {:.0f} recorded requests/s'.format(bench_parser()))
+    requests, elapsed = asyncio.run(replay_server(20, rnd))
+    print('server: {} requests pipelined over 20 connections in {:.0f} ms, all answered in order'.format(
+        requests, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,108 @@
+"""
+    --------------------------------------------------------------------------------------
+    webServer_loadtest.py
+    --------------------------------------------------------------------------------------
+    An asyncio load client for webServer.py: a number of concurrent clients send
+    requests over kept-alive connections, one after the other, and the requests per
+    second and latency percentiles are reported.
+
+    Without a host it starts a local webServer.py on a free port and loads that, to
+    measure the server on a computer.  Given the address of a board running
+    socketServer.py, it loads the real thing (keep the client count within the
+    board's max_connections, or the extra clients only get 503 responses).
+
+    Runs on a computer with CPython:
+        python webServer_loadtest.py [host [port [path [clients [requests]]]]]
+        python webServer_loadtest.py 192.168.1.50 80 /status 4 100
+    --------------------------------------------------------------------------------------
+"""
+
+import asyncio
+import sys
+import time
+
+import webServer
+
+CLIENTS = 20
+REQUESTS = 50
+
+
+async def _response(reader):
+    # Returns the status code and body of the next response on the connection
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.split(b'\r\n')
+    status = int(lines[0].split()[1])
+    length = 0
+    for line in lines[1:]:
+        if line[:15].lower() == b'content-length:':
+            length = int(line[15:])
+    body = await reader.readexactly(length) if length else b''
+    return status, body
+
+
+async def _client(host, port, path, requests, latencies, statuses):
+    reader, writer = await asyncio.open_connection(host, port)
+    request = b'GET ' + path + b' HTTP/1.1\r\nHost: ' + host.encode() + b'\r\n\r\n'
+    try:
+        for _ in range(requests):
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status, body = await _response(reader)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 503:
+                # The server closes connections it can't take
+                break
+    except (OSError, asyncio.IncompleteReadError):
+        statuses['errors'] = statuses.get('errors', 0) + 1
+    writer.close()
+
+
+def _percentile(values, p):
+    return values[min(len(values) - 1, len(values) * p // 100)]
+
+
+async def load(host, port, path=b'/status', clients=CLIENTS, requests=REQUESTS):
+    """Runs the load test, prints the results and returns (requests/s, p99 in ms)."""
+    latencies = []
+    statuses = {}
+    start = time.perf_counter()
+    await asyncio.gather(*[_client(host, port, path, requests, latencies, statuses) for _ in range(clients)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    rate = len(latencies) / elapsed
+    p99 = _percentile(latencies, 99) * 1000 if latencies else 0
+    print('{} clients x {} requests of {}: {:.0f} requests/s'.format(clients, requests, path.decode(), rate))
+    if latencies:
+        print('latency  p50 {:.2f} ms  p90 {:.2f} ms  p99 {:.2f} ms  max {:.2f} ms'.format(
+            _percentile(latencies, 50) * 1000, _percentile(latencies, 90) * 1000, p99, latencies[-1] * 1000))
+    print('responses', statuses)
+    return rate, p99
+
+
+async def local(path=b'/status', clients=CLIENTS, requests=REQUESTS):
+    # A server like socketServer.py's, with room for every client
+    def status(request):
+        return 200, b'application/json', b'{"led": "off"}'
+
+    server = webServer.WebServer(max_connections=clients, timeout=5)
+    server.add_route(b'/status', status)
+    listener = await asyncio.start_server(server._serve, '127.0.0.1', 0)
+    port = listener.sockets[0].getsockname()[1]
+    try:
+        return await load('127.0.0.1', port, path, clients, requests)
+    finally:
+        listener.close()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args:
+        asyncio.run(load(args[0], int(args[1]) if len(args) > 1 else 80,
+                         args[2].encode() if len(args) > 2 else b'/status',
+                         int(args[3]) if len(args) > 3 else CLIENTS,
+                         int(args[4]) if len(args) > 4 else REQUESTS))
+    else:
+        asyncio.run(local())
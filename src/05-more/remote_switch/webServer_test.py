@@ -0,0 +1,174 @@
+"""
+Checks webServer.py over real connections to a local server: idle clients and
+clients that stop reading are dropped after the timeout, a full pool answers 503,
+every connection gives its request slot back when it ends, and event streams
+give theirs back as soon as they start, within their own limit.
+"""
+
+import asyncio
+import time
+
+import webServer
+
+HELLO = b'GET /hello HTTP/1.1\r\nHost: test\r\n\r\n'
+BIG = b'GET /big HTTP/1.1\r\nHost: test\r\n\r\n'
+EVENTS = b'GET /events HTTP/1.1\r\nHost: test\r\n\r\n'
+
+
+def hello(request):
+    return 200, b'text/plain', b'hello'
+
+
+def big(request):
+    # More than the socket buffers of both ends can hold
+    return 200, b'application/octet-stream', [b'x' * (1 << 20)] * 64
+
+
+async def start(events=None, **kw):
+    server = webServer.WebServer(**kw)
+    server.add_route(b'/hello', hello)
+    server.add_route(b'/big', big)
+    if events:
+        server.add_stream(b'/events', events.subscribe)
+    listener = await asyncio.start_server(server._serve, '127.0.0.1', 0)
+    return server, listener, listener.sockets[0].getsockname()[1]
+
+
+async def status(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    return int(head.split()[1])
+
+
+async def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        await asyncio.sleep(0.01)
+
+
+def test_idle_connection_is_closed():
+    async def main():
+        server, listener, port = await start(timeout=0.2)
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        start_time = time.monotonic()
+        writer.write(HELLO[:10])
+        assert await asyncio.wait_for(reader.read(), 5) == b''
+        assert 0.2 <= time.monotonic() - start_time < 2
+        await wait_until(lambda: len(server.free) == 4)
+        writer.close()
+        listener.close()
+    asyncio.run(main())
+
+
+def test_client_that_stops_reading_is_dropped():
+    async def main():
+        server, listener, port = await start(max_connections=1, timeout=0.2)
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(BIG)
+        # The response can't be sent while we don't read, so the slot must
+        # come back after the timeout
+        await asyncio.sleep(0.1)
+        assert not server.free
+        await wait_until(lambda: len(server.free) == 1)
+        writer.close()
+
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(HELLO)
+        assert await asyncio.wait_for(status(reader), 5) == 200
+        writer.close()
+        listener.close()
+    asyncio.run(main())
+
+
+def test_full_pool_answers_503():
+    async def main():
+        server, listener, port = await start(max_connections=2, timeout=5)
+        held = []
+        for _ in range(2):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(HELLO)
+            assert await status(reader) == 200
+            held.append((reader, writer))
+        assert not server.free
+
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(HELLO)
+        assert await asyncio.wait_for(status(reader), 5) == 503
+        assert (await asyncio.wait_for(reader.read(), 5)).endswith(b'Too many connections')
+        writer.close()
+        for _, writer in held:
+            writer.close()
+        listener.close()
+    asyncio.run(main())
+
+
+def test_slots_are_released():
+    async def main():
+        server, listener, port = await start(max_connections=2, timeout=5)
+        for _ in range(5):
+            # Closed by the client, by Connection: close, and by a bad request
+            for request in (HELLO, HELLO.replace(b'\r\n\r\n', b'\r\nConnection: close\r\n\r\n'),
+                            b'GET\r\n\r\n'):
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.write(request)
+                assert await status(reader) in (200, 400)
+                writer.close()
+                await wait_until(lambda: len(server.free) == 2)
+        listener.close()
+    asyncio.run(main())
+
+
+async def subscribe(port):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(EVENTS)
+    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 5)
+    assert b'text/event-stream' in head
+    assert await asyncio.wait_for(reader.readuntil(b'\n\n'), 5) == b'retry: 2000\n\n'
+    return reader, writer
+
+
+def test_streams_release_their_slot():
+    async def main():
+        # Closed clients are noticed at the next keepalive
+        events = webServer.EventStream(keepalive=0.1)
+        server, listener, port = await start(events, max_connections=1, max_streams=2, timeout=5)
+        streams = [await subscribe(port) for _ in range(2)]
+        await wait_until(lambda: events.clients == 2)
+        assert server.streams == 2 and len(server.free) == 1
+
+        # Requests still get the slot, and another stream gets a 503
+        for request, expected in ((HELLO, 200), (EVENTS, 503), (HELLO, 200)):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(request)
+            assert await asyncio.wait_for(status(reader), 5) == expected
+            writer.close()
+            await wait_until(lambda: len(server.free) == 1)
+
+        events.publish(b'{"led": "on"}')
+        for reader, writer in streams:
+            assert await asyncio.wait_for(reader.readuntil(b'\n\n'), 5) == b'data: {"led": "on"}\n\n'
+            writer.close()
+        await wait_until(lambda: server.streams == 0 and events.clients == 0)
+        listener.close()
+    asyncio.run(main())
+
+
+def test_stream_that_stops_reading_is_dropped():
+    async def main():
+        events = webServer.EventStream(keepalive=0.1, timeout=0.2)
+        server, listener, port = await start(events, max_streams=1, timeout=5)
+        reader, writer = await subscribe(port)
+        await wait_until(lambda: events.clients == 1)
+        # Keepalives come while nothing is published
+        assert await asyncio.wait_for(reader.readuntil(b'\n\n'), 5) == b':\n\n'
+
+        # An event bigger than the socket buffers, that we don't read
+        events.publish(b'x' * (64 << 20))
+        await wait_until(lambda: server.streams == 0 and events.clients == 0)
+        writer.close()
+
+        reader, writer = await subscribe(port)
+        assert server.streams == 1
+        writer.close()
+        listener.close()
+    asyncio.run(main())
@@ -0,0 +1,155 @@
+"""
+    --------------------------------------------------------------------------------------
+    allowlist.py
+    --------------------------------------------------------------------------------------
+    Checks RFID card UIDs against an allowlist that is far too big to fit in RAM
+    (tens of thousands of badges), stored on flash or an SD card.
+
+    The allowlist is a file of sorted, fixed width records that is searched with a
+    binary search, reading one record at a time with seek(), so only a couple of
+    small buffers are ever allocated.  A lookup costs about log2(entries) reads,
+    i.e. 17 reads for 100,000 badges.
+
+    Optionally, build() also writes a bloom filter next to the list.  When it is
+    loaded into RAM, most UIDs that aren't in the list are rejected without touching
+    the file at all.  It takes bloom_bits / 8 bytes of RAM, so size it to the board.
+
+    The file is built once, on the board or on a regular computer, from a list of
+    UIDs (bytes objects of 4, 7 or 10 bytes):
+        import allowlist
+        allowlist.build(uids, 'badges.bin', bloom_bits=8 * len(uids))
+
+    and then used on the board:
+        import mfrc522, allowlist
+        reader = mfrc522.MFRC522(sck=14, mosi=13, miso=12, rst=5, cs=4)
+        badges = allowlist.Allowlist('/sd/badges.bin', bloom=True)
+
+        uid, allowed = allowlist.check_card(reader, badges)
+    --------------------------------------------------------------------------------------
+"""
+
+# Each record is the UID length followed by the UID, zero padded to 10 bytes
+RECORD_SIZE = 11
+
+# The bloom filter sets this many bits per UID
+BLOOM_HASHES = 3
+
+
+def _record(uid, buf):
+    buf[0] = len(uid)
+    for i in range(10):
+        buf[i + 1] = uid[i] if i < len(uid) else 0
+
+
+def _hashes(record):
+    # Two independent 22 bit hashes, for double hashing.  They are kept small
+    # so that MicroPython never needs to allocate big integers.
+    h1 = 5381
+    h2 = 0
+    for b in record:
+        h1 = ((h1 * 33) ^ b) & 0x3FFFFF
+        h2 = (h2 * 131 + b) & 0x3FFFFF
+    return h1, h2 | 1
+
+
+def build(uids, path, bloom_bits=0):
+    """
+    Writes the allowlist file for the given UIDs to path, and when bloom_bits is
+    set, a bloom filter of that many bits to path + '.bloom'.
+    """
+    records = set()
+    for uid in uids:
+        buf = bytearray(RECORD_SIZE)
+        _record(uid, buf)
+        records.add(bytes(buf))
+    records = sorted(records)
+
+    with open(path, 'wb') as f:
+        for record in records:
+            f.write(record)
+
+    if bloom_bits:
+        bloom = bytearray((bloom_bits + 7) // 8)
+        for record in records:
+            h1, h2 = _hashes(record)
+            for i in range(BLOOM_HASHES):
+                bit = (h1 + i * h2) % bloom_bits
+                bloom[bit >> 3] |= 1 << (bit & 0x07)
+
+        with open(path + '.bloom', 'wb') as f:
+            f.write(bloom)
+
+
+class Allowlist:
+    def __init__(self, path, bloom=False):
+        self.file = open(path, 'rb')
+        self.count = self.file.seek(0, 2) // RECORD_SIZE
+
+        self.key = bytearray(RECORD_SIZE)
+        self.record = bytearray(RECORD_SIZE)
+
+        # hits and misses of the bloom filter, and records read from the file
+        self.stats = [0, 0, 0]
+
+        self.bloom = None
+        if bloom:
+            with open(path + '.bloom', 'rb') as f:
+                self.bloom = f.read()
+            self.bloom_bits = len(self.bloom) * 8
+
+    def _compare(self):
+        # <0, 0 or >0 as the record read last is below, equal to or above the key
+        key = self.key
+        record = self.record
+        for i in range(RECORD_SIZE):
+            if record[i] != key[i]:
+                return record[i] - key[i]
+        return 0
+
+    def __contains__(self, uid):
+        key = self.key
+        _record(uid, key)
+
+        bloom = self.bloom
+        if bloom:
+            h1, h2 = _hashes(key)
+            for i in range(BLOOM_HASHES):
+                bit = (h1 + i * h2) % self.bloom_bits
+                if not bloom[bit >> 3] & (1 << (bit & 0x07)):
+                    self.stats[1] += 1
+                    return False
+            self.stats[0] += 1
+
+        f = self.file
+        lo = 0
+        hi = self.count - 1
+        while lo <= hi:
+            mid = (lo + hi) >> 1
+            f.seek(mid * RECORD_SIZE)
+            f.readinto(self.record)
+            self.stats[2] += 1
+            c = self._compare()
+            if c == 0:
+                return True
+            if c < 0:
+                lo = mid + 1
+            else:
+                hi = mid - 1
+        return False
+
+    def close(self):
+        self.file.close()
+
+
+def check_card(reader, allowlist):
+    """
+    Selects the card in front of the MFRC522 reader and checks it against the
+    allowlist.  Returns (uid, allowed), or (None, False) when there is no card.
+    """
+    stat, bits = reader.request(reader.REQIDL)
+    if stat != reader.OK:
+        return None, False
+    stat, uid, sak = reader.select_uid()
+    if stat != reader.OK:
+        return None, False
+    return uid, uid in allowlist
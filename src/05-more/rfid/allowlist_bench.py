@@ -0,0 +1,79 @@
+"""
+    --------------------------------------------------------------------------------------
+    allowlist_bench.py
+    --------------------------------------------------------------------------------------
+    Builds an allowlist of random badge UIDs, checks every lookup against a plain set
+    of the same UIDs, and measures the lookup latency and the records read from the
+    file per lookup, with and without the bloom filter, for badges that are in the
+    list and for badges that aren't.
+
+    generate() makes the random UIDs (4, 7 and 10 bytes, like real cards), and can be
+    used on its own to make test lists.
+
+    Runs on a computer with CPython:
+        python allowlist_bench.py [entries]
+    --------------------------------------------------------------------------------------
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+import allowlist
+
+ENTRIES = 100000
+LOOKUPS = 10000
+
+
+def generate(count, seed=0):
+    """Returns count distinct random UIDs, mostly 4 bytes long, some 7 and 10."""
+    rnd = random.Random(seed)
+    uids = set()
+    while len(uids) < count:
+        size = rnd.choice((4, 4, 4, 7, 7, 10))
+        uids.add(bytes(rnd.randrange(256) for _ in range(size)))
+    return sorted(uids)
+
+
+def _percentile(times, p):
+    times = sorted(times)
+    return times[min(len(times) - 1, len(times) * p // 100)]
+
+
+def run(entries=ENTRIES, lookups=LOOKUPS):
+    uids = generate(entries + lookups)
+    rnd = random.Random(1)
+    rnd.shuffle(uids)
+    listed, unlisted = uids[:entries], uids[entries:]
+    expected = set(listed)
+    present = rnd.sample(listed, min(lookups, entries))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'badges.bin')
+        allowlist.build(listed, path, bloom_bits=8 * entries)
+        print('{} badges, {} bytes of list and {} bytes of bloom filter'.format(
+            entries, os.path.getsize(path), os.path.getsize(path + '.bloom')))
+
+        for bloom in (False, True):
+            badges = allowlist.Allowlist(path, bloom=bloom)
+            for name, sample in (('listed', present), ('unlisted', unlisted)):
+                badges.stats = [0, 0, 0]
+                times = []
+                for uid in sample:
+                    start = time.perf_counter()
+                    found = uid in badges
+                    times.append((time.perf_counter() - start) * 1000000)
+                    assert found == (uid in expected), uid
+                mean = sum(times) / len(times)
+                print('bloom {:3}  {:8}  mean {:6.1f} us  p99 {:6.1f} us  {:5.2f} reads per lookup'.format(
+                    'on' if bloom else 'off', name, mean, _percentile(times, 99),
+                    badges.stats[2] / len(sample)))
+                if bloom and name == 'unlisted':
+                    print('                     {:.2%} false positives'.format(badges.stats[0] / len(sample)))
+            badges.close()
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else ENTRIES)
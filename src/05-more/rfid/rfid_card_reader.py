@@ -12,13 +12,19 @@
      SPI MOSI    MOSI         D7 (GPIO13)
      SPI MISO    MISO         D6 (GPIO12)
      SPI SCK     SCK          D5 (GPIO14)
+     IRQ         IRQ          D3 (GPIO0)    (only needed by run_async)
      3.3V        3.3V         3.3V
      GND         GND          GND
 
 """
 
-import lib.mfrc522
-from os import uname
+import mfrc522
+import uasyncio as asyncio
+
+# True to wait for cards on the IRQ pin with run_async(), so other asyncio tasks
+# can run alongside. False to poll the reader with run(), which doesn't need the
+# IRQ pin to be wired.
+USE_IRQ = False
 
 
 def run():
@@ -37,16 +43,19 @@ def run():
 
                 if stat == reader.OK:
                     print("New card detected")
-                    print("  - tag type: 0x{02x}".format(tag_type)
-                    print("  - uid   : 0x{02x}{02x}{02x}{02x}".format(raw_uid[0], raw_uid[1], raw_uid[2], raw_uid[3]))
+                    print("  - tag type: 0x{:02x}".format(tag_type))
+                    print("  - uid   : 0x{:02x}{:02x}{:02x}{:02x}".format(raw_uid[0], raw_uid[1], raw_uid[2], raw_uid[3]))
                     print("")
 
                     if reader.select_tag(raw_uid) == reader.OK:
                         key = [0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]
 
-                        if reader.auth(reader.AUTHENT1A, 8, key, raw_uid) == reader.OK:
-                            print("Data: {}".format(reader.read(8))
-                            reader.stop_crypto1()
+                        # Authenticate once and read all 4 blocks of sector 2 (blocks 8 - 11)
+                        data = reader.read_sector(2, key, raw_uid)
+                        reader.stop_crypto1()
+
+                        if data:
+                            print("Data: {}".format(bytes(data)))
                         else:
                             print("Could not read tag data")
                     else:
@@ -57,4 +66,30 @@ def run():
             break
 
 
-run()
+async def read_cards(reader):
+    """
+    Same as run(), but waits for cards on the reader's IRQ pin instead of polling,
+    so other asyncio tasks (e.g. networking) keep running on the board.
+    """
+    while True:
+        await reader.wait_for_card()
+        stat, raw_uid = reader.anticoll()
+
+        if stat == reader.OK:
+            print("New card detected")
+            print("  - uid   : 0x{:02x}{:02x}{:02x}{:02x}".format(raw_uid[0], raw_uid[1], raw_uid[2], raw_uid[3]))
+            print("")
+
+        # Give the card time to leave the field before looking for the next one
+        await asyncio.sleep_ms(1000)
+
+
+def run_async():
+    reader = mfrc522.MFRC522(sck=14, mosi=13, miso=12, rst=5, cs=4, irq=0)
+    asyncio.run(read_cards(reader))
+
+
+if USE_IRQ:
+    run_async()
+else:
+    run()
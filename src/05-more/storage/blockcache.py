@@ -0,0 +1,132 @@
+"""
+Write-back block cache for block devices such as SDCard.
+
+Keeps the most recently used blocks in RAM, so FAT and directory sectors that
+are accessed over and over are only read once over SPI, and repeated writes to
+the same sector (e.g. the FAT while appending to a log file) only reach the
+card when the filesystem syncs. Blocks are evicted least recently used first.
+Size the cache to the RAM that can be spared: each block takes 512 bytes.
+
+Example usage on ESP8266:
+    import machine, sdcard, blockcache, os
+    sd = sdcard.SDCard(machine.SPI(1), machine.Pin(15))
+    cache = blockcache.BlockCache(sd, 8)
+    os.mount(cache, '/sd')
+    ...
+    os.sync()
+    print(cache.stats)
+"""
+
+from micropython import const
+
+_IOCTL_DEINIT = const(2)
+_IOCTL_SYNC = const(3)
+
+_BLOCK_SIZE = const(512)
+
+
+class BlockCache:
+    def __init__(self, device, nblocks):
+        self.device = device
+        self.nblocks = nblocks
+
+        self.buf = bytearray(nblocks * _BLOCK_SIZE)
+        self.buf_memoryview = memoryview(self.buf)
+        # block number held by each slot (-1 when free), slot of each cached
+        # block, last use of each slot and whether it needs writing back
+        self.tags = [-1] * nblocks
+        self.slots = {}
+        self.used = [0] * nblocks
+        self.dirty = bytearray(nblocks)
+        self.clock = 0
+
+        # hits, misses, blocks read from and blocks written to the device
+        self.stats = [0, 0, 0, 0]
+
+    def _slot(self, block_num, load):
+        self.clock += 1
+        slot = self.slots.get(block_num)
+        if slot is not None:
+            self.stats[0] += 1
+            self.used[slot] = self.clock
+            return slot
+
+        self.stats[1] += 1
+
+        # evict the least recently used slot
+        used = self.used
+        slot = 0
+        for i in range(1, self.nblocks):
+            if used[i] < used[slot]:
+                slot = i
+        old = self.tags[slot]
+        if old >= 0:
+            if self.dirty[slot]:
+                self._write_back(slot)
+            del self.slots[old]
+            # free until the new block is in, in case loading it fails
+            self.tags[slot] = -1
+
+        if load:
+            self.device.readblocks(block_num, self._block(slot))
+            self.stats[2] += 1
+        self.tags[slot] = block_num
+        self.slots[block_num] = slot
+        used[slot] = self.clock
+        return slot
+
+    def _block(self, slot):
+        return self.buf_memoryview[slot * _BLOCK_SIZE : (slot + 1) * _BLOCK_SIZE]
+
+    def _write_back(self, slot):
+        self.device.writeblocks(self.tags[slot], self._block(slot))
+        self.dirty[slot] = 0
+        self.stats[3] += 1
+
+    def readblocks(self, block_num, buf, offset=0):
+        mv = memoryview(buf)
+        block_num += offset // _BLOCK_SIZE
+        offset %= _BLOCK_SIZE
+        pos = 0
+        while pos < len(buf):
+            n = min(_BLOCK_SIZE - offset, len(buf) - pos)
+            slot = self._slot(block_num, True)
+            start = slot * _BLOCK_SIZE + offset
+            mv[pos : pos + n] = self.buf_memoryview[start : start + n]
+            pos += n
+            offset = 0
+            block_num += 1
+
+    def writeblocks(self, block_num, buf, offset=0):
+        mv = memoryview(buf)
+        block_num += offset // _BLOCK_SIZE
+        offset %= _BLOCK_SIZE
+        pos = 0
+        while pos < len(buf):
+            n = min(_BLOCK_SIZE - offset, len(buf) - pos)
+            # a block that is overwritten entirely doesn't need loading first
+            slot = self._slot(block_num, n < _BLOCK_SIZE)
+            start = slot * _BLOCK_SIZE + offset
+            self.buf_memoryview[start : start + n] = mv[pos : pos + n]
+            self.dirty[slot] = 1
+            pos += n
+            offset = 0
+            block_num += 1
+
+    def sync(self):
+        # write back dirty blocks in ascending block order
+        tags = self.tags
+        dirty = self.dirty
+        while True:
+            slot = -1
+            for i in range(self.nblocks):
+                if dirty[i] and (slot < 0 or tags[i] < tags[slot]):
+                    slot = i
+            if slot < 0:
+                return
+            self._write_back(slot)
+
+    def ioctl(self, op, arg):
+        if op == _IOCTL_SYNC or op == _IOCTL_DEINIT:
+            self.sync()
+        return self.device.ioctl(op, arg)
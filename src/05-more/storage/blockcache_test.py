@@ -0,0 +1,123 @@
+"""
+Checks BlockCache in front of sdcard.py on the simulated card of sdcard_sim.py,
+backed by a card image file: that it returns and writes back the same data as
+the card on its own, how much SPI traffic it saves on the access pattern of
+appending to a log file, and that it recovers from a failed read.
+"""
+
+import random
+
+import pytest
+
+import sdcard_sim
+import sdcard
+import blockcache
+
+SECTORS = 1024
+
+# Where a FAT filesystem keeps the sectors that change on every append
+FAT = 40
+DIRECTORY = 72
+DATA = 100
+
+
+def open_card(image, nblocks=None):
+    # The simulated card, behind a cache of nblocks blocks if given
+    spi = sdcard_sim.FakeSPI(image, sectors=SECTORS)
+    sd = sdcard.SDCard(spi, spi.cs)
+    spi.reset_counts()
+    return spi, (blockcache.BlockCache(sd, nblocks) if nblocks else sd)
+
+
+def append_log(device, records=200, size=60):
+    """
+    What FAT does to append `records` lines of `size` bytes to a log file, one
+    write and flush at a time: update the data block, the cluster chain in the
+    FAT and the file size in the directory entry.
+    """
+    length = 0
+    entry = bytearray(32)
+    fat = bytearray(4)
+    for i in range(records):
+        line = bytes((48 + (i + j) % 10) for j in range(size - 1)) + b'\n'
+        block, offset = divmod(length, 512)
+        device.writeblocks(DATA + block, line, offset)
+        length += size
+
+        # Cluster chain: one more entry every block
+        device.readblocks(FAT, fat, (block * 4) % 512)
+        fat[:] = (DATA + block + 1).to_bytes(4, 'little')
+        device.writeblocks(FAT, fat, (block * 4) % 512)
+
+        # Directory entry: the new file size
+        device.readblocks(DIRECTORY, entry)
+        entry[28:32] = length.to_bytes(4, 'little')
+        device.writeblocks(DIRECTORY, entry)
+    device.ioctl(3, 0)
+
+
+def test_matches_the_card(tmp_path):
+    ref = bytearray(SECTORS * 512)
+    spi, cache = open_card(str(tmp_path / 'card.img'), 5)
+    rnd = random.Random(1)
+    for _ in range(500):
+        start = rnd.randrange(64 * 512)
+        n = rnd.randrange(1, 1500)
+        block = rnd.randrange(start // 512 + 1)
+        offset = start - block * 512
+        if rnd.random() < 0.5:
+            data = bytes(rnd.randrange(256) for _ in range(n))
+            cache.writeblocks(block, data, offset)
+            ref[start : start + n] = data
+        else:
+            buf = bytearray(n)
+            cache.readblocks(block, buf, offset)
+            assert buf == ref[start : start + n]
+    cache.ioctl(3, 0)
+    for n in range(70):
+        assert spi.read_block(n) == ref[n * 512 : (n + 1) * 512], n
+    spi.close()
+
+
+def test_saves_spi_traffic(tmp_path):
+    traffic = {}
+    for nblocks in (None, 4):
+        image = tmp_path / 'card{}.img'.format(nblocks)
+        spi, device = open_card(str(image), nblocks)
+        append_log(device)
+        traffic[nblocks] = spi.bytes, spi.blocks_read + spi.blocks_written
+        spi.close()
+        traffic[nblocks, 'image'] = image.read_bytes()
+    print('without cache: {} bytes, {} blocks; with 4 blocks of cache: {} bytes, {} blocks'.format(
+        *(traffic[None] + traffic[4])))
+
+    # The same data ends up on the card
+    assert traffic[None, 'image'] == traffic[4, 'image']
+    # The cache only reads and writes each block once, instead of for every append
+    assert traffic[4][1] < traffic[None][1] / 20
+    assert traffic[4][0] < traffic[None][0] / 20
+
+
+def test_recovers_from_a_failed_read():
+    spi, cache = open_card(None, 2)
+    for n in range(4):
+        spi.write_block(n, bytes((n,)) * 512)
+    buf = bytearray(512)
+    cache.writeblocks(0, b'\xAA' * 10, 10)
+    cache.readblocks(1, buf)
+
+    # Evicting block 0 writes it back, then reading block 2 fails
+    spi.fail_reads = 1
+    with pytest.raises(OSError):
+        cache.readblocks(2, buf)
+    assert spi.read_block(0)[10:20] == b'\xAA' * 10
+
+    # The slot of the failed read is reused, and nothing reads the stale block
+    for n in (2, 3, 0, 1):
+        cache.readblocks(n, buf)
+        expected = bytearray((n,)) * 512
+        if n == 0:
+            expected[10:20] = b'\xAA' * 10
+        assert buf == expected, n
+    cache.ioctl(3, 0)
+
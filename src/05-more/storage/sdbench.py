@@ -0,0 +1,58 @@
+"""
+Measures how fast an SD card is: sequential read/write throughput and random
+single block read/write IOPS.
+
+WARNING: the benchmark writes to the last blocks of the card. Only run it on a
+card that holds nothing you need.
+
+Example usage on ESP8266:
+    import machine, sdcard, sdbench
+    sd = sdcard.SDCard(machine.SPI(1), machine.Pin(15))
+    sd.calibrate()
+    sdbench.run(sd)
+"""
+
+import time
+import urandom
+
+
+def _timed(fn, count):
+    start = time.ticks_us()
+    for i in range(count):
+        fn(i)
+    return time.ticks_diff(time.ticks_us(), start)
+
+
+def run(sd, area=64, chunk=8, ops=100):
+    """
+    Benchmarks sd using its last `area` blocks, transferring `chunk` blocks per
+    call in the sequential tests, and `ops` single block calls in the random
+    tests. Returns the results as a dict.
+    """
+    first = sd.ioctl(4, 0) - area
+    buf = bytearray(512 * chunk)
+    block = memoryview(buf)[:512]
+    for i in range(len(buf)):
+        buf[i] = i & 0xFF
+
+    rounds = area // chunk
+    results = {}
+
+    us = _timed(lambda i: sd.writeblocks(first + i * chunk, buf), rounds)
+    results["seq_write_Bps"] = rounds * len(buf) * 1000000 // us
+
+    us = _timed(lambda i: sd.readblocks(first + i * chunk, buf), rounds)
+    results["seq_read_Bps"] = rounds * len(buf) * 1000000 // us
+
+    offsets = [urandom.getrandbits(16) % area for _ in range(ops)]
+
+    us = _timed(lambda i: sd.writeblocks(first + offsets[i], block), ops)
+    results["rand_write_iops"] = ops * 1000000 // us
+
+    us = _timed(lambda i: sd.readblocks(first + offsets[i], block), ops)
+    results["rand_read_iops"] = ops * 1000000 // us
+
+    for name in sorted(results):
+        print("{}: {}".format(name, results[name]))
+
+    return results
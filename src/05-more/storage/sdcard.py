@@ -12,9 +12,18 @@ Example usage on ESP8266:
     sd = sdcard.SDCard(machine.SPI(1), machine.Pin(15))
     os.mount(sd, '/sd')
     os.listdir('/')
+The SPI clock can be calibrated to the fastest rate the card and wiring
+reliably support, and remembered for that card:
+    sd = sdcard.SDCard(machine.SPI(1), machine.Pin(15), speed_file='/sdspeed.json')
+    sd.calibrate()
+The extended block device protocol (offsets, sync, block size and erase) is
+supported too, so the card can be formatted with littlefs:
+    os.VfsLfs2.mkfs(sd)
+    os.mount(os.VfsLfs2(sd), '/sd')
 """
 
 from micropython import const
+from array import array
 import time
 
 
@@ -31,19 +40,37 @@ _TOKEN_CMD25 = const(0xFC)
 _TOKEN_STOP_TRAN = const(0xFD)
 _TOKEN_DATA = const(0xFE)
 
+_IOCTL_INIT = const(1)
+_IOCTL_DEINIT = const(2)
+_IOCTL_SYNC = const(3)
+_IOCTL_BLK_COUNT = const(4)
+_IOCTL_BLK_SIZE = const(5)
+_IOCTL_BLK_ERASE = const(6)
+
 
 class SDCard:
-    def __init__(self, spi, cs):
+    def __init__(self, spi, cs, baudrate=1320000, speed_file=None):
         self.spi = spi
         self.cs = cs
+        self.baudrate = baudrate
+        self.speed_file = speed_file
+        self.crctable = None
+        # whether the card is initialised and ready for transfers
+        self.ready = False
 
         self.cmdbuf = bytearray(6)
         self.dummybuf = bytearray(512)
         self.tokenbuf = bytearray(1)
+        self.crcbuf = bytearray(2)
+        self.sendbuf = bytearray(1)
+        self.blockbuf = None
         for i in range(512):
             self.dummybuf[i] = 0xFF
         self.dummybuf_memoryview = memoryview(self.dummybuf)
 
+        # transfer statistics: bytes read, us reading, bytes written, us writing
+        self.stats = [0, 0, 0, 0]
+
         # initialise the card
         self.init_card()
 
@@ -58,6 +85,8 @@ class SDCard:
             self.spi.init(master, baudrate=baudrate, phase=0, polarity=0)
 
     def init_card(self):
+        self.ready = False
+
         # init CS pin
         self.cs.init(self.cs.OUT, value=1)
 
@@ -104,8 +133,13 @@ class SDCard:
         if self.cmd(16, 512, 0) != 0:
             raise OSError("can't set 512 block size")
 
-        # set to high data rate now that it's initialised
-        self.init_spi(1320000)
+        # set to high data rate now that it's initialised, using the rate
+        # calibrated for this card if there is one
+        baudrate = self.baudrate
+        if self.speed_file:
+            baudrate = self.load_speeds().get(self.cid(), baudrate)
+        self.init_spi(baudrate)
+        self.ready = True
 
     def init_card_v1(self):
         for i in range(_CMD_TIMEOUT):
@@ -134,10 +168,10 @@ class SDCard:
         # create and send the command
         buf = self.cmdbuf
         buf[0] = 0x40 | cmd
-        buf[1] = arg >> 24
-        buf[2] = arg >> 16
-        buf[3] = arg >> 8
-        buf[4] = arg
+        buf[1] = (arg >> 24) & 0xFF
+        buf[2] = (arg >> 16) & 0xFF
+        buf[3] = (arg >> 8) & 0xFF
+        buf[4] = arg & 0xFF
         buf[5] = crc
         self.spi.write(buf)
 
@@ -162,7 +196,8 @@ class SDCard:
         self.spi.write(b"\xff")
         return -1
 
-    def readinto(self, buf):
+    def readinto(self, buf, check_crc=False):
+        # returns False if check_crc is set and the data CRC doesn't match
         self.cs(0)
 
         # read until start byte (0xff)
@@ -181,48 +216,141 @@ class SDCard:
         self.spi.write_readinto(mv, buf)
 
         # read checksum
-        self.spi.write(b"\xff")
-        self.spi.write(b"\xff")
+        self.spi.readinto(self.crcbuf, 0xFF)
 
         self.cs(1)
         self.spi.write(b"\xff")
 
+        if check_crc:
+            return self.crc16(buf) == (self.crcbuf[0] << 8 | self.crcbuf[1])
+        return True
+
+    def crc16(self, buf):
+        # CRC-16/XMODEM, the checksum the card sends with each data block
+        table = self.crctable
+        if table is None:
+            table = self.crctable = array("H", bytearray(512))
+            for i in range(256):
+                crc = i << 8
+                for _ in range(8):
+                    crc = ((crc << 1) ^ 0x1021 if crc & 0x8000 else crc << 1) & 0xFFFF
+                table[i] = crc
+        crc = 0
+        for b in buf:
+            crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ b]
+        return crc
+
+    def cid(self):
+        # CMD10: card identification register, as a hex string
+        if self.cmd(10, 0, 0, 0, False) != 0:
+            raise OSError(5)  # EIO
+        cid = bytearray(16)
+        self.readinto(cid)
+        return "".join("%02x" % b for b in cid)
+
+    def load_speeds(self):
+        import ujson
+
+        try:
+            with open(self.speed_file) as f:
+                return ujson.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def calibrate(self, rates=(400000, 1000000, 1320000, 4000000, 8000000, 10000000,
+                               20000000, 40000000), block=0, reads=8):
+        """
+        Steps the SPI clock through rates (slowest first), reading block
+        `reads` times at each rate and checking the data CRC. Settles on the
+        fastest rate at which every read succeeded, and saves it for this
+        card in speed_file, if one was given. Returns the chosen rate.
+        The rates start below the default clock, so flaky wiring can end up
+        slower than it. Raises OSError if no rate works.
+        """
+        cid = self.cid() if self.speed_file else None
+        buf = bytearray(512)
+        best = None
+        for rate in rates:
+            self.init_spi(rate)
+            try:
+                for _ in range(reads):
+                    if self.cmd(17, block * self.cdv, 0, release=False) != 0:
+                        self.cs(1)
+                        raise OSError(5)  # EIO
+                    if not self.readinto(buf, True):
+                        raise OSError(5)  # EIO
+            except OSError:
+                break
+            best = rate
+
+        if best is None:
+            # not even the slowest rate is reliable: keep the clock as it was,
+            # and don't remember a rate that doesn't work
+            self.init_spi(self.baudrate)
+            raise OSError(5)  # EIO
+        # init_card() sets the clock to self.baudrate again, e.g. when remounting
+        self.baudrate = best
+        self.init_spi(best)
+
+        if cid:
+            import ujson
+
+            speeds = self.load_speeds()
+            speeds[cid] = best
+            with open(self.speed_file, "w") as f:
+                ujson.dump(speeds, f)
+
+        return best
+
+    def wait_ready(self):
+        # wait for the card to stop signalling busy (0x00), polling into the
+        # preallocated token buffer
+        tokenbuf = self.tokenbuf
+        readinto = self.spi.readinto
+        readinto(tokenbuf, 0xFF)
+        while tokenbuf[0] == 0x00:
+            readinto(tokenbuf, 0xFF)
+
     def write(self, token, buf):
         self.cs(0)
 
         # send: start of block, data, checksum
-        self.spi.read(1, token)
+        self.sendbuf[0] = token
+        self.spi.write(self.sendbuf)
         self.spi.write(buf)
-        self.spi.write(b"\xff")
-        self.spi.write(b"\xff")
+        self.spi.write(b"\xff\xff")
 
         # check the response
-        if (self.spi.read(1, 0xFF)[0] & 0x1F) != 0x05:
+        self.spi.readinto(self.tokenbuf, 0xFF)
+        if (self.tokenbuf[0] & 0x1F) != 0x05:
             self.cs(1)
             self.spi.write(b"\xff")
             return
 
         # wait for write to finish
-        while self.spi.read(1, 0xFF)[0] == 0:
-            pass
+        self.wait_ready()
 
         self.cs(1)
         self.spi.write(b"\xff")
 
     def write_token(self, token):
         self.cs(0)
-        self.spi.read(1, token)
+        self.sendbuf[0] = token
+        self.spi.write(self.sendbuf)
         self.spi.write(b"\xff")
         # wait for write to finish
-        while self.spi.read(1, 0xFF)[0] == 0x00:
-            pass
+        self.wait_ready()
 
         self.cs(1)
         self.spi.write(b"\xff")
 
-    def readblocks(self, block_num, buf):
+    def readblocks(self, block_num, buf, offset=0):
+        if offset or len(buf) % 512:
+            self.partial(block_num, buf, offset, False)
+            return
         nblocks = len(buf) // 512
         assert nblocks and not len(buf) % 512, "Buffer length is invalid"
+        start = time.ticks_us()
         if nblocks == 1:
             # CMD17: set read address for single block
             if self.cmd(17, block_num * self.cdv, 0, release=False) != 0:
@@ -246,10 +374,17 @@ class SDCard:
                 nblocks -= 1
             if self.cmd(12, 0, 0xFF, skip1=True):
                 raise OSError(5)  # EIO
+        stats = self.stats
+        stats[0] += len(buf)
+        stats[1] += time.ticks_diff(time.ticks_us(), start)
 
-    def writeblocks(self, block_num, buf):
+    def writeblocks(self, block_num, buf, offset=0):
+        if offset or len(buf) % 512:
+            self.partial(block_num, buf, offset, True)
+            return
         nblocks, err = divmod(len(buf), 512)
         assert nblocks and not err, "Buffer length is invalid"
+        start = time.ticks_us()
         if nblocks == 1:
             # CMD24: set write address for single block
             if self.cmd(24, block_num * self.cdv, 0) != 0:
@@ -258,6 +393,12 @@ class SDCard:
             # send the data
             self.write(_TOKEN_DATA, buf)
         else:
+            # ACMD23: pre-erase the blocks about to be written, so the card
+            # doesn't have to erase them one by one during the transfer.
+            # This is only a hint, so a card that rejects it is not an error.
+            self.cmd(55, 0, 0)
+            self.cmd(23, nblocks, 0)
+
             # CMD25: set write address for first block
             if self.cmd(25, block_num * self.cdv, 0) != 0:
                 raise OSError(5)  # EIO
@@ -269,7 +410,62 @@ class SDCard:
                 offset += 512
                 nblocks -= 1
             self.write_token(_TOKEN_STOP_TRAN)
+        stats = self.stats
+        stats[2] += len(buf)
+        stats[3] += time.ticks_diff(time.ticks_us(), start)
+
+    def partial(self, block_num, buf, offset, write):
+        # read or write a byte range that doesn't cover whole blocks, going
+        # through a block buffer (read-modify-write for writes)
+        if self.blockbuf is None:
+            self.blockbuf = bytearray(512)
+        blockbuf = self.blockbuf
+        block_mv = memoryview(blockbuf)
+        mv = memoryview(buf)
+        block_num += offset // 512
+        offset %= 512
+        pos = 0
+        while pos < len(buf):
+            n = min(512 - offset, len(buf) - pos)
+            self.readblocks(block_num, blockbuf)
+            if write:
+                block_mv[offset : offset + n] = mv[pos : pos + n]
+                self.writeblocks(block_num, blockbuf)
+            else:
+                mv[pos : pos + n] = block_mv[offset : offset + n]
+            pos += n
+            offset = 0
+            block_num += 1
+
+    def throughput(self):
+        # average (read, write) throughput in bytes per second since the card
+        # was initialised or reset_stats() was called
+        bytes_read, read_us, bytes_written, write_us = self.stats
+        return (bytes_read * 1000000 // read_us if read_us else 0,
+                bytes_written * 1000000 // write_us if write_us else 0)
+
+    def reset_stats(self):
+        stats = self.stats
+        for i in range(4):
+            stats[i] = 0
 
     def ioctl(self, op, arg):
-        if op == 4:  # get number of blocks
+        if op == _IOCTL_INIT:
+            # the card was initialised by the constructor, so this only needs
+            # doing again after a deinit or a failed initialisation
+            if not self.ready:
+                self.init_card()
+            return 0
+        if op == _IOCTL_DEINIT:
+            self.ready = False
+            return 0
+        if op == _IOCTL_SYNC:
+            # writes complete before writeblocks returns, nothing to flush
+            return 0
+        if op == _IOCTL_BLK_COUNT:
             return self.sectors
+        if op == _IOCTL_BLK_SIZE:
+            return 512
+        if op == _IOCTL_BLK_ERASE:
+            # SD cards erase internally on write, so there's nothing to do
+            return 0
@@ -0,0 +1,320 @@
+"""
+A simulated SD card on a fake SPI bus, to test and benchmark sdcard.py and
+blockcache.py on a computer with CPython instead of on the board.
+
+The card speaks the SPI mode protocol that sdcard.py uses (CMD0, CMD8, ACMD41,
+CMD58, CMD9, CMD10, CMD16, CMD17/18/12, CMD24/25 and ACMD23) and stores its
+blocks in a bytearray, or in a file when given a path or an open file, so a card
+image can be kept between runs.
+
+The bus counts the bytes clocked and the blocks transferred, and advances a
+simulated clock by the time each byte takes at the SPI baud rate.
+time.sleep_ms(), ticks_us() and ticks_diff() are replaced with versions that use
+the same clock, so transfers can be timed exactly and take no real time.
+
+Errors can be injected: `fail_reads` makes that many of the next block reads
+fail with an error response, and data read at a baud rate above `max_baudrate`
+arrives with a flipped bit (and the CRC of the correct data), like on wiring
+that is too long for the clock.
+
+Example:
+    import sdcard_sim
+    spi = sdcard_sim.FakeSPI('card.img', sectors=2048)
+    import sdcard
+    sd = sdcard.SDCard(spi, spi.cs)
+    sd.readblocks(0, bytearray(512))
+    print(spi.bytes, spi.blocks_read, spi.clock.now)
+"""
+
+from collections import deque
+import json
+import sys
+import time
+import types
+
+# The MicroPython modules the drivers import
+if 'micropython' not in sys.modules:
+    sys.modules['micropython'] = types.SimpleNamespace(const=lambda x: x)
+if 'ujson' not in sys.modules:
+    sys.modules['ujson'] = json
+
+_BLOCK_SIZE = 512
+
+_R1_IDLE_STATE = 0x01
+_R1_ILLEGAL_COMMAND = 0x04
+_R1_COM_CRC_ERROR = 0x08
+_R1_ADDRESS_ERROR = 0x20
+
+_TOKEN_CMD25 = 0xFC
+_TOKEN_STOP_TRAN = 0xFD
+_TOKEN_DATA = 0xFE
+
+# Bytes the card holds MISO low after a write, to signal it's busy
+_BUSY = 4
+
+# CID of a made up card: manufacturer, OEM, name, revision, serial and date
+CID = bytes.fromhex('03 53 44 53 49 4d 30 31 80 12 34 56 78 01 4a 01')
+
+
+def crc16(data):
+    """CRC-16/XMODEM, computed bit by bit, independently of sdcard.py's table."""
+    crc = 0
+    for b in data:
+        crc ^= b << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021 if crc & 0x8000 else crc << 1) & 0xFFFF
+    return crc
+
+
+class Clock:
+    """Simulated time, in microseconds."""
+
+    def __init__(self):
+        self.now = 0
+
+    def sleep_us(self, us):
+        self.now += us
+
+    def sleep_ms(self, ms):
+        self.now += ms * 1000
+
+    def ticks_us(self):
+        return int(self.now)
+
+    def install(self):
+        time.sleep_us = self.sleep_us
+        time.sleep_ms = self.sleep_ms
+        time.ticks_us = self.ticks_us
+        time.ticks_diff = lambda a, b: a - b
+
+
+class FakePin:
+    OUT = 1
+
+    def __init__(self):
+        self.value = 1
+
+    def init(self, mode, value=1):
+        self.value = value
+
+    def __call__(self, value):
+        self.value = value
+
+
+class FakeSPI:
+    def __init__(self, image=None, sectors=1024):
+        # sdcard.py reads the capacity of an SDHC card in units of 1024 blocks
+        assert sectors and not sectors % 1024, 'sectors must be a multiple of 1024'
+        self.sectors = sectors
+        self.file = None
+        self.data = None
+        if image is None:
+            self.data = bytearray(sectors * _BLOCK_SIZE)
+        elif isinstance(image, (bytearray, memoryview)):
+            self.data = image
+        elif isinstance(image, str):
+            try:
+                self.file = open(image, 'r+b')
+            except OSError:
+                self.file = open(image, 'w+b')
+        else:
+            self.file = image
+
+        self.cs = FakePin()
+        self.baudrate = 0
+        self.clock = Clock()
+        self.clock.install()
+
+        self.fail_reads = 0
+        self.max_baudrate = None
+
+        # Responses waiting to be clocked out, the command being received, the
+        # block being received and what the card is doing
+        self.out = deque()
+        self.command = bytearray()
+        self.rx = bytearray()
+        self.state = 'command'
+        self.block = 0
+        self.reading = None
+        self.app_command = False
+        self.idle = True
+        self.reset_counts()
+
+    def reset_counts(self):
+        self.bytes = 0
+        self.commands = 0
+        self.blocks_read = 0
+        self.blocks_written = 0
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+    # Block storage
+
+    def read_block(self, n):
+        if self.file is None:
+            return bytes(self.data[n * _BLOCK_SIZE : (n + 1) * _BLOCK_SIZE])
+        self.file.seek(n * _BLOCK_SIZE)
+        data = self.file.read(_BLOCK_SIZE)
+        # Blocks past the end of a sparse image read as zeroes
+        return data + bytes(_BLOCK_SIZE - len(data))
+
+    def write_block(self, n, data):
+        if self.file is None:
+            self.data[n * _BLOCK_SIZE : (n + 1) * _BLOCK_SIZE] = data
+        else:
+            self.file.seek(n * _BLOCK_SIZE)
+            self.file.write(data)
+
+    # The machine.SPI interface
+
+    def init(self, baudrate=1000000, polarity=0, phase=0):
+        self.baudrate = baudrate
+
+    def write(self, buf):
+        for b in buf:
+            self._exchange(b)
+
+    def readinto(self, buf, write=0x00):
+        for i in range(len(buf)):
+            buf[i] = self._exchange(write)
+
+    def write_readinto(self, write_buf, read_buf):
+        for i in range(len(read_buf)):
+            read_buf[i] = self._exchange(write_buf[i])
+
+    # The card
+
+    def _exchange(self, b):
+        self.bytes += 1
+        self.clock.now += 8000000 / self.baudrate
+        if self.cs.value:
+            # Not selected: the card ignores the bus
+            return 0xFF
+
+        if not self.out and self.reading is not None:
+            # Multiple block read: keep sending blocks until CMD12
+            self._send_block(self.reading)
+            self.reading += 1
+        out = self.out.popleft() if self.out else 0xFF
+
+        state = self.state
+        if state == 'command':
+            if self.command or b & 0xC0 == 0x40:
+                self.command.append(b)
+                if len(self.command) == 6:
+                    self._command()
+                    self.command = bytearray()
+        elif state == 'single' or state == 'multiple':
+            # Waiting for the start of a data block
+            if b == _TOKEN_DATA and state == 'single' or b == _TOKEN_CMD25 and state == 'multiple':
+                self.rx = bytearray()
+                self.state = 'receiving ' + state
+            elif b == _TOKEN_STOP_TRAN and state == 'multiple':
+                self.out.extend((0xFF,) + (0x00,) * _BUSY)
+                self.state = 'command'
+        else:
+            self.rx.append(b)
+            if len(self.rx) == _BLOCK_SIZE + 2:
+                self._received()
+        return out
+
+    def _respond(self, r1, *extra):
+        self.out.clear()
+        self.out.append(0xFF)
+        self.out.append(r1 | (_R1_IDLE_STATE if self.idle else 0))
+        self.out.extend(extra)
+
+    def _send_block(self, n, data=None):
+        if data is None:
+            data = self.read_block(n)
+            self.blocks_read += 1
+        crc = crc16(data)
+        if self.max_baudrate and self.baudrate > self.max_baudrate:
+            data = bytearray(data)
+            data[len(data) // 2] ^= 0x10
+        self.out.append(0xFF)
+        self.out.append(_TOKEN_DATA)
+        self.out.extend(data)
+        self.out.append(crc >> 8)
+        self.out.append(crc & 0xFF)
+
+    def _address(self, arg):
+        if arg >= self.sectors:
+            self._respond(_R1_ADDRESS_ERROR)
+            return False
+        return True
+
+    def _command(self):
+        self.commands += 1
+        index = self.command[0] & 0x3F
+        arg = int.from_bytes(self.command[1:5], 'big')
+        app_command = self.app_command
+        self.app_command = False
+
+        if index == 0:
+            self.idle = True
+            self.reading = None
+            self.state = 'command'
+            self._respond(0)
+        elif index == 8:
+            self._respond(0, 0x00, 0x00, (arg >> 8) & 0x0F, arg & 0xFF)
+        elif index == 55:
+            self.app_command = True
+            self._respond(0)
+        elif index == 41 and app_command:
+            self.idle = False
+            self._respond(0)
+        elif index == 58:
+            # OCR: powered up, SDHC (block addressing), 2.7 - 3.6V
+            self._respond(0, 0xC0, 0xFF, 0x80, 0x00)
+        elif index == 9:
+            # CSD version 2.0, with the capacity in units of 1024 blocks
+            csd = bytearray(16)
+            csd[0] = 0x40
+            size = self.sectors // 1024 - 1
+            csd[7] = (size >> 16) & 0x3F
+            csd[8] = (size >> 8) & 0xFF
+            csd[9] = size & 0xFF
+            self._respond(0)
+            self._send_block(None, csd)
+        elif index == 10:
+            self._respond(0)
+            self._send_block(None, CID)
+        elif index == 16:
+            self._respond(0 if arg == _BLOCK_SIZE else _R1_ILLEGAL_COMMAND)
+        elif index == 23 and app_command:
+            self._respond(0)
+        elif index == 17 or index == 18:
+            if self.fail_reads:
+                self.fail_reads -= 1
+                self._respond(_R1_COM_CRC_ERROR)
+            elif self._address(arg):
+                self._respond(0)
+                if index == 17:
+                    self._send_block(arg)
+                else:
+                    self.reading = arg
+        elif index == 12:
+            if self.reading is not None and self.out:
+                # The block that was being sent when the card was stopped
+                self.blocks_read -= 1
+            self.reading = None
+            # A stuff byte, then the response
+            self._respond(0)
+        elif index == 24 or index == 25:
+            if self._address(arg):
+                self._respond(0)
+                self.block = arg
+                self.state = 'single' if index == 24 else 'multiple'
+        else:
+            self._respond(_R1_ILLEGAL_COMMAND)
+
+    def _received(self):
+        self.write_block(self.block, bytes(self.rx[:_BLOCK_SIZE]))
+        self.blocks_written += 1
+        self.block += 1
+        # Data accepted, then busy while the card programs the block
+        self.out.extend((0x05,) + (0x00,) * _BUSY)
+        self.state = 'command' if self.state == 'receiving single' else 'multiple'
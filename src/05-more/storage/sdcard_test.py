@@ -0,0 +1,196 @@
+"""
+Checks sdcard.py against the simulated card of sdcard_sim.py: initialisation,
+the extended block device protocol (ioctl, offsets and partial blocks), single
+and multiple block transfers and the data CRC.
+"""
+
+import random
+
+import pytest
+
+import sdcard_sim
+import sdcard
+
+SECTORS = 2048
+
+
+@pytest.fixture
+def card():
+    spi = sdcard_sim.FakeSPI(sectors=SECTORS)
+    sd = sdcard.SDCard(spi, spi.cs)
+    spi.reset_counts()
+    return spi, sd
+
+
+def test_ioctl(card):
+    spi, sd = card
+    assert sd.ioctl(4, 0) == SECTORS
+    assert sd.ioctl(5, 0) == 512
+    assert sd.ioctl(6, 10) == 0
+    assert sd.ioctl(3, 0) == 0
+
+
+def test_init_only_when_needed(card):
+    spi, sd = card
+    # Mounting calls ioctl INIT on a card the constructor already initialised
+    assert sd.ioctl(1, 0) == 0
+    assert spi.commands == 0
+
+    # After a deinit, the card is initialised again
+    assert sd.ioctl(2, 0) == 0
+    assert sd.ioctl(1, 0) == 0
+    assert spi.commands > 0
+
+
+def test_init_again_after_failure(card):
+    spi, sd = card
+    # A card that doesn't answer the block size command fails to initialise...
+    command = spi._command
+
+    def refuse_block_size():
+        if spi.command[0] & 0x3F == 16:
+            spi._respond(0x04)
+        else:
+            command()
+
+    spi._command = refuse_block_size
+    with pytest.raises(OSError):
+        sd.init_card()
+
+    # ...and is initialised again on the next ioctl INIT
+    spi._command = command
+    spi.reset_counts()
+    assert sd.ioctl(1, 0) == 0
+    assert spi.commands > 0
+    buf = bytearray(512)
+    sd.readblocks(0, buf)
+
+
+def test_whole_blocks(card):
+    spi, sd = card
+    rnd = random.Random(2)
+    data = bytes(rnd.randrange(256) for _ in range(8 * 512))
+
+    # Single block (CMD24/CMD17) and multiple block (CMD25/CMD18) transfers
+    sd.writeblocks(10, data[:512])
+    sd.writeblocks(11, data[512:])
+    assert spi.blocks_written == 8
+    assert spi.data[10 * 512 : 18 * 512] == data
+
+    buf = bytearray(8 * 512)
+    sd.readblocks(10, buf)
+    assert buf == data
+    assert spi.blocks_read == 8
+
+    one = bytearray(512)
+    sd.readblocks(17, one)
+    assert one == data[7 * 512 :]
+
+    # A multiple block write followed by a command still works
+    sd.writeblocks(20, data)
+    sd.readblocks(20, buf)
+    assert buf == data
+
+
+def test_offsets_and_partial_blocks(card):
+    spi, sd = card
+    ref = bytearray(SECTORS * 512)
+    rnd = random.Random(3)
+    for _ in range(300):
+        start = rnd.randrange(60 * 512)
+        n = rnd.randrange(1, 1500)
+        block = rnd.randrange(start // 512 + 1)
+        offset = start - block * 512
+        if rnd.random() < 0.5:
+            data = bytes(rnd.randrange(256) for _ in range(n))
+            sd.writeblocks(block, data, offset)
+            ref[start : start + n] = data
+        else:
+            buf = bytearray(n)
+            sd.readblocks(block, buf, offset)
+            assert buf == ref[start : start + n]
+    assert spi.data == ref
+
+
+def test_read_error(card):
+    spi, sd = card
+    spi.fail_reads = 1
+    with pytest.raises(OSError) as error:
+        sd.readblocks(0, bytearray(512))
+    assert error.value.args[0] == 5
+    sd.readblocks(0, bytearray(512))
+
+
+def test_crc(card):
+    spi, sd = card
+    for data in (b'123456789', bytes(512), bytes(range(256)) * 2):
+        assert sd.crc16(data) == sdcard_sim.crc16(data)
+    assert sd.crc16(b'123456789') == 0x31C3
+
+    # A block read too fast for the wiring fails the CRC check
+    spi.data[0:512] = bytes(range(256)) * 2
+    buf = bytearray(512)
+    assert sd.cmd(17, 0, 0, release=False) == 0
+    assert sd.readinto(buf, True)
+    spi.max_baudrate = spi.baudrate - 1
+    assert sd.cmd(17, 0, 0, release=False) == 0
+    assert not sd.readinto(buf, True)
+
+
+def test_calibrate(card):
+    spi, sd = card
+    spi.max_baudrate = 10000000
+    assert sd.calibrate() == 10000000
+    assert spi.baudrate == 10000000
+
+    # Initialising the card again, as remounting it does, keeps the rate
+    sd.ioctl(2, 0)
+    sd.ioctl(1, 0)
+    assert spi.baudrate == 10000000
+
+
+def test_calibrate_slower_than_the_default(card):
+    # Wiring that corrupts data above 1MHz, below the 1.32MHz default clock
+    spi, sd = card
+    spi.max_baudrate = 1000000
+    assert sd.calibrate() == 1000000
+    assert spi.baudrate == 1000000
+    buf = bytearray(512)
+    assert sd.cmd(17, 0, 0, release=False) == 0
+    assert sd.readinto(buf, True)
+
+
+def test_calibrate_fails_when_no_rate_works(card):
+    spi, sd = card
+    spi.max_baudrate = 100000
+    with pytest.raises(OSError):
+        sd.calibrate()
+    # The clock is left as it was
+    assert sd.baudrate == 1320000
+    assert spi.baudrate == 1320000
+
+
+def test_calibrate_speed_file(tmp_path):
+    speed_file = str(tmp_path / 'sdspeed.json')
+    spi = sdcard_sim.FakeSPI(sectors=SECTORS)
+    sd = sdcard.SDCard(spi, spi.cs, speed_file=speed_file)
+    spi.max_baudrate = 8000000
+    assert sd.calibrate() == 8000000
+
+    # The same card at the next boot starts at the calibrated rate
+    spi = sdcard_sim.FakeSPI(spi.data, sectors=SECTORS)
+    sd = sdcard.SDCard(spi, spi.cs, speed_file=speed_file)
+    assert spi.baudrate == 8000000
+
+
+def test_statistics(card):
+    spi, sd = card
+    sd.writeblocks(0, bytes(4 * 512))
+    sd.readblocks(0, bytearray(4 * 512))
+    read, written = sd.throughput()
+    # A little under the 1.32MHz bus clock, after the commands and tokens
+    assert 130000 < read < 165000
+    assert 130000 < written < 165000
+    sd.reset_stats()
+    assert sd.throughput() == (0, 0)
+